@@ -0,0 +1,153 @@
+"""
+Password hashing off the event loop and admission control for the auth endpoints
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+from metrics import histogram, span
+
+PASSWORD_HASH_SECONDS = histogram(
+    "deepdistill_password_hash_seconds", "Password hash/verify time, including the wait for a hasher", ("op",)
+)
+
+
+class HasherBusy(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Password hasher backlog is full")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Runs a passlib context's ``hash``/``verify`` on a small dedicated thread pool.
+
+    Argon2 (argon2-cffi) releases the GIL while hashing, so hashes run in
+    parallel with the event loop, yet never on more than ``workers`` cores at
+    once, however many logins arrive. Beyond ``max_pending`` queued or running
+    operations new ones are refused instead of queueing without bound.
+
+    Args:
+        context: passlib ``CryptContext``
+        workers: Hashing threads (0 = run inline on the event loop)
+        max_pending: Operations queued or running before ``HasherBusy`` is raised
+        retry_after: Seconds suggested to refused clients
+    """
+
+    def __init__(self, context: Any, workers: int = 2, max_pending: int = 32, retry_after: int = 1):
+        self.context = context
+        self.workers = max(0, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.retry_after = retry_after
+        self._pool = None
+
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def _run(self, op: str, fn: Callable, *args) -> Any:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy(self.retry_after)
+        self.pending += 1
+        try:
+            with span(f"password_{op}", PASSWORD_HASH_SECONDS, op=op):
+                if not self.workers:
+                    result = fn(*args)
+                else:
+                    if self._pool is None:
+                        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="argon2")
+                    result = await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run("verify", self.context.verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Too many attempts")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket per key (client IP, email, ...).
+
+    Each key may make ``burst`` attempts at once, refilled at ``per_minute``
+    per minute. Only the ``max_keys`` most recently seen keys are tracked;
+    a forgotten key simply starts again with a full bucket.
+
+    Args:
+        per_minute: Sustained attempts per key per minute (0 = unlimited)
+        burst: Bucket size (default: ``per_minute``)
+        max_keys: Keys tracked before the least recently seen are dropped
+    """
+
+    def __init__(self, per_minute: float, burst: float = 0, max_keys: int = 100_000):
+        self.rate = max(0.0, float(per_minute)) / 60.0
+        self.burst = float(burst or per_minute)
+        self.max_keys = max(1, int(max_keys))
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def hit(self, key: Hashable):
+        """Take one token for ``key`` or raise ``RateLimited`` with the wait until the next one."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if bucket[0] < 1:
+                self.rejected += 1
+                raise RateLimited(max(1, math.ceil((1 - bucket[0]) / self.rate)))
+            bucket[0] -= 1
+
+    def stats(self) -> dict:
+        return {
+            "per_minute": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "tracked_keys": len(self._buckets),
+            "rejected": self.rejected,
+        }
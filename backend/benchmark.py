@@ -0,0 +1,413 @@
+"""
+Inference benchmark suite for the DeepDistill serving stack
+
+Two parts, both written to one JSON file (tagged with the git commit) so runs
+can be diffed across commits:
+
+- ``models``: every available MODEL_CHECKPOINTS model, per backend (eager,
+  fuse/trace/compile, onnx; INT8 students run as their TorchScript export),
+  thread count and batch size: latency percentiles and images/s
+- ``e2e``: concurrent ``/api/predict`` load against the app in-process, with
+  the mock DB and the local upload stand-in (or against ``--url``)
+- ``auth``: event-loop lag of the in-process app during a login storm, with
+  Argon2 inline on the loop vs on the hasher pool, and with the auth rate limits
+
+Usage:
+    python benchmark.py --batch-sizes 1,8,32 --threads 1,4 --backends eager,fuse,onnx
+    python benchmark.py --skip-models --concurrency 1,8,32 --requests 200
+    python benchmark.py --skip-models --skip-e2e --logins 400 --login-concurrency 64
+    python benchmark.py --compare ../results/benchmark_abc1234.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def latency_summary(timings_ms: List[float], items_per_call: int = 1) -> dict:
+    """Percentiles, mean and throughput (items/s) of a list of per-call latencies."""
+    timings = np.asarray(timings_ms)
+    summary = {f"p{p}_ms": round(float(np.percentile(timings, p)), 3) for p in LATENCY_PERCENTILES}
+    summary["mean_ms"] = round(float(timings.mean()), 3)
+    summary["throughput_ips"] = round(items_per_call * 1000 / float(timings.mean()), 1)
+    summary["iterations"] = len(timings)
+    return summary
+
+
+# =============================================================================
+# MODEL BENCHMARKS
+# =============================================================================
+
+def benchmark_models(args) -> List[dict]:
+    import torch
+    import config
+    from model_registry import ModelRegistry, MODEL_CHECKPOINTS
+
+    input_size = config.IMAGE_SIZE
+    labels = [str(i) for i in range(config.NUM_CLASSES)]
+    models = [m for m in args.models.split(",") if m] or list(MODEL_CHECKPOINTS)
+    rows, seen = [], set()
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for backend in args.backends:
+            registry = ModelRegistry(
+                {k: MODEL_CHECKPOINTS[k] for k in models if k in MODEL_CHECKPOINTS},
+                labels,
+                config.NUM_CLASSES,
+                warmup_shape=(1, 3, input_size, input_size),
+                compile_mode=backend if backend not in ("eager", "onnx") else "off",
+                onnx_models=models if backend == "onnx" else (),
+                onnx_threads=threads,
+            )
+            for model_key in registry.available_models():
+                model = registry.get(model_key)
+                if model is None:
+                    continue
+                applied = registry.status()["models"][model_key]["compiled"]
+                if backend == "onnx" and applied != "onnxruntime":
+                    continue
+                if (model_key, applied, threads) in seen:
+                    continue  # e.g. an INT8 export is the same graph under every backend
+                seen.add((model_key, applied, threads))
+                for batch_size in args.batch_sizes:
+                    x = torch.randn(batch_size, 3, input_size, input_size)
+                    if getattr(model, "numpy_io", False):
+                        x = x.numpy()
+                    timings = []
+                    with torch.inference_mode():
+                        for _ in range(args.warmup):
+                            model(x)
+                        for _ in range(args.iterations):
+                            started = time.perf_counter()
+                            model(x)
+                            timings.append((time.perf_counter() - started) * 1000)
+                    row = {
+                        "model": model_key,
+                        "backend": applied,
+                        "threads": threads,
+                        "batch_size": batch_size,
+                        **latency_summary(timings, batch_size),
+                    }
+                    rows.append(row)
+                    print(
+                        f"⏱️  {model_key:<20} {applied:<12} threads={threads:<2} batch={batch_size:<3} "
+                        f"p50 {row['p50_ms']:8.2f} ms  p99 {row['p99_ms']:8.2f} ms  {row['throughput_ips']:8.1f} img/s"
+                    )
+    return rows
+
+
+# =============================================================================
+# END-TO-END /api/predict LOAD
+# =============================================================================
+
+def synthetic_jpegs(count: int, seed: int = 0, size: int = 256) -> List[bytes]:
+    """Distinct JPEGs (use a different ``seed`` per batch so the prediction cache never hits)."""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (size // 8, size // 8, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize((size, size)).save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+async def run_load(client, images: List[bytes], concurrency: int, headers: Dict[str, str]) -> dict:
+    """Send every image to /api/predict with ``concurrency`` requests in flight."""
+    queue = list(enumerate(images))
+    timings, statuses = [], {}
+
+    async def worker():
+        while queue:
+            index, data = queue.pop()
+            started = time.perf_counter()
+            response = await client.post(
+                "/api/predict", files={"file": (f"bench_{index}.jpg", data, "image/jpeg")}, headers=headers
+            )
+            timings.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    summary = latency_summary(timings)
+    summary["throughput_rps"] = round(len(timings) / elapsed, 1)
+    del summary["throughput_ips"]
+    summary["status_codes"] = {str(code): count for code, count in sorted(statuses.items())}
+    return summary
+
+
+async def start_app(args):
+    """Import and start the app in-process: mock DB and a local stand-in for Cloudinary"""
+    os.environ["MONGO_URI"] = ""  # set (not removed) so load_dotenv() keeps it empty
+    os.environ.setdefault("UPLOAD_BACKEND", "local")
+    os.environ.setdefault("LOCAL_UPLOAD_DIR", tempfile.mkdtemp(prefix="deepdistill_bench_"))
+    os.environ.setdefault("LOCAL_UPLOAD_LATENCY_MS", str(args.upload_latency_ms))
+    import main as app_module
+    await app_module.startup_event()
+    return app_module
+
+
+async def register_user(client, password: str = "benchmark") -> tuple:
+    """Create a throwaway account; returns (email, auth headers)"""
+    email = f"bench_{uuid.uuid4().hex[:12]}@example.com"
+    response = await client.post(
+        "/auth/register", json={"full_name": "Benchmark", "email": email, "password": password}
+    )
+    response.raise_for_status()
+    return email, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def benchmark_e2e(args) -> dict:
+    import httpx
+
+    if args.url:
+        transport, base_url, app_module = None, args.url.rstrip("/"), None
+    else:
+        app_module = await start_app(args)
+        transport, base_url = httpx.ASGITransport(app=app_module.app), "http://bench"
+
+    levels = []
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120) as client:
+            # /api/predict needs a user; its requests also write prediction history
+            _, headers = await register_user(client)
+            # Lazily loaded models (and compilation) are paid for before measuring
+            await run_load(client, synthetic_jpegs(args.e2e_warmup, seed=0), 1, headers)
+            for seed, concurrency in enumerate(args.concurrency, start=1):
+                images = synthetic_jpegs(args.requests, seed=seed)
+                level = {"concurrency": concurrency, **await run_load(client, images, concurrency, headers)}
+                levels.append(level)
+                print(
+                    f"🌐 concurrency={concurrency:<3} {level['throughput_rps']:7.1f} req/s  "
+                    f"p50 {level['p50_ms']:8.2f} ms  p99 {level['p99_ms']:8.2f} ms  {level['status_codes']}"
+                )
+            health = (await client.get("/api/health")).json()
+    finally:
+        if app_module is not None:
+            await app_module.shutdown_event()
+    return {
+        "target": args.url or "in-process",
+        "mode": health.get("mode"),
+        "upload_latency_ms": None if args.url else args.upload_latency_ms,
+        "levels": levels,
+        "server": {k: health.get(k) for k in ("models", "batching", "executor", "uploads")},
+    }
+
+
+# =============================================================================
+# LOGIN STORM
+# =============================================================================
+
+async def probe_loop_lag(stop: asyncio.Event, interval_s: float = 0.005) -> List[float]:
+    """How late (ms) each short sleep wakes up: time the loop spent busy with something else"""
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval_s)
+        lags.append(max(0.0, (time.perf_counter() - started - interval_s) * 1000))
+    return lags
+
+
+def lag_summary(lags_ms: List[float]) -> dict:
+    lags = np.asarray(lags_ms or [0.0])
+    summary = {f"p{p}_ms": round(float(np.percentile(lags, p)), 3) for p in LATENCY_PERCENTILES}
+    summary["max_ms"] = round(float(lags.max()), 3)
+    return summary
+
+
+async def benchmark_login_storm(args) -> dict:
+    """Event-loop lag while ``--logins`` logins arrive ``--login-concurrency`` at a time"""
+    import httpx
+    from auth_guard import PasswordHasher, RateLimiter
+
+    app_module = await start_app(args)
+    configured = (app_module.password_hasher, app_module.auth_ip_limiter, app_module.auth_email_limiter)
+    workers = app_module.PASSWORD_HASH_WORKERS
+    scenarios = []
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app_module.app), base_url="http://bench", timeout=120
+        ) as client:
+            stop = asyncio.Event()
+            probe = asyncio.create_task(probe_loop_lag(stop))
+            await asyncio.sleep(1.0)
+            stop.set()
+            idle = lag_summary(await probe)
+            print(f"🔐 idle loop lag p99 {idle['p99_ms']:.2f} ms")
+
+            for name, hasher_workers, rate_limited in (
+                ("inline", 0, False), ("pool", workers, False), ("pool+limits", workers, True)
+            ):
+                app_module.password_hasher = PasswordHasher(
+                    app_module.pwd_context, workers=hasher_workers, max_pending=args.logins + 1
+                )
+                if rate_limited:
+                    app_module.auth_ip_limiter, app_module.auth_email_limiter = configured[1:]
+                else:
+                    app_module.auth_ip_limiter = app_module.auth_email_limiter = RateLimiter(0)
+                email, _ = await register_user(client)
+                form = {"username": email, "password": "benchmark"}
+                queue, statuses = list(range(args.logins)), {}
+
+                async def worker():
+                    while queue:
+                        queue.pop()
+                        response = await client.post("/auth/login", data=form)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+                stop = asyncio.Event()
+                probe = asyncio.create_task(probe_loop_lag(stop))
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(args.login_concurrency)))
+                elapsed = time.perf_counter() - started
+                stop.set()
+                lag = lag_summary(await probe)
+                app_module.password_hasher.shutdown()
+                scenarios.append({
+                    "scenario": name,
+                    "hasher_workers": hasher_workers,
+                    "rate_limits": rate_limited,
+                    "logins": args.logins,
+                    "elapsed_s": round(elapsed, 3),
+                    "logins_per_s": round(args.logins / elapsed, 1),
+                    "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+                    "loop_lag": lag,
+                })
+                print(
+                    f"🔐 {name:<12} {args.logins / elapsed:7.1f} logins/s  loop lag p50 {lag['p50_ms']:8.2f} ms  "
+                    f"p99 {lag['p99_ms']:8.2f} ms  max {lag['max_ms']:8.2f} ms  {scenarios[-1]['status_codes']}"
+                )
+    finally:
+        app_module.password_hasher, app_module.auth_ip_limiter, app_module.auth_email_limiter = configured
+        await app_module.shutdown_event()
+    return {"concurrency": args.login_concurrency, "idle_loop_lag": idle, "scenarios": scenarios}
+
+
+# =============================================================================
+# COMPARISON
+# =============================================================================
+
+def compare(previous_path: str, current: dict):
+    """Print p50/throughput changes for rows present in both runs."""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"📈 vs {previous['meta'].get('commit')} ({previous_path})")
+
+    def keyed(rows, fields):
+        return {tuple(row[f] for f in fields): row for row in rows}
+
+    model_fields = ("model", "backend", "threads", "batch_size")
+    old_rows = keyed(previous.get("models", []), model_fields)
+    for key, row in keyed(current.get("models", []), model_fields).items():
+        if key in old_rows:
+            old = old_rows[key]
+            print(f"   {' '.join(map(str, key)):<48} p50 {100 * (row['p50_ms'] / old['p50_ms'] - 1):+6.1f}%  "
+                  f"throughput {100 * (row['throughput_ips'] / old['throughput_ips'] - 1):+6.1f}%")
+    old_levels = keyed((previous.get("e2e") or {}).get("levels", []), ("concurrency",))
+    for key, level in keyed((current.get("e2e") or {}).get("levels", []), ("concurrency",)).items():
+        if key in old_levels:
+            old = old_levels[key]
+            print(f"   e2e concurrency={key[0]:<3} p50 {100 * (level['p50_ms'] / old['p50_ms'] - 1):+6.1f}%  "
+                  f"throughput {100 * (level['throughput_rps'] / old['throughput_rps'] - 1):+6.1f}%")
+    old_scenarios = keyed((previous.get("auth") or {}).get("scenarios", []), ("scenario",))
+    for key, scenario in keyed((current.get("auth") or {}).get("scenarios", []), ("scenario",)).items():
+        if key in old_scenarios:
+            old = old_scenarios[key]
+            print(f"   login storm {key[0]:<12} loop lag p99 {old['loop_lag']['p99_ms']:.2f} -> "
+                  f"{scenario['loop_lag']['p99_ms']:.2f} ms")
+
+
+def main():
+    def int_list(value: str) -> List[int]:
+        return [int(v) for v in value.split(",") if v]
+
+    parser = argparse.ArgumentParser(description="Benchmark model backends and the /api/predict endpoint")
+    parser.add_argument("--models", default="", help="Comma-separated MODEL_CHECKPOINTS keys (default: all available)")
+    parser.add_argument("--backends", default="eager,fuse,trace,onnx", help="eager, fuse, trace, compile and/or onnx")
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 8, 32])
+    parser.add_argument("--threads", type=int_list, default=[1, min(4, os.cpu_count() or 1)])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--skip-models", action="store_true", help="Only run the end-to-end benchmark")
+    parser.add_argument("--skip-e2e", action="store_true", help="Skip the /api/predict load test")
+    parser.add_argument("--skip-auth", action="store_true", help="Skip the login storm")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--upload-latency-ms", type=float, default=50.0, help="Simulated upload latency (in-process only)")
+    parser.add_argument("--e2e-warmup", type=int, default=4, help="Untimed requests sent before the first level")
+    parser.add_argument("--logins", type=int, default=200, help="Logins sent during each login storm")
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--url", default=None, help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", default=None, help="JSON output (default: RESULTS_DIR/benchmark_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Previous benchmark JSON to print deltas against")
+    args = parser.parse_args()
+    args.backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    from logs import setup_logging
+    setup_logging(fmt="text")
+
+    import torch
+    try:
+        import onnxruntime
+        onnxruntime_version = onnxruntime.__version__
+    except ImportError:
+        onnxruntime_version = None
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.utcnow().isoformat(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "onnxruntime": onnxruntime_version,
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "models": [] if args.skip_models else benchmark_models(args),
+        "e2e": None if args.skip_e2e else asyncio.run(benchmark_e2e(args)),
+        # The loop being probed is this process's, so the storm always runs in-process
+        "auth": None if args.skip_auth else asyncio.run(benchmark_login_storm(args)),
+    }
+
+    import config
+    output = args.output or os.path.join(config.RESULTS_DIR, f"benchmark_{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {output}")
+
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Calibration of the student -> teacher cascade thresholds (mode=cascade on /api/predict)
+
+Runs the student and the teacher once over a held-out TinyImageNet validation
+subset, then sweeps top-1 probability and top-1/top-2 margin thresholds. The
+cheapest pair whose cascade accuracy reaches the target is kept. Cost is the
+average compute per image: the student's latency, plus the teacher's latency
+times the escalation rate. The chosen pair is checked on the remaining images
+and written where the API reads it (CASCADE_THRESHOLDS_PATH).
+
+Usage:
+    python calibrate_cascade.py --student distilled_b0 --teacher teacher_b2_tiny --max-accuracy-drop 0.5
+"""
+
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+import config
+from cascade import DEFAULT_STUDENT, DEFAULT_TEACHER, confidence_and_margin
+from data import TinyImageNetVal, calibration_split, make_loader
+from evaluation import collect_probabilities, measure_latency
+from logs import setup_logging
+from model_registry import MODEL_CHECKPOINTS, resolve_checkpoint, inspect_and_load_architecture
+
+
+def load_model(model_key: str) -> Optional[torch.nn.Module]:
+    if model_key not in MODEL_CHECKPOINTS:
+        print(f"⚠️ {model_key} is not in MODEL_CHECKPOINTS")
+        return None
+    rel_path, arch = MODEL_CHECKPOINTS[model_key]
+    checkpoint_path = resolve_checkpoint(rel_path)
+    if checkpoint_path is None:
+        print(f"⚠️ Could not find {model_key} checkpoint {rel_path}")
+        return None
+    return inspect_and_load_architecture(model_key, checkpoint_path, arch, config.NUM_CLASSES)
+
+
+def cascade_outcome(
+    escalate: np.ndarray,
+    student_correct: np.ndarray,
+    teacher_correct: np.ndarray,
+    student_ms: float,
+    teacher_ms: float
+) -> Dict[str, float]:
+    """Accuracy (percent), escalation rate and average cost (ms) of one escalation mask."""
+    correct = np.where(escalate, teacher_correct, student_correct)
+    rate = float(escalate.mean())
+    return {
+        "top1_accuracy": 100.0 * float(correct.mean()),
+        "escalation_rate": rate,
+        "avg_cost_ms": student_ms + rate * teacher_ms,
+    }
+
+
+def sweep_thresholds(
+    confidence: np.ndarray,
+    margin: np.ndarray,
+    student_correct: np.ndarray,
+    teacher_correct: np.ndarray,
+    student_ms: float,
+    teacher_ms: float,
+    grid: np.ndarray
+) -> List[dict]:
+    """Cascade outcome for every (min_confidence, min_margin) pair in ``grid`` x ``grid``."""
+    points = []
+    for min_confidence in grid:
+        below_confidence = confidence < min_confidence
+        for min_margin in grid:
+            escalate = below_confidence | (margin < min_margin)
+            points.append({
+                "min_confidence": round(float(min_confidence), 4),
+                "min_margin": round(float(min_margin), 4),
+                **cascade_outcome(escalate, student_correct, teacher_correct, student_ms, teacher_ms),
+            })
+    return points
+
+
+def pick_thresholds(points: List[dict], target_accuracy: float) -> dict:
+    """Cheapest point reaching ``target_accuracy`` (ties: more accurate); else the most accurate one."""
+    feasible = [p for p in points if p["top1_accuracy"] >= target_accuracy]
+    if feasible:
+        return min(feasible, key=lambda p: (p["avg_cost_ms"], -p["top1_accuracy"]))
+    print(f"⚠️ No thresholds reach {target_accuracy:.2f}% top-1; using the most accurate cascade")
+    return max(points, key=lambda p: (p["top1_accuracy"], -p["avg_cost_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick cascade escalation thresholds on TinyImageNet validation")
+    parser.add_argument("--student", default=DEFAULT_STUDENT, help="MODEL_CHECKPOINTS key answering first")
+    parser.add_argument("--teacher", default=DEFAULT_TEACHER, help="MODEL_CHECKPOINTS key escalated to")
+    parser.add_argument("--target-accuracy", type=float, default=None, help="Cascade top-1 to reach, in percent")
+    parser.add_argument("--max-accuracy-drop", type=float, default=1.0,
+                        help="Without --target-accuracy: points of top-1 the cascade may lose against the teacher")
+    parser.add_argument("--grid-step", type=float, default=0.02, help="Threshold sweep step (0-1)")
+    parser.add_argument("--data-dir", default=None, help="TinyImageNet root (default: DATA_DIR/tiny-imagenet-200)")
+    parser.add_argument("--calibration-size", type=int, default=5000, help="Validation images used to pick thresholds")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--latency-runs", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads for the latency measurement (0 = default)")
+    parser.add_argument("--output", default=os.path.join(config.RESULTS_DIR, "cascade_thresholds.json"))
+    args = parser.parse_args()
+    setup_logging(fmt="text")
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    student, teacher = load_model(args.student), load_model(args.teacher)
+    if student is None or teacher is None:
+        return
+
+    dataset = TinyImageNetVal(args.data_dir) if args.data_dir else TinyImageNetVal()
+    calibration_set, eval_set = calibration_split(dataset, args.calibration_size)
+    print(f"📊 {len(calibration_set)} calibration / {len(eval_set)} evaluation images")
+
+    # Per-image latency stands in for compute: the cascade runs one image at a time
+    input_shape = (1, 3, config.IMAGE_SIZE, config.IMAGE_SIZE)
+    student_ms = measure_latency(student, input_shape, args.latency_runs)[0]
+    teacher_ms = measure_latency(teacher, input_shape, args.latency_runs)[0]
+    print(f"⏱️  {args.student}: {student_ms:.2f} ms, {args.teacher}: {teacher_ms:.2f} ms per image")
+
+    # Both models run once per split; every threshold is then scored from these outputs
+    splits = {}
+    for split_name, subset in (("calibration", calibration_set), ("evaluation", eval_set)):
+        if len(subset) == 0:
+            continue
+        loader = make_loader(subset, args.batch_size)
+        student_probs, targets = collect_probabilities(student, loader)
+        teacher_probs, _ = collect_probabilities(teacher, loader)
+        confidence, margin = confidence_and_margin(student_probs)
+        splits[split_name] = {
+            "confidence": confidence,
+            "margin": margin,
+            "student_correct": student_probs.argmax(axis=1) == targets,
+            "teacher_correct": teacher_probs.argmax(axis=1) == targets,
+        }
+
+    calibration = splits["calibration"]
+    teacher_accuracy = 100.0 * float(calibration["teacher_correct"].mean())
+    target = args.target_accuracy if args.target_accuracy is not None else teacher_accuracy - args.max_accuracy_drop
+    print(
+        f"🎯 Target {target:.2f}% top-1 (student {100.0 * calibration['student_correct'].mean():.2f}%, "
+        f"teacher {teacher_accuracy:.2f}%)"
+    )
+
+    grid = np.round(np.arange(0.0, 1.0 + args.grid_step / 2, args.grid_step), 4)
+    points = sweep_thresholds(
+        calibration["confidence"], calibration["margin"],
+        calibration["student_correct"], calibration["teacher_correct"],
+        student_ms, teacher_ms, grid,
+    )
+    chosen = pick_thresholds(points, target)
+
+    report = {
+        "student": args.student,
+        "teacher": args.teacher,
+        "min_confidence": chosen["min_confidence"],
+        "min_margin": chosen["min_margin"],
+        "target_accuracy": target,
+        "latency_ms": {args.student: student_ms, args.teacher: teacher_ms},
+    }
+    for split_name, split in splits.items():
+        escalate = (split["confidence"] < chosen["min_confidence"]) | (split["margin"] < chosen["min_margin"])
+        report[split_name] = {
+            "images": int(escalate.shape[0]),
+            **cascade_outcome(escalate, split["student_correct"], split["teacher_correct"], student_ms, teacher_ms),
+            "student_top1_accuracy": 100.0 * float(split["student_correct"].mean()),
+            "teacher_top1_accuracy": 100.0 * float(split["teacher_correct"].mean()),
+        }
+        outcome = report[split_name]
+        print(
+            f"✅ {split_name}: min_confidence={chosen['min_confidence']}, min_margin={chosen['min_margin']} -> "
+            f"top1 {outcome['top1_accuracy']:.2f}%, {100 * outcome['escalation_rate']:.1f}% escalated, "
+            f"{outcome['avg_cost_ms']:.2f} ms/image (teacher alone {teacher_ms:.2f} ms)"
+        )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Thresholds written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
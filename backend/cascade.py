@@ -0,0 +1,102 @@
+"""
+Confidence-based student -> teacher cascade shared by the API and calibrate_cascade.py
+"""
+
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_STUDENT = "distilled_b0"
+DEFAULT_TEACHER = "teacher_b2_tiny"
+
+
+def confidence_and_margin(probs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-1 probability and top-1 minus top-2 probability per row.
+
+    Args:
+        probs: [N, C] softmax probabilities (0-1)
+
+    Returns:
+        (confidence, margin), each of shape [N]
+    """
+    top2 = np.partition(probs, -2, axis=1)[:, -2:]
+    return top2[:, 1], top2[:, 1] - top2[:, 0]
+
+
+class CascadePolicy:
+    """
+    Answer with ``student``; escalate to ``teacher`` when the student is unsure.
+
+    The student is unsure when its top-1 probability is below
+    ``min_confidence`` or its top-1/top-2 gap is below ``min_margin``.
+    Thresholds are chosen offline by ``calibrate_cascade.py``.
+
+    Args:
+        student: MODEL_CHECKPOINTS key run for every image
+        teacher: MODEL_CHECKPOINTS key run only on escalation
+        min_confidence: Escalate below this top-1 probability (0-1)
+        min_margin: Escalate below this top-1 minus top-2 probability (0-1)
+    """
+
+    def __init__(
+        self,
+        student: str = DEFAULT_STUDENT,
+        teacher: str = DEFAULT_TEACHER,
+        min_confidence: float = 0.5,
+        min_margin: float = 0.0,
+    ):
+        self.student = student
+        self.teacher = teacher
+        self.min_confidence = float(min_confidence)
+        self.min_margin = float(min_margin)
+
+    @property
+    def models(self) -> List[str]:
+        return [self.student, self.teacher]
+
+    @property
+    def tag(self) -> str:
+        """Identifies the policy in prediction cache keys."""
+        return f"cascade:{self.student}>{self.teacher}@{self.min_confidence:.4f},{self.min_margin:.4f}"
+
+    def scores(self, topk: List[dict]) -> Tuple[float, float]:
+        """Confidence and margin (0-1) from a model's top-k response entries."""
+        probs = [entry["probability"] / 100 for entry in topk[:2]] + [0.0, 0.0]
+        return probs[0], probs[0] - probs[1]
+
+    def should_escalate(self, topk: Optional[List[dict]]) -> bool:
+        if not topk:
+            return True
+        confidence, margin = self.scores(topk)
+        return confidence < self.min_confidence or margin < self.min_margin
+
+    def to_dict(self) -> dict:
+        return {
+            "student": self.student,
+            "teacher": self.teacher,
+            "min_confidence": self.min_confidence,
+            "min_margin": self.min_margin,
+        }
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, **overrides) -> "CascadePolicy":
+        """
+        Policy from a calibration file (if it exists), with non-None ``overrides`` on top.
+
+        Args:
+            path: JSON written by ``calibrate_cascade.py``
+            **overrides: student, teacher, min_confidence and/or min_margin
+
+        Returns:
+            The policy
+        """
+        settings = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            settings = {k: saved[k] for k in ("student", "teacher", "min_confidence", "min_margin") if k in saved}
+        settings.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**settings)
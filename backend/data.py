@@ -0,0 +1,197 @@
+"""
+TinyImageNet data for offline tooling (quantization, calibration, benchmarks) and distillation training
+"""
+
+import hashlib
+import os
+import random
+from typing import List, Optional, Tuple
+
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, Subset
+from torchvision import transforms
+
+try:
+    import config
+    DATA_DIR, IMAGE_SIZE, SEED = config.DATA_DIR, config.IMAGE_SIZE, config.SEED
+    TRAIN_AUGMENTATION = config.TRAIN_AUGMENTATION
+except ImportError:
+    DATA_DIR, IMAGE_SIZE, SEED = "./data", 64, 42
+    TRAIN_AUGMENTATION = {"random_crop": True, "horizontal_flip": True, "normalize": True}
+
+TINY_IMAGENET_DIR = os.path.join(DATA_DIR, "tiny-imagenet-200")
+
+# Same preprocessing the API applies before inference
+EVAL_TRANSFORM = transforms.Compose([
+    transforms.Resize(IMAGE_SIZE),
+    transforms.CenterCrop(IMAGE_SIZE),
+    transforms.ToTensor(),
+    transforms.Normalize(
+        mean=[0.485, 0.456, 0.406],
+        std=[0.229, 0.224, 0.225]
+    )
+])
+
+
+def build_train_transform(augmentation: dict = TRAIN_AUGMENTATION, image_size: int = IMAGE_SIZE) -> transforms.Compose:
+    """Training-time augmentation from ``config.TRAIN_AUGMENTATION``."""
+    steps = []
+    if augmentation.get("random_crop"):
+        steps.append(transforms.RandomCrop(image_size, padding=image_size // 8, padding_mode="reflect"))
+    else:
+        steps += [transforms.Resize(image_size), transforms.CenterCrop(image_size)]
+    if augmentation.get("horizontal_flip"):
+        steps.append(transforms.RandomHorizontalFlip())
+    if augmentation.get("color_jitter"):
+        steps.append(transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2))
+    if augmentation.get("random_rotation"):
+        steps.append(transforms.RandomRotation(augmentation["random_rotation"]))
+    steps.append(transforms.ToTensor())
+    if augmentation.get("normalize", True):
+        steps.append(transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]))
+    return transforms.Compose(steps)
+
+
+TRAIN_TRANSFORM = build_train_transform()
+
+
+def read_classes(root: str) -> List[str]:
+    """Sorted WNIDs (the class index order the API's label list follows)."""
+    wnids_path = os.path.join(root, "wnids.txt")
+    if os.path.exists(wnids_path):
+        with open(wnids_path) as f:
+            wnids = [line.strip() for line in f if line.strip()]
+    else:
+        wnids = os.listdir(os.path.join(root, "train"))
+    return sorted(wnids)
+
+
+class TinyImageNetVal(Dataset):
+    """
+    TinyImageNet validation split (``val/images`` + ``val_annotations.txt``).
+
+    Class indices follow the sorted WNIDs, matching the label list the API uses.
+
+    Args:
+        root: Dataset root (containing ``wnids.txt``, ``train/`` and ``val/``)
+        transform: Transform applied to each PIL image
+    """
+
+    def __init__(self, root: str = TINY_IMAGENET_DIR, transform=EVAL_TRANSFORM):
+        self.root = root
+        self.transform = transform
+        self.classes = read_classes(root)
+        class_to_idx = {wnid: i for i, wnid in enumerate(self.classes)}
+
+        self.samples: List[Tuple[str, int]] = []
+        with open(os.path.join(root, "val", "val_annotations.txt")) as f:
+            for line in f:
+                parts = line.strip().split("\t")
+                if len(parts) >= 2:
+                    self.samples.append((os.path.join(root, "val", "images", parts[0]), class_to_idx[parts[1]]))
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, int]:
+        path, target = self.samples[index]
+        image = Image.open(path).convert("RGB")
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, target
+
+
+class TinyImageNetTrain(TinyImageNetVal):
+    """
+    TinyImageNet training split (``train/<wnid>/images/*``), in a fixed, sorted order.
+
+    Args:
+        root: Dataset root (containing ``wnids.txt`` and ``train/``)
+        transform: Transform applied to each PIL image (None = return the PIL image)
+    """
+
+    def __init__(self, root: str = TINY_IMAGENET_DIR, transform=TRAIN_TRANSFORM):
+        self.root = root
+        self.transform = transform
+        self.classes = read_classes(root)
+        self.samples = []
+        for target, wnid in enumerate(self.classes):
+            image_dir = os.path.join(root, "train", wnid, "images")
+            if not os.path.isdir(image_dir):
+                continue
+            for name in sorted(os.listdir(image_dir)):
+                self.samples.append((os.path.join(image_dir, name), target))
+
+    def fingerprint(self) -> str:
+        """Hash of the sample list, so stores built from it can check they match."""
+        digest = hashlib.sha1()
+        for path, target in self.samples:
+            digest.update(f"{os.path.relpath(path, self.root)}\t{target}\n".encode())
+        return digest.hexdigest()
+
+
+class AugmentedViews(Dataset):
+    """
+    Reproducible augmentation: view ``v`` of image ``i`` is always the same tensor.
+
+    The transform runs under a torch RNG seeded from (seed, view, index), so a
+    teacher pass over view ``v`` (``precompute_teacher_logits.py``) and a later
+    student epoch on view ``v`` see identical images, in any order and with
+    any number of loader workers. Items are ``(image, target, index)``.
+
+    Args:
+        dataset: Dataset yielding (PIL image, target), e.g. ``TinyImageNetTrain(transform=None)``
+        transform: Random augmentation to apply
+        num_views: Distinct augmentations per image
+        seed: Base seed
+    """
+
+    def __init__(self, dataset: Dataset, transform, num_views: int, seed: int = SEED):
+        self.dataset = dataset
+        self.transform = transform
+        self.num_views = max(1, int(num_views))
+        self.seed = seed
+        self.view = 0
+
+    def set_view(self, view: int):
+        """Select the view served next (set before creating the loader iterator)."""
+        self.view = view % self.num_views
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, int, int]:
+        image, target = self.dataset[index]
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(((self.seed * 1_000_003 + self.view) * 10_000_019 + index) % 2**63)
+            image = self.transform(image)
+        return image, target, index
+
+
+def calibration_split(
+    dataset: Dataset,
+    calibration_size: int,
+    seed: int = SEED
+) -> Tuple[Subset, Subset]:
+    """
+    Split off a random, held-out calibration subset.
+
+    Args:
+        dataset: Dataset to split
+        calibration_size: Number of samples reserved for calibration
+        seed: Shuffle seed, so every tool holds out the same images
+
+    Returns:
+        (calibration subset, evaluation subset)
+    """
+    indices = list(range(len(dataset)))
+    random.Random(seed).shuffle(indices)
+    calibration_size = min(calibration_size, len(indices))
+    return Subset(dataset, indices[:calibration_size]), Subset(dataset, indices[calibration_size:])
+
+
+def make_loader(dataset: Dataset, batch_size: int = 128, num_workers: Optional[int] = None) -> DataLoader:
+    if num_workers is None:
+        num_workers = min(4, os.cpu_count() or 1)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
@@ -0,0 +1,140 @@
+"""
+Evaluation helpers producing entries in the results/*.json schema
+"""
+
+import json
+import os
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+# Numeric fields of a results entry (besides "model_name")
+RESULT_FIELDS = (
+    "top1_accuracy", "top5_accuracy", "f1_macro", "f1_weighted",
+    "num_parameters", "size_mb", "inference_time_ms", "inference_std_ms",
+)
+
+
+def evaluate_accuracy(model: nn.Module, loader: DataLoader, num_classes: int) -> Dict[str, float]:
+    """
+    Top-1/top-5 accuracy and macro/weighted F1 (all in percent) over ``loader``.
+
+    Args:
+        model: Model in eval mode (on CPU)
+        loader: Yields (images, targets) batches
+        num_classes: Number of classes for the confusion matrix
+
+    Returns:
+        Dict with top1_accuracy, top5_accuracy, f1_macro and f1_weighted
+    """
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    top5_hits, total = 0, 0
+    with torch.inference_mode():
+        for images, targets in loader:
+            logits = model(images)
+            top5 = logits.topk(min(5, logits.shape[1]), dim=1).indices
+            top5_hits += (top5 == targets.unsqueeze(1)).any(dim=1).sum().item()
+            np.add.at(confusion, (targets.numpy(), top5[:, 0].numpy()), 1)
+            total += targets.shape[0]
+
+    true_positives = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    precision = np.divide(true_positives, predicted, out=np.zeros_like(true_positives), where=predicted > 0)
+    recall = np.divide(true_positives, support, out=np.zeros_like(true_positives), where=support > 0)
+    denominator = precision + recall
+    f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(true_positives), where=denominator > 0)
+    present = support > 0
+    return {
+        "top1_accuracy": 100.0 * true_positives.sum() / max(total, 1),
+        "top5_accuracy": 100.0 * top5_hits / max(total, 1),
+        "f1_macro": 100.0 * f1[present].mean() if present.any() else 0.0,
+        "f1_weighted": 100.0 * (f1 * support).sum() / max(support.sum(), 1),
+    }
+
+
+def collect_probabilities(model: nn.Module, loader: DataLoader) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Softmax outputs of ``model`` over ``loader``, in loader order.
+
+    Args:
+        model: Model in eval mode (on CPU)
+        loader: Yields (images, targets) batches (unshuffled, so models can be compared per image)
+
+    Returns:
+        ([N, C] float32 probabilities, [N] targets)
+    """
+    probs, targets = [], []
+    with torch.inference_mode():
+        for images, batch_targets in loader:
+            probs.append(torch.softmax(model(images).float(), dim=1).numpy())
+            targets.append(batch_targets.numpy())
+    return np.concatenate(probs), np.concatenate(targets)
+
+
+def measure_latency(
+    model: nn.Module,
+    input_shape: Tuple[int, ...],
+    runs: int = 100,
+    warmup: int = 10
+) -> Tuple[float, float]:
+    """
+    Per-call latency of ``model`` on a random input.
+
+    Args:
+        model: Model in eval mode (on CPU)
+        input_shape: Input shape, e.g. (1, 3, 64, 64) for per-image latency
+        runs: Timed calls
+        warmup: Untimed calls first
+
+    Returns:
+        (mean, standard deviation) in milliseconds
+    """
+    x = torch.randn(input_shape)
+    timings = []
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(x)
+        for _ in range(runs):
+            started = time.perf_counter()
+            model(x)
+            timings.append((time.perf_counter() - started) * 1000)
+    return float(np.mean(timings)), float(np.std(timings))
+
+
+def results_entry(
+    model_name: str,
+    accuracy: Dict[str, float],
+    num_parameters: int,
+    size_mb: float,
+    latency: Tuple[float, float]
+) -> dict:
+    return {
+        "model_name": model_name,
+        **accuracy,
+        "num_parameters": num_parameters,
+        "size_mb": size_mb,
+        "inference_time_ms": latency[0],
+        "inference_std_ms": latency[1],
+    }
+
+
+def results_delta(model_name: str, entry: dict, baseline: dict) -> dict:
+    """``entry - baseline`` for every numeric field, in the same schema."""
+    return {"model_name": model_name, **{k: entry[k] - baseline[k] for k in RESULT_FIELDS}}
+
+
+def save_results(path: str, results: Dict[str, dict], merge: bool = True):
+    """Write ``results`` keyed by model name, keeping other entries already in the file."""
+    existing = {}
+    if merge and os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+    existing.update(results)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(existing, f, indent=2)
@@ -0,0 +1,122 @@
+"""
+Export MODEL_CHECKPOINTS to ONNX for the ONNX Runtime serving backend
+
+Each checkpoint is written next to itself as ``<name>.onnx`` with a dynamic
+batch axis, then run through ONNX Runtime (CPU) on random batches of several
+sizes and compared against PyTorch. A model whose logits or top-1 classes
+differ beyond tolerance is reported as failed (and the command exits 1).
+
+Usage:
+    python export_onnx.py [--models distilled_b0,teacher_r18_tiny]
+
+Needs onnx/onnxscript for the export and onnxruntime for the check. Then serve
+them with ONNX_MODELS=all (or a comma-separated list of keys).
+"""
+
+import argparse
+import inspect
+import os
+import sys
+from typing import Optional
+
+import numpy as np
+import torch
+
+import config
+from logs import setup_logging
+from model_registry import MODEL_CHECKPOINTS, resolve_checkpoint, inspect_and_load_architecture
+from onnx_backend import OnnxModel, onnx_path
+
+
+def export_model(model: torch.nn.Module, path: str, image_size: int, opset: Optional[int]):
+    """Export ``model`` with input ``input`` [batch, 3, H, W] and output ``logits`` [batch, classes]."""
+    example = torch.randn(2, 3, image_size, image_size)
+    kwargs = {}
+    if "external_data" in inspect.signature(torch.onnx.export).parameters:
+        # Keep the weights inside the .onnx file (these models are far below 2 GB)
+        kwargs["external_data"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (example,),
+            path,
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+            **kwargs,
+        )
+
+
+def check_parity(model: torch.nn.Module, session: OnnxModel, image_size: int, batch_sizes, atol: float) -> dict:
+    """
+    Compare PyTorch and ONNX Runtime logits on random batches.
+
+    Returns:
+        Dict with the max absolute logit difference, the top-1 agreement rate
+        and whether both are within tolerance
+    """
+    max_diff, agree, total = 0.0, 0, 0
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            x = torch.randn(batch_size, 3, image_size, image_size)
+            expected = model(x).numpy()
+            actual = session(x.numpy())
+            max_diff = max(max_diff, float(np.abs(expected - actual).max()))
+            agree += int((expected.argmax(axis=1) == actual.argmax(axis=1)).sum())
+            total += batch_size
+    return {"max_abs_diff": max_diff, "top1_agreement": agree / total, "ok": max_diff <= atol and agree == total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export checkpoints to ONNX and verify parity with PyTorch")
+    parser.add_argument("--models", default="", help="Comma-separated MODEL_CHECKPOINTS keys (default: all)")
+    parser.add_argument("--opset", type=int, default=None, help="ONNX opset (default: the exporter's)")
+    parser.add_argument("--batch-sizes", default="1,4,16", help="Batch sizes used for the parity check")
+    parser.add_argument("--atol", type=float, default=1e-3, help="Max absolute logit difference allowed")
+    args = parser.parse_args()
+    setup_logging(fmt="text")
+
+    keys = [m.strip() for m in args.models.split(",") if m.strip()] or list(MODEL_CHECKPOINTS)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    failed = []
+    for model_key in keys:
+        if model_key not in MODEL_CHECKPOINTS:
+            print(f"⚠️ Unknown model {model_key}, skipping")
+            continue
+        rel_path, arch = MODEL_CHECKPOINTS[model_key]
+        if arch == "torchscript":
+            print(f"ℹ️  {model_key} is already an exported graph, skipping")
+            continue
+        checkpoint_path = resolve_checkpoint(rel_path)
+        if checkpoint_path is None or checkpoint_path.endswith(".onnx"):
+            print(f"⚠️ Could not find {model_key} checkpoint {rel_path}, skipping")
+            continue
+        model = inspect_and_load_architecture(model_key, checkpoint_path, arch, config.NUM_CLASSES)
+        if model is None:
+            failed.append(model_key)
+            continue
+
+        path = onnx_path(checkpoint_path)
+        try:
+            export_model(model, path, config.IMAGE_SIZE, args.opset)
+            parity = check_parity(model, OnnxModel(path), config.IMAGE_SIZE, batch_sizes, args.atol)
+        except Exception as e:
+            print(f"❌ {model_key}: export failed: {e}")
+            failed.append(model_key)
+            continue
+        status = "✅" if parity["ok"] else "❌"
+        print(
+            f"{status} {model_key} -> {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB, "
+            f"max |diff| {parity['max_abs_diff']:.2e}, top-1 agreement {parity['top1_agreement']:.0%})"
+        )
+        if not parity["ok"]:
+            failed.append(model_key)
+
+    if failed:
+        print(f"⚠️ Parity check failed for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
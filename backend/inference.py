@@ -0,0 +1,567 @@
+"""
+Serving-side inference utilities for the DeepDistill API
+"""
+
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from logs import get_logger, setup_logging
+from metrics import histogram
+from onnx_backend import postprocess_topk_numpy
+
+logger = get_logger("inference")
+
+BATCH_FORWARD_SECONDS = histogram(
+    "deepdistill_batch_forward_seconds", "Forward pass time per micro-batch", ("model",)
+)
+BATCH_SIZE = histogram(
+    "deepdistill_batch_size", "Images per micro-batch", ("model",), buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+
+def output_classes(model: nn.Module) -> Optional[int]:
+    """Number of classes produced by the final classification layer, if it can be found."""
+    if not isinstance(model, nn.Module):
+        # Exported graphs (e.g. ONNX sessions) report their output width directly
+        return getattr(model, "num_classes", None)
+    final_layer = None
+    # Try to find the final classification layer
+    if hasattr(model, 'classifier') and isinstance(model.classifier, nn.Sequential):
+        # EfficientNet usually has classifier as Sequential(Dropout, Linear)
+        if len(model.classifier) > 1 and isinstance(model.classifier[-1], nn.Linear):
+            final_layer = model.classifier[-1]
+    elif hasattr(model, 'classifier') and isinstance(model.classifier, nn.Linear):
+        final_layer = model.classifier
+    elif hasattr(model, 'fc') and isinstance(model.fc, nn.Linear):
+        # ResNet usually uses 'fc'
+        final_layer = model.fc
+    return getattr(final_layer, 'out_features', None)
+
+
+def build_label_table(labels: Sequence[str], num_classes: int) -> np.ndarray:
+    """
+    Class-name lookup table covering every index a model can predict.
+
+    Indices the label list doesn't cover map to a placeholder name, so the
+    bounds check happens once here instead of for every prediction.
+    """
+    table = np.empty(max(num_classes, len(labels)), dtype=object)
+    table[:len(labels)] = list(labels)
+    for idx in range(len(labels), len(table)):
+        table[idx] = f"Unknown Class {idx} (OutOfBounds)"
+    return table
+
+
+def postprocess_topk(logits: torch.Tensor, label_table: np.ndarray, k: int = 5) -> List[List[dict]]:
+    """
+    Turn [B, C] logits into top K ``{"class_id", "class_name", "probability"}`` dicts per row.
+
+    One softmax and one topk cover the whole batch, and the results cross to
+    host memory in a single transfer before the label lookup.
+    """
+    probs = torch.softmax(logits.float(), dim=1)
+    top_probs, top_indices = torch.topk(probs, min(k, probs.shape[1]), dim=1)
+    # Pack probabilities and class ids into one float64 tensor (exact for both,
+    # and rounded percentages serialize cleanly) so the device sync happens once
+    top_probs = top_probs.double()
+    packed = torch.stack([(top_probs * 100).round(decimals=2), top_indices.to(top_probs.dtype)]).cpu().numpy()
+    top_probs, top_indices = packed[0].tolist(), packed[1].astype(np.int64)
+    names = label_table[top_indices].tolist()
+    return [
+        [
+            {"class_id": idx, "class_name": name, "probability": prob}
+            for idx, name, prob in zip(row_ids, row_names, row_probs)
+        ]
+        for row_ids, row_names, row_probs in zip(top_indices.tolist(), names, top_probs)
+    ]
+
+
+def run_topk(
+    model: Optional[nn.Module],
+    batch_tensor: torch.Tensor,
+    label_table: np.ndarray,
+    k: int = 5,
+    device: Optional[torch.device] = None
+) -> List[List[dict]]:
+    """
+    Run one forward pass on a [B, C, H, W] batch and return top K results per image.
+
+    Args:
+        model: Model to run (``None`` yields empty results)
+        batch_tensor: Preprocessed input batch
+        label_table: Class names indexed by class id (see ``build_label_table``)
+        k: Number of classes to return per image
+        device: Device to move the batch to before the forward pass (models
+            with ``numpy_io``, e.g. ONNX Runtime sessions, always run on CPU)
+
+    Returns:
+        One list of ``{"class_id", "class_name", "probability"}`` dicts per image
+    """
+    if model is None: return [[] for _ in range(batch_tensor.shape[0])]
+    try:
+        if getattr(model, "numpy_io", False):
+            return postprocess_topk_numpy(model(batch_tensor.cpu().numpy()), label_table, k)
+        with torch.inference_mode():
+            if device is not None:
+                batch_tensor = batch_tensor.to(device, non_blocking=True)
+            logits = model(batch_tensor)
+            return postprocess_topk(logits, label_table, k)
+    except Exception as e:
+        logger.exception("Error during inference: %s", e)
+        return [[] for _ in range(batch_tensor.shape[0])]
+
+
+async def gather_with_budgets(
+    calls: Dict[str, Awaitable],
+    budgets_s: Dict[str, Optional[float]]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Await independent per-model calls concurrently, each with its own deadline.
+
+    A call that misses its budget is cancelled (a batcher drops cancelled
+    requests that have not reached a forward pass yet) without holding back
+    the others.
+
+    Args:
+        calls: Awaitable per model name
+        budgets_s: Timeout in seconds per model name (missing/None = no limit)
+
+    Returns:
+        (results of the calls that finished, names of the calls that timed out)
+    """
+    names = list(calls)
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(calls[name], budgets_s.get(name)) for name in names),
+        return_exceptions=True
+    )
+    results, timed_out = {}, []
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            timed_out.append(name)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results[name] = outcome
+    return results, timed_out
+
+
+# =============================================================================
+# INFERENCE EXECUTORS
+# =============================================================================
+
+class InferenceQueueFull(Exception):
+    """Raised when the executor already holds ``max_queue_depth`` requests."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Base class for the pluggable inference executors.
+
+    Keeps CPU-bound work (image decoding, transforms, forward passes) off the
+    asyncio event loop and applies backpressure: at most ``max_queue_depth``
+    requests may be admitted at once, later ones get ``InferenceQueueFull``.
+
+    Args:
+        labels: Class names used to postprocess logits
+        label_tables: Per-model lookup tables built at load time (models
+            without one use a table built from ``labels``)
+        max_queue_depth: Maximum number of admitted, unfinished requests
+        retry_after: Seconds clients should wait before retrying when full
+        prep_workers: Threads used for request preprocessing
+    """
+
+    kind = "base"
+    # Whether models are loaded inside the pool's workers rather than this process
+    loads_in_workers = False
+
+    def __init__(
+        self,
+        labels: Sequence[str],
+        label_tables: Optional[Dict[str, np.ndarray]] = None,
+        max_queue_depth: int = 64,
+        retry_after: int = 1,
+        prep_workers: int = 2
+    ):
+        self.labels = list(labels)
+        self.label_tables = label_tables if label_tables is not None else {}
+        self.default_label_table = build_label_table(self.labels, len(self.labels))
+        self.max_queue_depth = max(1, int(max_queue_depth))
+        self.retry_after = max(1, int(retry_after))
+        self.in_flight = 0
+        self.rejected = 0
+        self._prep_pool = ThreadPoolExecutor(max_workers=max(1, prep_workers), thread_name_prefix="prep")
+
+    # --- admission control ---
+    def acquire_slot(self):
+        """Admit one request or raise ``InferenceQueueFull``."""
+        if self.in_flight >= self.max_queue_depth:
+            self.rejected += 1
+            raise InferenceQueueFull(self.retry_after)
+        self.in_flight += 1
+
+    def release_slot(self):
+        self.in_flight = max(0, self.in_flight - 1)
+
+    @contextmanager
+    def admit(self):
+        self.acquire_slot()
+        try:
+            yield
+        finally:
+            self.release_slot()
+
+    # --- execution ---
+    async def run_blocking(self, fn: Callable, *args) -> Any:
+        """Run a blocking helper (decode, transform, ...) on the prep pool."""
+        # Carry the caller's context so tracing spans inside ``fn`` land on its trace
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._prep_pool, partial(ctx.run, fn, *args))
+
+    @property
+    def pool(self) -> Executor:
+        """Executor that forward passes are submitted to."""
+        raise NotImplementedError
+
+    def batch_fn(self, model_name: str) -> Callable[[torch.Tensor], List[List[dict]]]:
+        """Callable computing top-k results for a batch of ``model_name``."""
+        raise NotImplementedError
+
+    def label_table(self, model_name: str) -> np.ndarray:
+        return self.label_tables.get(model_name, self.default_label_table)
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "in_flight": self.in_flight,
+            "max_queue_depth": self.max_queue_depth,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._prep_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ThreadInferenceExecutor(InferenceExecutor):
+    """
+    Runs forward passes on a dedicated thread pool inside the API process.
+
+    PyTorch releases the GIL inside its kernels, so several models can run
+    in parallel. ``intra_op_threads`` caps the threads each op may use so
+    the workers don't oversubscribe the CPU. ``models`` is a dict or a
+    ``ModelRegistry``. A registry is only read (``resident(name)``): loads
+    go through its async single-flight ``load`` before requests are
+    batched, and a model evicted meanwhile yields empty results instead of
+    a blocking reload on an inference thread.
+    """
+
+    kind = "thread"
+
+    def __init__(
+        self,
+        models: Any,
+        labels: Sequence[str],
+        workers: int = 4,
+        intra_op_threads: int = 0,
+        device: Optional[torch.device] = None,
+        **kwargs
+    ):
+        super().__init__(labels, **kwargs)
+        self.models = models
+        self.device = device
+        if intra_op_threads > 0:
+            torch.set_num_threads(intra_op_threads)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="infer")
+
+    @property
+    def pool(self) -> Executor:
+        return self._pool
+
+    def _forward(self, model_name: str, batch: torch.Tensor) -> List[List[dict]]:
+        lookup = getattr(self.models, "resident", self.models.get)
+        return run_topk(lookup(model_name), batch, self.label_table(model_name), device=self.device)
+
+    def batch_fn(self, model_name: str):
+        return partial(self._forward, model_name)
+
+    def shutdown(self):
+        super().shutdown()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Model source owned by a process-pool worker (populated by the initializer)
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_process_worker(
+    models: Any,
+    label_tables: Dict[str, np.ndarray],
+    default_table: np.ndarray,
+    intra_op_threads: int
+):
+    # Spawned workers start with a bare logging config
+    setup_logging()
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if callable(models):
+        # Registry factory: the worker loads its own replicas on first use
+        models = models()
+        label_tables = models.label_tables
+    else:
+        for model in models.values():
+            model.eval()
+    _WORKER_STATE.update(models=models, label_tables=label_tables, default_table=default_table)
+
+
+def _process_forward(model_name: str, batch: torch.Tensor) -> List[List[dict]]:
+    model = _WORKER_STATE["models"].get(model_name)
+    table = _WORKER_STATE["label_tables"].get(model_name, _WORKER_STATE["default_table"])
+    return run_topk(model, batch, table)
+
+
+class ProcessInferenceExecutor(InferenceExecutor):
+    """
+    Runs forward passes in a pool of worker processes.
+
+    Every worker holds its own replica of each model, so inference is
+    isolated from the API process (and from the GIL). Given a registry,
+    workers build their own from ``worker_factory()`` and load lazily;
+    a plain dict is copied to each worker at start-up. CPU only.
+    """
+
+    kind = "process"
+    loads_in_workers = True
+
+    def __init__(
+        self,
+        models: Any,
+        labels: Sequence[str],
+        workers: int = 2,
+        intra_op_threads: int = 0,
+        **kwargs
+    ):
+        super().__init__(labels, **kwargs)
+        workers = max(1, workers)
+        if intra_op_threads <= 0:
+            # Each worker would otherwise start a torch thread pool as wide as the machine
+            intra_op_threads = max(1, (os.cpu_count() or 1) // workers)
+        source = models.worker_factory() if hasattr(models, "worker_factory") else dict(models)
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(source, dict(self.label_tables), self.default_label_table, intra_op_threads),
+        )
+
+    @property
+    def pool(self) -> Executor:
+        return self._pool
+
+    def batch_fn(self, model_name: str):
+        return partial(_process_forward, model_name)
+
+    def shutdown(self):
+        super().shutdown()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_inference_executor(
+    kind: str,
+    models: Any,
+    labels: Sequence[str],
+    device: Optional[torch.device] = None,
+    workers: int = 4,
+    intra_op_threads: int = 0,
+    **kwargs
+) -> InferenceExecutor:
+    """
+    Build the executor selected by ``kind`` ("thread" or "process").
+
+    Process workers hold CPU replicas, so a CUDA device falls back to threads.
+    """
+    if kind == "process":
+        if device is not None and device.type != "cpu":
+            logger.warning("⚠️ Process executor is CPU-only, using threads on %s", device)
+        else:
+            return ProcessInferenceExecutor(models, labels, workers=workers, intra_op_threads=intra_op_threads, **kwargs)
+    elif kind != "thread":
+        logger.warning("⚠️ Unknown inference executor '%s', using threads", kind)
+    return ThreadInferenceExecutor(
+        models, labels, workers=workers, intra_op_threads=intra_op_threads, device=device, **kwargs
+    )
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-image requests into batched forward passes.
+
+    Callers ``await submit(tensor)`` with a preprocessed [C, H, W] tensor. A
+    background task collects pending tensors until either ``max_batch_size``
+    are queued or ``max_wait_ms`` has passed since the first one arrived,
+    stacks them into one [B, C, H, W] batch, runs ``batch_fn`` once and
+    scatters the per-row results back to the waiting callers. Up to
+    ``max_concurrent_batches`` batches run at once (one per executor worker);
+    while all are busy, new requests keep filling the next batch.
+
+    Args:
+        name: Name used in logs (usually the model key)
+        batch_fn: Callable taking a [B, C, H, W] tensor and returning a list
+            of B per-image results (must be picklable for process pools)
+        max_batch_size: Upper bound on the number of images per forward pass
+        max_wait_ms: How long the first request of a batch may wait for others
+        executor: Where ``batch_fn`` runs (default: the loop's thread pool)
+        max_concurrent_batches: Batches of this model in flight at once
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[torch.Tensor], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+        max_concurrent_batches: int = 1
+    ):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+
+        self._pending: List[Tuple[torch.Tensor, asyncio.Future]] = []
+        self._has_items: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._running: set = set()
+
+        # Simple counters, handy for /api/health and benchmarking
+        self.batches_run = 0
+        self.items_run = 0
+
+    def start(self):
+        """Start the collector task on the running event loop (idempotent)."""
+        if self._worker is None or self._worker.done():
+            self._has_items = asyncio.Event()
+            self._batch_full = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            # The collector outlives whichever request started it, so it must not
+            # inherit (and keep alive) that request's trace. (create_task(context=) is 3.11+)
+            self._worker = contextvars.Context().run(asyncio.create_task, self._run())
+
+    async def stop(self):
+        """Stop the collector task and fail any request still waiting."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._running):
+            task.cancel()
+        pending, self._pending = self._pending, []
+        for _, fut in pending:
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"Batcher '{self.name}' stopped"))
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, tensor: torch.Tensor) -> Any:
+        """
+        Queue one preprocessed image and wait for its result.
+
+        Args:
+            tensor: Image tensor of shape [C, H, W] (a leading batch dim of 1 is
+                squeezed away)
+
+        Returns:
+            The result ``batch_fn`` produced for this image's row
+        """
+        self.start()
+        if tensor.dim() == 4:
+            tensor = tensor.squeeze(0)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((tensor, fut))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await fut
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            # With every slot busy, requests keep piling into the next batch
+            await self._slots.acquire()
+
+            # Give other requests a short window to join this batch
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            if len(self._pending) < self.max_batch_size:
+                self._batch_full.clear()
+            if not self._pending:
+                self._has_items.clear()
+
+            # Requests whose client went away don't need a row in the batch
+            batch = [(t, f) for t, f in batch if not f.done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._run_batch(batch, self._slots))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: List[Tuple[torch.Tensor, asyncio.Future]], slots: asyncio.Semaphore):
+        try:
+            inputs = torch.stack([t for t, _ in batch])
+            started = time.perf_counter()
+            results = await self._execute(inputs)
+            BATCH_FORWARD_SECONDS.observe(time.perf_counter() - started, model=self.name)
+            BATCH_SIZE.observe(len(batch), model=self.name)
+        except (Exception, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.CancelledError):
+                e = RuntimeError(f"Batcher '{self.name}' stopped")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            # The semaphore this batch took (start() makes a new one after a restart)
+            slots.release()
+
+        self.batches_run += 1
+        self.items_run += len(batch)
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _execute(self, inputs: torch.Tensor) -> List[Any]:
+        # Run the forward pass off the loop so it keeps collecting the next
+        # batch while this one is being computed.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.batch_fn, inputs)
@@ -0,0 +1,150 @@
+"""
+Structured, non-blocking logging for the DeepDistill API
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import zlib
+from datetime import datetime, timezone
+from typing import Optional, Sequence
+
+from metrics import current_trace
+
+# Pass as ``extra=SAMPLED`` on per-request lines; they are kept for LOG_SAMPLE_RATE of traces
+SAMPLED = {"sampled": True}
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id", "sampled"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, trace id and ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TraceSamplingFilter(logging.Filter):
+    """
+    Stamps the current trace id on records and samples per-request lines.
+
+    Attached to the QueueHandler, so it runs on the thread that logs, before
+    the record is queued: the request's trace is still the current context,
+    and it adds a (cheap) check to every log call. Dropped lines are never
+    formatted or queued. The keep/drop decision is a hash of the trace id, so
+    a sampled request keeps all of its lines.
+
+    Args:
+        sample_rate: Fraction of traces whose ``SAMPLED`` lines are kept
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = current_trace()
+        record.trace_id = trace.trace_id if trace is not None else None
+        if not getattr(record, "sampled", False) or self.sample_rate >= 1.0:
+            return True
+        if trace is None:
+            return random.random() < self.sample_rate
+        return zlib.crc32(trace.trace_id.encode()) / 0xFFFFFFFF < self.sample_rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args and render the traceback now (they may not survive the
+        # thread hop), but keep ``extra`` fields for the JSON formatter
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    sample_rate: Optional[float] = None,
+    capture: Sequence[str] = ("uvicorn", "uvicorn.error", "uvicorn.access"),
+) -> logging.Logger:
+    """
+    Route logging through a queue drained by a background thread (idempotent).
+
+    Callers only pay for enqueueing a record; formatting and console I/O
+    happen on the listener thread.
+
+    Args:
+        level: Root level (default: LOG_LEVEL env, "INFO")
+        fmt: "json" or "text" (default: LOG_FORMAT env, "json")
+        sample_rate: Fraction of requests whose ``SAMPLED`` lines are kept
+            (default: LOG_SAMPLE_RATE env, 0.1)
+        capture: Loggers with their own handlers (uvicorn's) to move onto the queue
+
+    Returns:
+        The root logger
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        return root
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.1")) if sample_rate is None else sample_rate
+
+    console = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        console.setFormatter(JsonFormatter())
+    else:
+        console.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(TraceSamplingFilter(sample_rate))
+    _listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root.handlers = [handler]
+    root.setLevel(level)
+    for name in capture:
+        captured = logging.getLogger(name)
+        captured.handlers = []
+        captured.propagate = True
+    return root
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"deepdistill.{name}")
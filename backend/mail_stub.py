@@ -0,0 +1,103 @@
+"""
+Local stand-in for Brevo's transactional email API, for offline development and tests
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse
+
+
+def create_stub_app(
+    outbox_dir: Optional[str] = None,
+    latency_ms: float = 0.0,
+    fail_rate: float = 0.0,
+    api_key: Optional[str] = None,
+) -> FastAPI:
+    """
+    Build an app that accepts ``POST /v3/smtp/email`` like Brevo does.
+
+    Every delivered message (one per ``messageVersions`` entry) is kept in
+    ``app.state.messages`` and, with ``outbox_dir``, appended to
+    ``outbox_dir/messages.ndjson``. Run it with uvicorn and set
+    ``MAIL_API_URL``, or call it in-process through ``httpx.ASGITransport``.
+
+    Args:
+        outbox_dir: Directory to write received messages to (None = memory only)
+        latency_ms: Simulated API latency per request
+        fail_rate: Fraction of requests answered with a 503 (to exercise retries)
+        api_key: Expected ``api-key`` header (None = accept any)
+    """
+    app = FastAPI(title="DeepDistill mail stub")
+    app.state.messages = []
+    app.state.requests = 0
+    if outbox_dir:
+        os.makedirs(outbox_dir, exist_ok=True)
+
+    @app.post("/v3/smtp/email")
+    async def send_email(request: Request, api_key_header: Optional[str] = Header(None, alias="api-key")):
+        app.state.requests += 1
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000)
+        if api_key is not None and api_key_header != api_key:
+            return JSONResponse({"code": "unauthorized", "message": "Key not found"}, status_code=401)
+        if fail_rate > 0 and random.random() < fail_rate:
+            return JSONResponse({"code": "service_unavailable", "message": "Simulated outage"}, status_code=503)
+
+        payload = await request.json()
+        versions = payload.get("messageVersions") or [{}]
+        messages = []
+        for version in versions:
+            to = version.get("to") or payload.get("to")
+            if not to or "sender" not in payload:
+                return JSONResponse({"code": "missing_parameter", "message": "sender and to are required"}, status_code=400)
+            messages.append({
+                "messageId": f"<{uuid.uuid4().hex}@mail-stub>",
+                "received_at": time.time(),
+                "sender": payload["sender"],
+                "to": [recipient["email"] for recipient in to],
+                "subject": version.get("subject", payload.get("subject")),
+                "htmlContent": version.get("htmlContent", payload.get("htmlContent")),
+            })
+
+        app.state.messages.extend(messages)
+        if outbox_dir:
+            with open(os.path.join(outbox_dir, "messages.ndjson"), "a", encoding="utf-8") as f:
+                for message in messages:
+                    f.write(json.dumps(message) + "\n")
+        if len(messages) == 1:
+            return JSONResponse({"messageId": messages[0]["messageId"]}, status_code=201)
+        return JSONResponse({"messageIds": [m["messageId"] for m in messages]}, status_code=201)
+
+    @app.get("/messages")
+    async def list_messages():
+        return {"requests": app.state.requests, "messages": app.state.messages}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Brevo-compatible mail API (set MAIL_API_URL to it)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--outbox-dir", default="mail_stub_outbox", help="Where received messages are written")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated API latency")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    print(f"📮 Mail stub on http://{args.host}:{args.port} (messages -> {args.outbox_dir}/messages.ndjson)")
+    app = create_stub_app(args.outbox_dir, latency_ms=args.latency_ms, fail_rate=args.fail_rate)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
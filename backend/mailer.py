@@ -0,0 +1,373 @@
+"""
+Transactional email outbox: a persistent SQLite queue drained by a pooled async HTTP client
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import httpx
+
+from logs import get_logger
+from metrics import histogram
+
+logger = get_logger("mail")
+# httpx logs every request at INFO; the outbox logs per batch instead
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+MAIL_SEND_SECONDS = histogram(
+    "deepdistill_mail_send_seconds", "Mail API call duration per batch", ("outcome",)
+)
+
+
+@dataclass
+class OutboxMessage:
+    id: int
+    recipients: List[str]
+    subject: str
+    html: str
+    attempts: int
+
+
+class MailError(Exception):
+    """A send that failed; ``retryable`` is False when resending the same payload can't help."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class BrevoTransport:
+    """
+    Brevo transactional email API over one pooled ``httpx.AsyncClient``.
+
+    Connections are kept alive between sends (no TLS handshake per email) and
+    every call has a timeout. A batch goes out as one request: the first
+    message is the base and every message is a ``messageVersions`` entry with
+    its own recipients, subject and body.
+
+    Args:
+        api_key: Brevo API key
+        sender_email: From address
+        sender_name: From name
+        base_url: API root (point it at ``mail_stub.py`` for local runs)
+        timeout_s: Connect/read/write timeout per request
+        max_connections: Connection pool size
+        transport: Optional httpx transport (e.g. ``httpx.ASGITransport`` for tests)
+    """
+
+    name = "brevo"
+    # Brevo accepts up to 1000 message versions per request
+    max_batch_size = 1000
+
+    def __init__(
+        self,
+        api_key: str,
+        sender_email: str,
+        sender_name: str,
+        base_url: str = "https://api.brevo.com",
+        timeout_s: float = 10.0,
+        max_connections: int = 10,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.sender = {"name": sender_name, "email": sender_email}
+        self._client_kwargs = dict(
+            base_url=base_url.rstrip("/"),
+            headers={"accept": "application/json", "api-key": api_key},
+            timeout=httpx.Timeout(timeout_s),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+        # Created on first use so it binds to the serving loop (and again after close())
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def send(self, messages: Sequence[OutboxMessage]):
+        """Send ``messages`` in one API call; raises ``MailError`` on failure."""
+        first = messages[0]
+        payload = {
+            "sender": self.sender,
+            "subject": first.subject,
+            "htmlContent": first.html,
+        }
+        if len(messages) == 1:
+            payload["to"] = [{"email": email} for email in first.recipients]
+        else:
+            payload["messageVersions"] = [
+                {"to": [{"email": email} for email in m.recipients], "subject": m.subject, "htmlContent": m.html}
+                for m in messages
+            ]
+        if self._client is None:
+            self._client = httpx.AsyncClient(**self._client_kwargs)
+        try:
+            response = await self._client.post("/v3/smtp/email", json=payload)
+        except httpx.HTTPError as e:
+            raise MailError(f"{e.__class__.__name__}: {e}")
+        if response.status_code not in (200, 201, 202):
+            # 4xx other than rate limiting means the payload itself was rejected
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise MailError(f"HTTP {response.status_code}: {response.text[:200]}", retryable=retryable)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class EmailOutbox:
+    """
+    Persistent email queue with batching, retries and exponential backoff.
+
+    ``enqueue`` only writes a row to SQLite (on a dedicated thread), so a burst
+    of registrations costs the request path nothing but an insert. A background
+    task claims due rows in batches, sends them through ``transport`` and
+    deletes them once accepted; failures are retried with exponential backoff
+    until ``max_attempts``, after which they stay in the table as ``failed``.
+    Rows are claimed with a lease, so several API workers can share one file;
+    delivery is at-least-once (a crash mid-send resends after the lease).
+
+    Args:
+        path: SQLite file (created if missing)
+        transport: Sender with ``async send(messages)`` (``None`` drops mail with a warning)
+        batch_size: Messages per API call
+        max_attempts: Attempts before a message is marked failed
+        backoff_s: Delay before the first retry, doubled per attempt (capped at 1 h)
+        lease_s: How long a claimed batch is reserved for this worker
+    """
+
+    def __init__(
+        self,
+        path: str,
+        transport=None,
+        batch_size: int = 50,
+        max_attempts: int = 5,
+        backoff_s: float = 5.0,
+        lease_s: float = 60.0,
+    ):
+        self.path = path
+        self.transport = transport
+        self.batch_size = max(1, min(int(batch_size), getattr(transport, "max_batch_size", batch_size)))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_s = backoff_s
+        self.lease_s = lease_s
+
+        # One thread owns the connection, so SQLite calls never block the loop or each other
+        self._db_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.transport is not None
+
+    # --- storage (runs on the outbox thread) ---
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipients TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    html TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _insert(self, recipients: List[str], subject: str, html: str):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT INTO outbox (recipients, subject, html, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (json.dumps(recipients), subject, html, now, now),
+        )
+        conn.commit()
+
+    def _claim(self) -> List[OutboxMessage]:
+        conn = self._connect()
+        now, owner = time.time(), uuid.uuid4().hex
+        with conn:
+            conn.execute(
+                """
+                UPDATE outbox SET lease_owner = ?, lease_until = ?
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ?
+                    ORDER BY id LIMIT ?
+                )
+                """,
+                (owner, now + self.lease_s, now, now, self.batch_size),
+            )
+        rows = conn.execute(
+            "SELECT id, recipients, subject, html, attempts FROM outbox WHERE lease_owner = ? ORDER BY id", (owner,)
+        ).fetchall()
+        return [OutboxMessage(row[0], json.loads(row[1]), row[2], row[3], row[4]) for row in rows]
+
+    def _next_due(self) -> Optional[float]:
+        row = self._connect().execute(
+            "SELECT MIN(MAX(next_attempt_at, lease_until)) FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def _mark_sent(self, ids: List[int]):
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def _mark_failed(self, messages: List[OutboxMessage], error: str, retryable: bool) -> int:
+        """Schedule retries (or give up); returns how many messages gave up."""
+        conn = self._connect()
+        now, gave_up = time.time(), 0
+        with conn:
+            for m in messages:
+                attempts = m.attempts + 1
+                if not retryable or attempts >= self.max_attempts:
+                    status, next_at = "failed", now
+                    gave_up += 1
+                else:
+                    status, next_at = "pending", now + min(3600.0, self.backoff_s * 2 ** (attempts - 1))
+                conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, lease_owner = NULL, "
+                    "lease_until = 0, last_error = ? WHERE id = ?",
+                    (status, attempts, next_at, error[:500], m.id),
+                )
+        return gave_up
+
+    def _counts(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return dict(rows)
+
+    async def _db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_pool, fn, *args)
+
+    # --- public API ---
+    async def enqueue(self, subject: str, recipients: List[str], html: str):
+        """Persist one email for delivery; returns once it is on disk."""
+        if not self.enabled:
+            logger.warning("⚠️ Mail transport not configured. Skipping email to %s.", recipients)
+            return
+        await self._db(self._insert, list(recipients), subject, html)
+        self.enqueued += 1
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        """Start the delivery task on the running loop (idempotent); also resumes rows left from earlier runs."""
+        if self.enabled and (self._worker is None or self._worker.done()):
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Let the worker finish what is due now (up to ``timeout``), then stop it."""
+        if self._worker is not None:
+            self._stopping = True
+            self._wake.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._worker), timeout)
+            except asyncio.TimeoutError:
+                self._worker.cancel()
+            self._worker = None
+        if self.transport is not None:
+            await self.transport.close()
+
+    async def _run(self):
+        errors = 0
+        while True:
+            batch: List[OutboxMessage] = []
+            try:
+                batch = await self._db(self._claim)
+                if batch:
+                    await self._deliver(batch)
+                    errors = 0
+                    continue
+                if self._stopping:
+                    return
+                # Sleep until the next retry is due or something is enqueued
+                next_due = await self._db(self._next_due)
+                delay = 60.0 if next_due is None else max(0.0, min(60.0, next_due - time.time()))
+                errors = 0
+            except Exception as e:
+                # e.g. "database is locked": back off but keep the worker alive; rows
+                # claimed by this round are retried once their lease expires
+                errors += 1
+                delay = min(60.0, self.backoff_s * 2 ** (errors - 1))
+                logger.exception(
+                    "❌ Email outbox error (rows %s); retrying in %.1fs: %s", [m.id for m in batch], delay, e,
+                    extra={"ids": [m.id for m in batch]},
+                )
+                if self._stopping:
+                    return
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, batch: List[OutboxMessage]):
+        started = time.perf_counter()
+        try:
+            await self.transport.send(batch)
+        except Exception as e:
+            MAIL_SEND_SECONDS.observe(time.perf_counter() - started, outcome="error")
+            if not isinstance(e, MailError):
+                # A bug or an unwrapped client error: retried with backoff like a transient failure
+                logger.exception("❌ Unexpected error sending rows %s", [m.id for m in batch], extra={"ids": [m.id for m in batch]})
+                e = MailError(f"{e.__class__.__name__}: {e}")
+            if len(batch) > 1 and not e.retryable:
+                # One bad message shouldn't sink the rest: resend them one by one
+                for message in batch:
+                    await self._deliver([message])
+                return
+            gave_up = await self._db(self._mark_failed, batch, str(e), e.retryable)
+            self.retries += len(batch) - gave_up
+            self.failed += gave_up
+            log = logger.error if gave_up else logger.warning
+            log("❌ Email batch of %d failed (%s); %d will be retried", len(batch), e, len(batch) - gave_up)
+            return
+        MAIL_SEND_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+        await self._db(self._mark_sent, [m.id for m in batch])
+        self.sent += len(batch)
+        self.batches += 1
+        logger.info("✅ Sent %d email(s) via %s", len(batch), self.transport.name, extra={"ids": [m.id for m in batch]})
+
+    def stats(self) -> dict:
+        """Counters for this process (cheap enough for every metrics scrape)."""
+        return {
+            "transport": self.transport.name if self.transport is not None else None,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+    async def backlog(self) -> dict:
+        """Rows in the outbox by status, across every process sharing the file."""
+        return await self._db(self._counts) if self.enabled else {}
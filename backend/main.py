@@ -4,30 +4,40 @@ import io
 import uuid
 import logging
 import asyncio
-import requests # Added for Brevo API
+import time
+import hashlib
+import json
+import tarfile
+import zipfile
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Deque, Tuple
 
 # --- 1. ENV VARS SETUP ---
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends, status, Form, BackgroundTasks
+# Logs are queued and written by a background thread (LOG_LEVEL, LOG_FORMAT=json|text,
+# LOG_SAMPLE_RATE for per-request lines); set up first so import-time warnings use it too
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logs import setup_logging, get_logger, SAMPLED
+setup_logging()
+logger = get_logger("api")
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response, Depends, status, Form, BackgroundTasks, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.routing import Match
 from pydantic import BaseModel, EmailStr
 
 import torch
-import torch.nn as nn
-from torchvision import transforms, models as torchvision_models
+from torchvision import transforms
 from PIL import Image
 
 # --- External Services (Safe Import) ---
 try:
     import pymongo
-    from bson import ObjectId
     import cloudinary
     import cloudinary.uploader
     from passlib.context import CryptContext
@@ -36,36 +46,35 @@ try:
     # We no longer strictly need fastapi_mail if using API, but keeping for compatibility
     from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 except ImportError:
-    print("⚠️  Warning: Missing dependencies. Run: pip install -r backend/requirements.txt")
+    logger.warning("⚠️  Missing dependencies. Run: pip install -r backend/requirements.txt")
     # Dummy classes for safe execution if deps missing
     class CryptContext: 
         def __init__(self, **kwargs): pass
         def hash(self, p): return p + "_hashed"
         def verify(self, p, h): return h == p + "_hashed"
-    class ObjectId: 
-        def __init__(self, oid): self.oid = str(oid)
     JWTError = Exception
     FastMail = None 
 
 # --- LOCAL IMPORTS ---
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 try:
     import config  # Your new config file
-    # We import get_student_model for the baseline checkpoints (timm style)
-    from models import get_student_model 
 except ImportError:
-    print("⚠️  Warning: Could not import local modules (config/models). Ensure they exist.")
+    logger.warning("⚠️  Could not import local modules (config/models). Ensure they exist.")
     class ConfigMock:
         NUM_CLASSES = 200
         IMAGE_SIZE = 64
         DEVICE = "cpu"
     config = ConfigMock()
-    # Fallback if models.py is missing entirely
-    def get_student_model(num_classes=200):
-        print(f"⚠️ models.py missing, returning torchvision fallback with {num_classes} classes")
-        model = torchvision_models.efficientnet_b0(pretrained=False)
-        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
-        return model
+
+from inference import MicroBatcher, InferenceQueueFull, create_inference_executor, gather_with_budgets
+from cache import LRUTTLCache
+from uploads import CloudinaryUploader, LocalUploader, UploadQueue
+from storage import MongoStore, MemoryStore
+from model_registry import ModelRegistry, MODEL_CHECKPOINTS
+from auth_guard import PasswordHasher, HasherBusy, RateLimiter, RateLimited
+from mailer import BrevoTransport, EmailOutbox
+from cascade import CascadePolicy
+from metrics import REGISTRY as METRICS_REGISTRY, CONTENT_TYPE_LATEST, histogram, gauge, counter, span, start_trace, end_trace
 
 # =============================================================================
 # 2. CONFIGURATION & MOCK SWITCH
@@ -81,17 +90,151 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 MAIL_API_KEY = os.getenv("MAIL_PASSWORD") # Reuse the Brevo Key (xkeysib-...)
 MAIL_SENDER_EMAIL = os.getenv("MAIL_FROM", "noreply@deepdistill.app")
 MAIL_SENDER_NAME = "DeepDistill Admin"
+# Emails are queued in a SQLite outbox and sent by a background task over pooled
+# connections, batched and retried with backoff. Point MAIL_API_URL at mail_stub.py locally.
+MAIL_API_URL = os.getenv("MAIL_API_URL", "https://api.brevo.com")
+MAIL_OUTBOX_PATH = os.getenv("MAIL_OUTBOX_PATH", os.path.join(os.getcwd(), "mail_outbox.sqlite3"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_BACKOFF_S = float(os.getenv("MAIL_RETRY_BACKOFF_S", "5"))
+MAIL_TIMEOUT_S = float(os.getenv("MAIL_TIMEOUT_S", "10"))
+MAIL_MAX_CONNECTIONS = int(os.getenv("MAIL_MAX_CONNECTIONS", "10"))
 
 # --- FRONTEND URL CONFIGURATION ---
 # Default to Hugging Face Space URL if not set
 FRONTEND_URL = os.getenv("FRONTEND_URL", "https://huggingface.co/spaces/bembeng123")
 
+# --- MONGODB POOL CONFIGURATION ---
+# DB calls run on a thread pool of the same size as the driver's connection pool
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "32"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "4"))
+# Let a MongoDB TTL index expire unverified users instead of the hourly cleanup loop
+UNVERIFIED_USER_TTL_INDEX = os.getenv("UNVERIFIED_USER_TTL_INDEX", "1") == "1"
+UNVERIFIED_USER_TTL_S = 24 * 3600
+
+# --- IMAGE UPLOAD CONFIGURATION ---
+# "cloudinary", "local" (stand-in that writes under LOCAL_UPLOAD_DIR) or "none"
+UPLOAD_BACKEND = os.getenv("UPLOAD_BACKEND", "cloudinary" if CLOUDINARY_CLOUD_NAME else "none").strip().lower()
+LOCAL_UPLOAD_DIR = os.getenv("LOCAL_UPLOAD_DIR", os.path.join(os.getcwd(), "uploads"))
+LOCAL_UPLOAD_LATENCY_MS = float(os.getenv("LOCAL_UPLOAD_LATENCY_MS", "0"))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", "4"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "2"))
+# How long predict waits for the upload once inference is done; after that the
+# URL is patched into the history entry in the background
+UPLOAD_WAIT_MS = float(os.getenv("UPLOAD_WAIT_MS", "1500"))
+
+# --- HISTORY PAGINATION ---
+HISTORY_DEFAULT_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 200
+
+# --- INFERENCE BATCHING CONFIGURATION ---
+# Concurrent /api/predict requests are coalesced into one forward pass per model.
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "32"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+
+# --- INFERENCE EXECUTOR CONFIGURATION ---
+# "thread" runs models on a dedicated thread pool, "process" on worker processes
+# that each hold their own model replicas. Either way the event loop stays free.
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread").strip().lower()
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 0 = torch default for threads, cores / INFERENCE_WORKERS per process worker
+TORCH_INTRA_OP_THREADS = int(os.getenv("TORCH_INTRA_OP_THREADS", "0"))
+INFERENCE_MAX_QUEUE_DEPTH = int(os.getenv("INFERENCE_MAX_QUEUE_DEPTH", "64"))
+INFERENCE_RETRY_AFTER_S = int(os.getenv("INFERENCE_RETRY_AFTER_S", "1"))
+INFERENCE_PREP_WORKERS = int(os.getenv("INFERENCE_PREP_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# --- MODEL REGISTRY CONFIGURATION ---
+# Checkpoints load on first use; past the budget the least recently used model is evicted.
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # 0 = unlimited
+# Comma-separated model keys (or "all") to load at startup instead of on first request;
+# preloads run concurrently
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", "").split(",") if m.strip()]
+
+# Graph optimization after load: "off" (eager), "fuse" (BN folding + channels_last),
+# "trace" (+ frozen TorchScript) or "compile" (+ torch.compile). Falls back to eager on failure.
+INFERENCE_COMPILE = os.getenv("INFERENCE_COMPILE", "off").strip().lower()
+
+# Models served from their exported .onnx graph (export_onnx.py) with ONNX Runtime on CPU:
+# comma-separated keys or "all"
+ONNX_MODELS = [m.strip() for m in os.getenv("ONNX_MODELS", "").split(",") if m.strip()]
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 = onnxruntime default
+
+# --- BATCH PREDICTION LIMITS ---
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "256"))
+BATCH_MAX_BYTES = int(float(os.getenv("BATCH_MAX_MB", "200")) * 1024 * 1024)  # after decompression
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+# --- PREDICTION CACHE ---
+# Results are keyed by the SHA-256 of the upload plus the versions of the models that ran
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "1024"))
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", "3600"))
+PREDICTION_CACHE_MAX_MB = float(os.getenv("PREDICTION_CACHE_MAX_MB", "32"))
+
+# --- LATENCY BUDGETS ---
+# Per-model ceilings, e.g. "teacher_b2_tiny=40,teacher_r18_tiny=40" (ms). Models that
+# miss their budget are left out of the response instead of delaying the others.
+INFERENCE_DEFAULT_BUDGET_MS = float(os.getenv("INFERENCE_DEFAULT_BUDGET_MS", "0"))  # 0 = no limit
+MODEL_LATENCY_BUDGETS_MS = {
+    key.strip(): float(value)
+    for key, _, value in (
+        item.partition("=") for item in os.getenv("MODEL_LATENCY_BUDGETS_MS", "").split(",") if "=" in item
+    )
+}
+
+# --- CASCADE INFERENCE ---
+# mode=cascade on /api/predict runs a distilled student first and escalates to a teacher
+# only when the student's top-1 probability or top-1/top-2 margin is below threshold.
+# Thresholds come from calibrate_cascade.py (CASCADE_THRESHOLDS_PATH); env values override.
+PREDICT_DEFAULT_MODE = os.getenv("PREDICT_DEFAULT_MODE", "all").strip().lower()  # "all" or "cascade"
+CASCADE_THRESHOLDS_PATH = os.getenv(
+    "CASCADE_THRESHOLDS_PATH", os.path.join(getattr(config, "RESULTS_DIR", "./results"), "cascade_thresholds.json")
+)
+CASCADE_STUDENT = os.getenv("CASCADE_STUDENT")  # default: calibration file, else distilled_b0
+CASCADE_TEACHER = os.getenv("CASCADE_TEACHER")  # default: calibration file, else teacher_b2_tiny
+CASCADE_MIN_CONFIDENCE = float(os.environ["CASCADE_MIN_CONFIDENCE"]) if os.getenv("CASCADE_MIN_CONFIDENCE") else None
+CASCADE_MIN_MARGIN = float(os.environ["CASCADE_MIN_MARGIN"]) if os.getenv("CASCADE_MIN_MARGIN") else None
+
+# --- METRICS & TRACING ---
+# Every request gets a trace (id from X-Request-ID when sent); its spans are returned in
+# the Server-Timing header and logged for requests slower than TRACE_SLOW_MS (0 = never)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+
+# --- AUTH HARDENING ---
+# Argon2 runs on its own small thread pool so logins never stall the event loop (or take
+# every core from inference); past PASSWORD_HASH_MAX_PENDING, auth requests get a 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+# Auth attempts allowed per minute per client IP and per email (0 = unlimited), with bursts
+# of the same size; beyond that the endpoints answer 429
+AUTH_RATE_PER_MIN_IP = float(os.getenv("AUTH_RATE_PER_MIN_IP", "30"))
+AUTH_RATE_PER_MIN_EMAIL = float(os.getenv("AUTH_RATE_PER_MIN_EMAIL", "10"))
+# Reverse proxies in front of the app (Hugging Face Spaces: 1). Each appends the address it
+# saw to X-Forwarded-For, so the client is the N-th hop from the right; the hops left of it
+# are written by the client and never trusted. 0 = use the socket peer address.
+AUTH_TRUSTED_PROXY_HOPS = int(os.getenv("AUTH_TRUSTED_PROXY_HOPS", "1"))
+
+# --- AUTH USER CACHE ---
+# Authenticated requests reuse the decoded token and the user record for a few seconds
+# instead of hitting the DB each time. Writes in this process invalidate immediately;
+# the TTL bounds how stale other workers' copies can get.
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "30"))  # 0 = disabled
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
 # --- MOCK DATABASE (In-Memory) ---
 MOCK_USERS: Dict[str, dict] = {} 
-MOCK_HISTORY: List[dict] = []
+MOCK_HISTORY: Dict[str, Deque[Tuple[int, dict]]] = {}  # user_id -> newest-first (seq, entry)
+MOCK_HISTORY_RETENTION = int(os.getenv("MOCK_HISTORY_RETENTION", "500"))  # per user
 
 # Auth Setup
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+password_hasher = PasswordHasher(
+    pwd_context, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING
+)
+# token -> decoded claims, and (subject, token) -> user record
+auth_claims_cache = LRUTTLCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl_s=AUTH_CACHE_TTL_S)
+auth_user_cache = LRUTTLCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl_s=AUTH_CACHE_TTL_S)
+auth_ip_limiter = RateLimiter(AUTH_RATE_PER_MIN_IP)
+auth_email_limiter = RateLimiter(AUTH_RATE_PER_MIN_EMAIL)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
 # Cloudinary Setup
@@ -102,29 +245,60 @@ if CLOUDINARY_CLOUD_NAME:
         api_secret=os.getenv("CLOUDINARY_API_SECRET")
     )
 
+# Upload Queue Setup
+if UPLOAD_BACKEND == "cloudinary" and CLOUDINARY_CLOUD_NAME:
+    image_uploader = CloudinaryUploader()
+elif UPLOAD_BACKEND == "local":
+    image_uploader = LocalUploader(LOCAL_UPLOAD_DIR, latency_ms=LOCAL_UPLOAD_LATENCY_MS)
+else:
+    image_uploader = None
+upload_queue = UploadQueue(image_uploader, max_concurrency=UPLOAD_MAX_CONCURRENCY, max_retries=UPLOAD_MAX_RETRIES)
+
+# Email Outbox Setup
+if MAIL_API_KEY:
+    mail_transport = BrevoTransport(
+        MAIL_API_KEY, MAIL_SENDER_EMAIL, MAIL_SENDER_NAME,
+        base_url=MAIL_API_URL, timeout_s=MAIL_TIMEOUT_S, max_connections=MAIL_MAX_CONNECTIONS,
+    )
+else:
+    logger.warning("⚠️ MAIL_PASSWORD (API Key) missing. Emails will be skipped.")
+    mail_transport = None
+mail_outbox = EmailOutbox(
+    MAIL_OUTBOX_PATH, mail_transport,
+    batch_size=MAIL_BATCH_SIZE, max_attempts=MAIL_MAX_ATTEMPTS, backoff_s=MAIL_RETRY_BACKOFF_S,
+)
+
 # MongoDB Setup
 db_client = None
 db = None
 
 if MONGO_URI:
-    print(f"🔄 Connecting to MongoDB...")
+    logger.info("🔄 Connecting to MongoDB...")
     try:
         db_client = pymongo.MongoClient(
             MONGO_URI, 
             serverSelectionTimeoutMS=5000, 
             tlsAllowInvalidCertificates=True,
-            uuidRepresentation='standard'
+            uuidRepresentation='standard',
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE
         )
         db_client.admin.command('ping')
         db = db_client["deep_distill_db"]
-        print("✅ Connected to MongoDB Atlas")
+        logger.info("✅ Connected to MongoDB Atlas")
     except Exception as e:
-        print(f"⚠️  DB Connection Error: {e}")
-        print("🚀  Falling back to MOCK MODE. App is running normally!")
+        logger.warning("⚠️  DB Connection Error: %s", e)
+        logger.warning("🚀  Falling back to MOCK MODE. App is running normally!")
         db = None 
         db_client = None
 else:
-    print("⚠️  No MONGO_URI found. Running in MOCK MODE.")
+    logger.warning("⚠️  No MONGO_URI found. Running in MOCK MODE.")
+
+# Every handler goes through this async store; both backends share one interface
+if db is not None:
+    store = MongoStore(db, max_workers=MONGO_MAX_POOL_SIZE)
+else:
+    store = MemoryStore(MOCK_USERS, MOCK_HISTORY, history_retention=MOCK_HISTORY_RETENTION)
 
 # =============================================================================
 # 3. DATA MODELS
@@ -149,11 +323,41 @@ class Token(BaseModel):
 # =============================================================================
 # 4. HELPER FUNCTIONS
 # =============================================================================
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def hasher_busy_error(e: HasherBusy) -> HTTPException:
+    return HTTPException(
+        503,
+        "Too many sign-ins in progress, please retry shortly",
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_password_hash(password):
+    """Argon2 hash on the hasher pool (keeps the event loop free)"""
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy as e:
+        raise hasher_busy_error(e)
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HasherBusy as e:
+        raise hasher_busy_error(e)
+
+def client_ip(request: Request) -> str:
+    if AUTH_TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+        if len(hops) >= AUTH_TRUSTED_PROXY_HOPS:
+            return hops[-AUTH_TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def admit_auth_attempt(request: Request, email: Optional[str] = None):
+    """Rate-limit auth attempts per client IP and per email before any hashing happens"""
+    try:
+        auth_ip_limiter.hit(client_ip(request))
+        if email:
+            auth_email_limiter.hit(email.strip().lower())
+    except RateLimited as e:
+        raise HTTPException(429, "Too many attempts, please retry later", headers={"Retry-After": str(e.retry_after)})
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -161,7 +365,7 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
 
-def cleanup_unverified_user(user):
+async def cleanup_unverified_user(user):
     # This function checks a single user upon login
     if user.get("is_verified", False):
         return False 
@@ -176,11 +380,7 @@ def cleanup_unverified_user(user):
     if not created_at: return False
 
     if datetime.utcnow() - created_at > timedelta(hours=24):
-        if db is not None:
-            db.users.delete_one({"_id": user["_id"]})
-        else:
-            if user["email"] in MOCK_USERS:
-                del MOCK_USERS[user["email"]]
+        await store.delete_user(user)
         return True 
     
     return False
@@ -192,64 +392,52 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None: raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = None
-    if db is not None:
-        user = db.users.find_one({"email": email})
-        if user:
-            user["id"] = str(user["_id"])
-    elif email in MOCK_USERS:
-        user = MOCK_USERS[email]
-        
-    if not user:
+    payload = auth_claims_cache.get(token) if AUTH_CACHE_TTL_S > 0 else None
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
+        except JWTError:
+            raise credentials_exception
+        if AUTH_CACHE_TTL_S > 0:
+            auth_claims_cache.set(token, payload)
+    elif payload.get("exp", 0) < time.time():
+        # Expired while cached
+        auth_claims_cache.invalidate(token)
         raise credentials_exception
-
-    if cleanup_unverified_user(user):
+    email: str = payload.get("sub")
+    if email is None: raise credentials_exception
+
+    user = auth_user_cache.get((email, token)) if AUTH_CACHE_TTL_S > 0 else None
+    if user is None:
+        user = await store.get_user_by_email(email)
+        if not user:
+            raise credentials_exception
+        if AUTH_CACHE_TTL_S > 0:
+            auth_user_cache.set((email, token), user)
+
+    if await cleanup_unverified_user(user):
+        invalidate_cached_user(email)
         raise HTTPException(
             status_code=401, 
             detail="Account deleted: Email not verified within 24 hours."
         )
 
-    return user
+    # Handlers get their own copy, so the cached record can't be changed under other requests
+    return dict(user)
+
+def invalidate_cached_user(email: str):
+    """Drop every cached copy of a user's record (call after writing to it)"""
+    auth_user_cache.invalidate_where(lambda key: key[0] == email)
 
 async def send_email_via_api(subject: str, recipients: List[str], html_content: str):
     """
-    Sends email using Brevo's HTTP API.
-    This works on Hugging Face Spaces where SMTP ports (25, 465, 587) are blocked.
+    Queues an email for Brevo's HTTP API (SMTP ports are blocked on Hugging Face Spaces).
+    Delivery, batching and retries happen in the background outbox worker.
     """
-    if not MAIL_API_KEY:
-        print("⚠️ MAIL_PASSWORD (API Key) missing. Skipping email.")
-        return
-
-    url = "https://api.brevo.com/v3/smtp/email"
-    headers = {
-        "accept": "application/json",
-        "api-key": MAIL_API_KEY,
-        "content-type": "application/json"
-    }
-    
-    # Brevo API Payload
-    payload = {
-        "sender": {"name": MAIL_SENDER_NAME, "email": MAIL_SENDER_EMAIL},
-        "to": [{"email": email} for email in recipients],
-        "subject": subject,
-        "htmlContent": html_content
-    }
-
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code in [200, 201, 202]:
-            print(f"✅ Email sent via API to {recipients}")
-        else:
-            print(f"❌ Brevo API Error {response.status_code}: {response.text}")
+        await mail_outbox.enqueue(subject, recipients, html_content)
     except Exception as e:
-        print(f"❌ Email API Connection Error: {e}")
+        logger.error("❌ Email Queue Error: %s", e)
 
 # =============================================================================
 # 5. APP SETUP & AI MODELS
@@ -262,10 +450,66 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Trace-Id", "Server-Timing"],
 )
 
-# Global dictionary to store all loaded models
-models_dict = {}
+HTTP_REQUEST_SECONDS = histogram(
+    "deepdistill_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = gauge("deepdistill_http_requests_in_flight", "HTTP requests being handled")
+CASCADE_ANSWERS = counter(
+    "deepdistill_cascade_answers_total", "Cascade predictions by the tier that answered", ("tier",)
+)
+MODEL_LATENCY_SECONDS = histogram(
+    "deepdistill_model_latency_seconds", "Per-image model latency (batching wait + forward pass)", ("model",)
+)
+
+def route_template(scope: dict) -> str:
+    """Path template of the route a request matches (keeps metric label cardinality bounded)"""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace, token = start_trace(request.headers.get("X-Request-ID"))
+    route = route_template(request.scope)
+    HTTP_IN_FLIGHT.inc()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - trace.started
+        HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=status_code)
+        if TRACE_SLOW_MS and trace.spans and elapsed * 1000 >= TRACE_SLOW_MS:
+            logger.warning(
+                "🐢 %s %s took %.0f ms: %s", request.method, route, elapsed * 1000, trace.server_timing(),
+                extra={"status": status_code, "duration_ms": round(elapsed * 1000, 1), "spans": trace.spans},
+            )
+        end_trace(token)
+
+    response.headers["X-Trace-Id"] = trace.trace_id
+    if trace.spans:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+if isinstance(image_uploader, LocalUploader):
+    os.makedirs(LOCAL_UPLOAD_DIR, exist_ok=True)
+    app.mount("/uploads", StaticFiles(directory=LOCAL_UPLOAD_DIR), name="uploads")
+
+# One request-coalescing batcher per available model
+model_batchers: Dict[str, MicroBatcher] = {}
+# Executor that runs preprocessing and forward passes off the event loop
+inference_executor = None
+prediction_cache = LRUTTLCache(
+    max_entries=PREDICTION_CACHE_MAX_ENTRIES,
+    ttl_s=PREDICTION_CACHE_TTL_S,
+    max_bytes=int(PREDICTION_CACHE_MAX_MB * 1024 * 1024),
+)
 device = torch.device(config.DEVICE if torch.cuda.is_available() else 'cpu')
 
 # TinyImageNet has 200 classes.
@@ -276,98 +520,42 @@ TINY_IMAGENET_LABELS = [
 ]
 
 
-def inspect_and_load_architecture(model_key: str, checkpoint_path: str, arch_name: str, num_classes: int):
-    """
-    Intelligently loads model architecture based on the checkpoint file content.
-    Includes DEBUG checks for label size mismatches.
-    """
-    try:
-        # Load state dict first to inspect keys
-        state = torch.load(checkpoint_path, map_location=device)
-        if isinstance(state, dict) and 'model_state_dict' in state:
-            state = state['model_state_dict']
-        
-        # Determine Architecture Type
-        has_features = any(k.startswith('features.') for k in state.keys())
-        has_conv_stem = any(k.startswith('conv_stem') for k in state.keys())
-        
-        model = None
-        
-        if "efficientnet_b0" in arch_name:
-            if has_features:
-                print(f"[{model_key}] Detected Torchvision format")
-                model = torchvision_models.efficientnet_b0(weights=None)
-                model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
-            elif has_conv_stem:
-                print(f"[{model_key}] Detected Custom/Timm format")
-                model = get_student_model(num_classes=num_classes)
-            else:
-                print(f"[{model_key}] Unknown format, defaulting to Torchvision")
-                model = torchvision_models.efficientnet_b0(weights=None)
-                model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
-                
-        elif "efficientnet_b2" in arch_name:
-            model = torchvision_models.efficientnet_b2(weights=None)
-            model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
-            
-        elif "resnet18" in arch_name:
-            model = torchvision_models.resnet18(weights=None)
-            model.fc = nn.Linear(model.fc.in_features, num_classes)
-            
-        else:
-            print(f"⚠️ Unknown architecture {arch_name}, skipping")
-            return None
-
-        # Load weights
-        model.to(device)
-        model.load_state_dict(state, strict=True)
-        model.eval()
-
-        # --- DEBUG: CHECK LABEL MISMATCH ---
-        final_layer = None
-        # Try to find the final classification layer
-        if hasattr(model, 'classifier') and isinstance(model.classifier, nn.Sequential):
-            # EfficientNet usually has classifier as Sequential(Dropout, Linear)
-            if len(model.classifier) > 1 and isinstance(model.classifier[-1], nn.Linear):
-                final_layer = model.classifier[-1]
-        elif hasattr(model, 'classifier') and isinstance(model.classifier, nn.Linear):
-            final_layer = model.classifier
-        elif hasattr(model, 'fc') and isinstance(model.fc, nn.Linear):
-            # ResNet usually uses 'fc'
-            final_layer = model.fc
-        
-        if final_layer and hasattr(final_layer, 'out_features'):
-            out_features = final_layer.out_features
-            num_labels_defined = len(TINY_IMAGENET_LABELS)
-            if out_features != num_labels_defined:
-                print(f"⚠️  [DEBUG] Label Mismatch for {model_key}!")
-                print(f"    - Model Output Classes: {out_features}")
-                print(f"    - Label List Length:    {num_labels_defined}")
-                print(f"    - This WILL cause index errors if the model predicts a class >= {num_labels_defined}")
-            else:
-                print(f"✅ [DEBUG] {model_key} verified: {out_features} output classes match label list.")
-        else:
-            print(f"⚠️  [DEBUG] Could not automatically verify output layer size for {model_key}.")
-        # -----------------------------------
-
-        return model
-
-    except Exception as e:
-        print(f"❌ Failed to load {model_key} from {checkpoint_path}: {e}")
-        return None
-
 # =============================================================================
 # MODEL CONFIGURATION & LOADING
 # =============================================================================
 
-# Map friendly names to (path_suffix, architecture_type)
-MODEL_CHECKPOINTS = {
-    "baseline_b0_tiny": ("checkpoints/baseline_b0_tinyimagenet/best_model.pth", "efficientnet_b0"),
-    "distilled_b0": ("checkpoints/distilled_b0/best_model.pth", "efficientnet_b0"),
-    "b0_aktp_tiny": ("checkpoints_aktp/b0_aktp_tiny_best.pth", "efficientnet_b0"),
-    "teacher_b2_tiny": ("checkpoints_aktp/teacher_b2_tiny.pth", "efficientnet_b2"),
-    "teacher_r18_tiny": ("checkpoints_aktp/teacher_r18_tiny.pth", "resnet18"),
-}
+# MODEL_CHECKPOINTS (friendly name -> (path_suffix, architecture_type)) lives in
+# model_registry.py so offline tools can share it without importing the app
+
+# Models are loaded on first use and evicted (LRU) past MODEL_MEMORY_BUDGET_MB
+model_registry = ModelRegistry(
+    MODEL_CHECKPOINTS,
+    TINY_IMAGENET_LABELS,
+    config.NUM_CLASSES,
+    device=device,
+    memory_budget_mb=MODEL_MEMORY_BUDGET_MB,
+    warmup_shape=(1, 3, config.IMAGE_SIZE, config.IMAGE_SIZE),
+    compile_mode=INFERENCE_COMPILE,
+    onnx_models=MODEL_CHECKPOINTS if ONNX_MODELS == ["all"] else ONNX_MODELS,
+    onnx_threads=ONNX_INTRA_OP_THREADS,
+)
+# Currently resident models and their class-name lookups (validated at load time)
+models_dict = model_registry.models
+model_label_tables = model_registry.label_tables
+# Checkpoint fingerprint per model, part of the prediction cache key
+model_versions = model_registry.versions
+
+# Student/teacher pair and thresholds for mode=cascade
+cascade_policy = CascadePolicy.load(
+    CASCADE_THRESHOLDS_PATH,
+    student=CASCADE_STUDENT,
+    teacher=CASCADE_TEACHER,
+    min_confidence=CASCADE_MIN_CONFIDENCE,
+    min_margin=CASCADE_MIN_MARGIN,
+)
+for _cascade_model in cascade_policy.models:
+    if _cascade_model not in MODEL_CHECKPOINTS:
+        logger.warning("⚠️ Cascade model %s is not in MODEL_CHECKPOINTS; mode=cascade will fail", _cascade_model)
 
 # Define transforms
 TINY_IMAGENET_TRANSFORM = transforms.Compose([
@@ -380,12 +568,18 @@ TINY_IMAGENET_TRANSFORM = transforms.Compose([
     )
 ])
 
+# Decode JPEGs at a reduced scale (at least JPEG_DRAFT_OVERSAMPLE x IMAGE_SIZE)
+FAST_JPEG_DECODE = os.getenv("FAST_JPEG_DECODE", "1") == "1"
+JPEG_DRAFT_OVERSAMPLE = 2
+
 MODEL_PREPROCESSING = {
     "baseline_b0_tiny": TINY_IMAGENET_TRANSFORM,
     "distilled_b0": TINY_IMAGENET_TRANSFORM,
     "b0_aktp_tiny": TINY_IMAGENET_TRANSFORM,
     "teacher_b2_tiny": TINY_IMAGENET_TRANSFORM,
     "teacher_r18_tiny": TINY_IMAGENET_TRANSFORM,
+    "distilled_b0_int8": TINY_IMAGENET_TRANSFORM,
+    "b0_aktp_tiny_int8": TINY_IMAGENET_TRANSFORM,
 }
 
 # --- BACKGROUND TASKS ---
@@ -393,100 +587,131 @@ async def periodic_cleanup_task():
     """Background task to cleanup unverified users older than 24h"""
     while True:
         try:
-            print("🧹 Running periodic cleanup of unverified users...")
+            logger.info("🧹 Running periodic cleanup of unverified users...")
             cutoff = datetime.utcnow() - timedelta(hours=24)
             
-            if db is not None:
-                # Delete unverified users created before cutoff
-                result = db.users.delete_many({
-                    "is_verified": False,
-                    "created_at": {"$lt": cutoff}
-                })
-                if result.deleted_count > 0:
-                    print(f"🗑️  Deleted {result.deleted_count} unverified users.")
-            else:
-                # Mock DB Cleanup
-                to_delete = []
-                for email, user in MOCK_USERS.items():
-                    # Handle potential string dates in mock
-                    created_at = user.get("created_at")
-                    if isinstance(created_at, str):
-                        try: created_at = datetime.fromisoformat(created_at)
-                        except: continue
-                    
-                    if created_at and not user.get("is_verified", False) and created_at < cutoff:
-                        to_delete.append(email)
-                
-                for email in to_delete:
-                    del MOCK_USERS[email]
-                if to_delete:
-                    print(f"🗑️  Deleted {len(to_delete)} unverified users (Mock).")
+            # Delete unverified users created before cutoff
+            deleted = await store.delete_unverified_before(cutoff)
+            if deleted > 0:
+                logger.info("🗑️  Deleted %d unverified users (%s).", deleted, store.kind)
                     
         except Exception as e:
-            print(f"⚠️ Cleanup task error: {e}")
+            logger.error("⚠️ Cleanup task error: %s", e)
             
         # Run every hour (3600 seconds)
         await asyncio.sleep(3600)
 
 async def load_models_logic():
-    global models_dict
-    print(f"🚀 Initializing models on {device}...")
-    print(f"ℹ️  Expect {len(TINY_IMAGENET_LABELS)} classes based on label list.")
-    
-    base_dirs = [
-        os.getcwd(),
-        os.path.join(os.getcwd(), "deepdistill", "backend"),
-        os.path.join(os.getcwd(), "backend"),
-        os.path.join(os.getcwd(), "deepdistill")
-    ]
-
-    for model_key, (rel_path, arch) in MODEL_CHECKPOINTS.items():
-        loaded_model = None
-        
-        # Find valid path
-        for base in base_dirs:
-            clean_rel_path = rel_path.replace("\\", os.sep).replace("/", os.sep)
-            full_path = os.path.join(base, clean_rel_path)
-            
-            if os.path.exists(full_path):
-                # Use the smart loader that checks file content
-                loaded_model = inspect_and_load_architecture(model_key, full_path, arch, config.NUM_CLASSES)
-                if loaded_model:
-                    models_dict[model_key] = loaded_model
-                    print(f"✅ Loaded {model_key}")
-                    break
-        
-        if not loaded_model:
-            print(f"⚠️ Could not load {model_key} (File not found or mismatch)")
+    logger.info("🚀 Initializing models on %s...", device)
+    logger.info("ℹ️  Expect %d classes based on label list.", len(TINY_IMAGENET_LABELS))
+
+    for model_key in MODEL_CHECKPOINTS:
+        if model_registry.state(model_key) == "missing":
+            logger.warning("⚠️ Could not find %s (File not found)", model_key)
+    available = model_registry.available_models()
+    logger.info("📚 %d models available, loaded on first use: %s", len(available), ", ".join(available))
+
+    preload = available if PRELOAD_MODELS == ["all"] else [m for m in PRELOAD_MODELS if m in available]
+    if not PRELOAD_MODELS and INFERENCE_COMPILE != "off":
+        # Compile + warm up now so no user request pays for it
+        preload = available
+    if preload:
+        await ensure_models_loaded(preload)
+
+async def ensure_models_loaded(model_names: List[str]) -> List[str]:
+    """Load models into this process (single-flight); process workers load their own replicas"""
+    if inference_executor is not None and inference_executor.loads_in_workers:
+        return [m for m in model_names if m in model_registry.available_models()]
+    with span("model_load"):
+        return await model_registry.ensure_loaded(model_names)
+
+def build_inference_executor():
+    """Create the inference executor selected by INFERENCE_EXECUTOR"""
+    global inference_executor
+    if inference_executor is not None:
+        inference_executor.shutdown()
+    inference_executor = create_inference_executor(
+        INFERENCE_EXECUTOR,
+        model_registry,
+        TINY_IMAGENET_LABELS,
+        label_tables=model_label_tables,
+        device=device,
+        workers=INFERENCE_WORKERS,
+        intra_op_threads=TORCH_INTRA_OP_THREADS,
+        max_queue_depth=INFERENCE_MAX_QUEUE_DEPTH,
+        retry_after=INFERENCE_RETRY_AFTER_S,
+        prep_workers=INFERENCE_PREP_WORKERS,
+    )
+    logger.info(
+        "🧵 Inference executor: %s (workers=%d, max_queue=%d)",
+        inference_executor.kind, INFERENCE_WORKERS, INFERENCE_MAX_QUEUE_DEPTH,
+    )
+
+def build_model_batchers():
+    """Create (or recreate) one micro-batcher per available model"""
+    model_batchers.clear()
+    for model_key in model_registry.available_models():
+        model_batchers[model_key] = MicroBatcher(
+            model_key,
+            inference_executor.batch_fn(model_key),
+            max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+            max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            executor=inference_executor.pool,
+            # One batch per executor worker, so a second batch needn't wait for the first
+            max_concurrent_batches=INFERENCE_WORKERS,
+        )
+    logger.info("📦 Micro-batching enabled (max_batch=%d, max_wait=%sms)", INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS)
 
 @app.on_event("startup")
 async def startup_event():
-    # 1. Load Models
-    await load_models_logic()
-    
-    # 2. Start Cleanup Task
-    asyncio.create_task(periodic_cleanup_task())
+    started = time.perf_counter()
+    # 1. Discover (and optionally preload) models while 2. DB indexes are provisioned
+    build_inference_executor()
+    _, ttl_ready = await asyncio.gather(
+        load_models_logic(),
+        store.ensure_indexes(UNVERIFIED_USER_TTL_S if UNVERIFIED_USER_TTL_INDEX else None),
+    )
+    build_model_batchers()
+    logger.info("⏱️  Ready in %.0f ms", (time.perf_counter() - started) * 1000)
+
+    # 3. Start Cleanup Task (unless a TTL index already expires unverified users)
+    if ttl_ready:
+        logger.info("🗂️  Unverified users expire via TTL index; periodic cleanup disabled.")
+    else:
+        asyncio.create_task(periodic_cleanup_task())
+
+    # 4. Deliver queued emails (including any left over from a previous run)
+    mail_outbox.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for batcher in model_batchers.values():
+        await batcher.stop()
+    if inference_executor is not None:
+        inference_executor.shutdown()
+    password_hasher.shutdown()
+    await upload_queue.drain(timeout=10)
+    await mail_outbox.stop(timeout=10)
+    store.close()
 
 # =============================================================================
-# 6. AUTH ENDPOINTS (Unchanged)
+# 6. AUTH ENDPOINTS
 # =============================================================================
 
 @app.post("/auth/register", response_model=Token)
-async def register(background_tasks: BackgroundTasks, user_data: UserRegister):
+async def register(request: Request, background_tasks: BackgroundTasks, user_data: UserRegister):
+    admit_auth_attempt(request, user_data.email)
     verification_token = str(uuid.uuid4())
     
     # Check User Existence
-    if db is not None:
-        if db.users.find_one({"email": user_data.email}):
-            raise HTTPException(400, "Email already registered")
-    elif user_data.email in MOCK_USERS:
+    if await store.get_user_by_email(user_data.email):
         raise HTTPException(400, "Email already registered")
 
     # Create User Data
     new_user = {
         "full_name": user_data.full_name,
         "email": user_data.email,
-        "password": get_password_hash(user_data.password),
+        "password": await get_password_hash(user_data.password),
         "avatar_url": None,
         "created_at": datetime.utcnow(),
         "is_verified": False,
@@ -494,13 +719,8 @@ async def register(background_tasks: BackgroundTasks, user_data: UserRegister):
     }
 
     # Insert into DB or Mock
-    if db is not None:
-        res = db.users.insert_one(new_user)
-        user_response = UserResponse(id=str(res.inserted_id), **new_user)
-    else:
-        new_user["id"] = str(uuid.uuid4())
-        MOCK_USERS[user_data.email] = new_user
-        user_response = UserResponse(**new_user)
+    await store.create_user(new_user)
+    user_response = UserResponse(**new_user)
 
     # SEND EMAIL (API WRAPPER)
     try:
@@ -520,68 +740,50 @@ async def register(background_tasks: BackgroundTasks, user_data: UserRegister):
             html_content=html
         )
     except Exception as e:
-        print(f"❌ Email Prep Failed: {e}")
+        logger.error("❌ Email Prep Failed: %s", e)
     
     access_token = create_access_token(data={"sub": user_data.email})
     return {"access_token": access_token, "token_type": "bearer", "user": user_response}
 
 @app.post("/auth/verify")
 async def verify_email(token: str = Form(...)):
-    if db is not None:
-        user = db.users.find_one({"verification_token": token})
-        if user:
-            db.users.update_one({"_id": user["_id"]}, {"$set": {"is_verified": True, "verification_token": None}})
-            return {"message": "Email verified successfully!"}
-    
-    for email, u in MOCK_USERS.items():
-        if u.get("verification_token") == token:
-            MOCK_USERS[email]["is_verified"] = True
-            MOCK_USERS[email]["verification_token"] = None
+    user = await store.get_user_by_verification_token(token)
+    if user:
+        await store.update_user(user, {"is_verified": True, "verification_token": None})
+        invalidate_cached_user(user["email"])
+        if store.kind == "MOCK":
             return {"message": "Email verified successfully (Mock)!"}
+        return {"message": "Email verified successfully!"}
             
     raise HTTPException(400, "Invalid verification token")
 
 @app.post("/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = None
-    if db is not None:
-        user_doc = db.users.find_one({"email": form_data.username})
-        if user_doc:
-            user_doc["id"] = str(user_doc["_id"])
-            user = user_doc
-    elif form_data.username in MOCK_USERS:
-        user = MOCK_USERS[form_data.username]
-
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    admit_auth_attempt(request, form_data.username)
+    user = await store.get_user_by_email(form_data.username)
     if not user:
         raise HTTPException(401, "Incorrect email or password")
 
-    if cleanup_unverified_user(user):
+    if await cleanup_unverified_user(user):
         raise HTTPException(401, "Account deleted: Email not verified within 24 hours.")
 
-    if not verify_password(form_data.password, user["password"]):
+    if not await verify_password(form_data.password, user["password"]):
         raise HTTPException(401, "Incorrect email or password")
     
     access_token = create_access_token(data={"sub": user["email"]})
     return {"access_token": access_token, "token_type": "bearer", "user": user}
 
 @app.post("/auth/forgot-password")
-async def forgot_password(background_tasks: BackgroundTasks, email: str = Form(...)):
-    user_found = None
-    if db is not None:
-        user_found = db.users.find_one({"email": email})
-    elif email in MOCK_USERS:
-        user_found = MOCK_USERS[email]
+async def forgot_password(request: Request, background_tasks: BackgroundTasks, email: str = Form(...)):
+    admit_auth_attempt(request, email)
+    user_found = await store.get_user_by_email(email)
 
     if user_found:
         reset_token = str(uuid.uuid4())
-        if db is not None:
-            db.users.update_one(
-                {"_id": user_found["_id"]}, 
-                {"$set": {"reset_token": reset_token, "reset_token_exp": datetime.utcnow() + timedelta(hours=1)}}
-            )
-        else:
-            MOCK_USERS[email]["reset_token"] = reset_token
-            MOCK_USERS[email]["reset_token_exp"] = datetime.utcnow() + timedelta(hours=1)
+        await store.update_user(
+            user_found,
+            {"reset_token": reset_token, "reset_token_exp": datetime.utcnow() + timedelta(hours=1)}
+        )
 
         try:
             # Use FRONTEND_URL environment variable to construct link
@@ -595,21 +797,14 @@ async def forgot_password(background_tasks: BackgroundTasks, email: str = Form(.
                 html_content=html
             )
         except Exception as e:
-            print(f"❌ Forgot Password Email Failed: {e}")
+            logger.error("❌ Forgot Password Email Failed: %s", e)
 
     return {"message": "If that email exists, we sent a reset link."}
 
 @app.post("/auth/reset-password")
-async def reset_password(token: str = Form(...), new_password: str = Form(...)):
-    user_found = None
-    if db is not None:
-        user_found = db.users.find_one({"reset_token": token})
-    else:
-        for email, u in MOCK_USERS.items():
-            if u.get("reset_token") == token:
-                user_found = u
-                break
-    
+async def reset_password(request: Request, token: str = Form(...), new_password: str = Form(...)):
+    admit_auth_attempt(request)
+    user_found = await store.get_user_by_reset_token(token)
     if not user_found:
         raise HTTPException(400, "Invalid or expired token")
 
@@ -617,17 +812,13 @@ async def reset_password(token: str = Form(...), new_password: str = Form(...)):
     if expiry and expiry < datetime.utcnow():
          raise HTTPException(400, "Token expired")
 
-    new_hash = get_password_hash(new_password)
+    new_hash = await get_password_hash(new_password)
     
-    if db is not None:
-        db.users.update_one(
-            {"_id": user_found["_id"]}, 
-            {"$set": {"password": new_hash, "reset_token": None, "reset_token_exp": None}}
-        )
-    else:
-        MOCK_USERS[user_found["email"]]["password"] = new_hash
-        MOCK_USERS[user_found["email"]]["reset_token"] = None
-        MOCK_USERS[user_found["email"]]["reset_token_exp"] = None
+    await store.update_user(
+        user_found,
+        {"password": new_hash, "reset_token": None, "reset_token_exp": None}
+    )
+    invalidate_cached_user(user_found["email"])
         
     return {"message": "Password updated successfully!"}
 
@@ -643,18 +834,15 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
 @app.put("/user/avatar")
 async def update_avatar(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
     image_url = f"https://api.dicebear.com/7.x/avataaars/svg?seed={current_user['email']}"
-    if CLOUDINARY_CLOUD_NAME:
-        try:
-            content = await file.read()
-            upload_result = cloudinary.uploader.upload(content, folder="user_avatars")
-            image_url = upload_result.get("secure_url")
-        except Exception as e:
-            print(f"Cloudinary error: {e}")
+    if upload_queue.enabled:
+        content = await file.read()
+        # Runs in a worker thread with retries, so the event loop stays free
+        uploaded_url = await upload_queue.submit(content, "user_avatars")
+        if uploaded_url:
+            image_url = uploaded_url
             
-    if db is not None:
-        db.users.update_one({"_id": ObjectId(current_user["id"])}, {"$set": {"avatar_url": image_url}})
-    else:
-        MOCK_USERS[current_user["email"]]["avatar_url"] = image_url
+    await store.update_user(current_user, {"avatar_url": image_url})
+    invalidate_cached_user(current_user["email"])
         
     return {"avatar_url": image_url}
 
@@ -662,52 +850,275 @@ async def update_avatar(file: UploadFile = File(...), current_user: dict = Depen
 # 8. INFERENCE & HISTORY
 # =============================================================================
 
-def get_topk(model, img_tensor, k=5):
-    """Run inference on a single model and return top K results"""
-    if model is None: return []
-    try:
-        with torch.no_grad():
-            logits = model(img_tensor)
-            probs = torch.softmax(logits, dim=1)
-            top_probs, top_indices = torch.topk(probs, k, dim=1)
-            results = []
-            for i in range(k):
-                idx = int(top_indices[0][i].item())
-                prob = float(top_probs[0][i].item()) * 100 
-                
-                # --- DEBUG CHECK: Index Validity ---
-                if idx < len(TINY_IMAGENET_LABELS):
-                    name = TINY_IMAGENET_LABELS[idx]
-                else:
-                    # Print debug info to console for the developer
-                    print(f"⚠️  [DEBUG] Inference Error: Predicted Class Index {idx} is out of bounds!")
-                    print(f"    - Max available label index: {len(TINY_IMAGENET_LABELS) - 1}")
-                    name = f"Unknown Class {idx} (OutOfBounds)"
-                
-                results.append({"class_id": idx, "class_name": name, "probability": round(prob, 2)})
-            return results
-    except Exception as e:
-        print(f"Error during inference: {e}")
-        return []
+def decode_image(image_data: bytes):
+    """Decode an upload to RGB, letting libjpeg downscale large JPEGs while decoding"""
+    image = Image.open(io.BytesIO(image_data))
+    if FAST_JPEG_DECODE and image.format == "JPEG":
+        # draft() picks the largest 1/2, 1/4 or 1/8 scale that still covers the
+        # requested size, so the Resize below never has to upsample
+        target = config.IMAGE_SIZE * JPEG_DRAFT_OVERSAMPLE
+        image.draft("RGB", (target, target))
+    return image.convert('RGB')
+
+def preprocess_image(image_data: bytes, model_names: List[str]):
+    """Decode an upload and apply each requested model's transform (runs off the event loop)"""
+    with span("decode"):
+        image = decode_image(image_data)
+    tensors = {}
+    # Models sharing a pipeline (all of them, today) share the resulting tensor
+    by_transform = {}
+    with span("transform"):
+        for model_name in model_names:
+            # Get the correct transform for this model
+            transform = MODEL_PREPROCESSING.get(model_name, TINY_IMAGENET_TRANSFORM)
+            if id(transform) not in by_transform:
+                by_transform[id(transform)] = transform(image)
+            tensors[model_name] = by_transform[id(transform)]
+    return tensors
+
+def parse_model_selection(models: Optional[str]) -> List[str]:
+    """Turn the comma-separated `models` form field into available model keys"""
+    available = model_registry.available_models()
+    if not models:
+        return available
+    requested = [m.strip() for m in models.split(",") if m.strip()]
+    unknown = [m for m in requested if m not in MODEL_CHECKPOINTS]
+    if unknown:
+        raise HTTPException(400, f"Unknown models: {', '.join(unknown)}. Choose from: {', '.join(MODEL_CHECKPOINTS)}")
+    return [m for m in requested if m in available]
+
+def parse_predict_mode(mode: Optional[str], models: Optional[str]) -> tuple:
+    """
+    Resolve the `mode` form field: "all" runs the `models` selection, "cascade" the
+    cascade policy's student (and its teacher on escalation; `models` is ignored).
+    Returns (model keys to preprocess for, cascade policy or None).
+    """
+    mode = (mode or PREDICT_DEFAULT_MODE).strip().lower()
+    if mode == "cascade":
+        return cascade_policy.models, cascade_policy
+    if mode != "all":
+        raise HTTPException(400, f"Unknown mode: {mode}. Choose from: all, cascade")
+    return parse_model_selection(models), None
+
+def model_budgets(model_names: List[str], budget_ms: Optional[float], started: float) -> Dict[str, Optional[float]]:
+    """Remaining time (seconds) each model may take, from per-model and per-request budgets"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    budgets = {}
+    for model_name in model_names:
+        limits = [b for b in (budget_ms, MODEL_LATENCY_BUDGETS_MS.get(model_name), INFERENCE_DEFAULT_BUDGET_MS) if b]
+        budgets[model_name] = max(0.0, min(limits) - elapsed_ms) / 1000 if limits else None
+    return budgets
+
+def prediction_cache_key(image_data: bytes, model_names: List[str], cascade: Optional[CascadePolicy] = None) -> str:
+    """Content hash of the upload combined with the versions of the models that will run"""
+    versions = ",".join(f"{m}@{model_versions.get(m, '?')}" for m in sorted(model_names))
+    key = f"{hashlib.sha256(image_data).hexdigest()}|{versions}"
+    # Cascade answers depend on the thresholds too
+    return f"{key}|{cascade.tag}" if cascade is not None else key
+
+async def save_prediction_history(current_user: Optional[dict], image_url: Optional[str], result_data: dict):
+    """Record a prediction in the user's history (DB or Mock) and return the entry"""
+    if not current_user:
+        return None
+    entry = {
+        "user_id": current_user["id"],
+        "image_url": image_url,
+        "result": result_data, # Saves all keys automatically
+        "timestamp": datetime.utcnow()
+    }
+    with span("history_insert"):
+        return await store.add_history(entry)
+
+def attach_late_upload(
+    upload_task: asyncio.Task,
+    entry: Optional[dict],
+    cache_key: Optional[str],
+    result_data: dict,
+    cascade: Optional[dict] = None
+):
+    """Once a slow upload finishes, patch its URL into the history entry and cache"""
+    def _on_done(task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            return
+        image_url = task.result()
+        if not image_url:
+            return
+        if entry is not None:
+            asyncio.ensure_future(store.set_history_image(entry, image_url))
+        if cache_key is not None:
+            prediction_cache.set(cache_key, {"result": result_data, "image_url": image_url, "cascade": cascade})
+    upload_task.add_done_callback(_on_done)
+
+async def infer(model_name: str, img_tensor: torch.Tensor):
+    """Submit one image to its model's batcher, timing the wait and the forward pass"""
+    with span(f"model:{model_name}", MODEL_LATENCY_SECONDS, model=model_name):
+        return await model_batchers[model_name].submit(img_tensor)
+
+def prediction_response(
+    result_data: dict,
+    image_url: Optional[str],
+    timed_out: List[str],
+    cached: bool,
+    cascade: Optional[dict] = None,
+    model_errors: Optional[Dict[str, str]] = None
+) -> dict:
+    response = {
+        **result_data,
+        "image_url": image_url,
+        "completed_models": [m for m, topk in result_data.items() if topk],
+        "timed_out_models": timed_out,
+        "cached": cached,
+    }
+    if cascade is not None:
+        response["cascade"] = cascade
+    if model_errors:
+        # Models that were asked for but produced nothing (never cached, so retried next time)
+        response["model_errors"] = model_errors
+    return response
+
+async def run_cascade(
+    policy: CascadePolicy,
+    tensors: Dict[str, torch.Tensor],
+    loaded: List[str],
+    budget_ms: Optional[float],
+    started: float
+) -> tuple:
+    """Run the student; run the teacher only if the student is unsure, missing or late"""
+    result_data, timed_out = {}, []
+    if policy.student in loaded:
+        result_data, timed_out = await gather_with_budgets(
+            {policy.student: infer(policy.student, tensors[policy.student])},
+            model_budgets([policy.student], budget_ms, started)
+        )
+    student_topk = result_data.get(policy.student)
+    tier = {"tier": "student", "answered_by": policy.student if student_topk else None, "escalated": False}
+    if student_topk:
+        confidence, margin = policy.scores(student_topk)
+        tier.update(confidence=round(confidence, 4), margin=round(margin, 4))
+
+    if policy.should_escalate(student_topk):
+        tier["escalated"] = True
+        if policy.teacher in await ensure_models_loaded([policy.teacher]):
+            teacher_result, teacher_timed_out = await gather_with_budgets(
+                {policy.teacher: infer(policy.teacher, tensors[policy.teacher])},
+                model_budgets([policy.teacher], budget_ms, started)
+            )
+            result_data.update(teacher_result)
+            timed_out += teacher_timed_out
+            if teacher_result.get(policy.teacher):
+                tier.update(tier="teacher", answered_by=policy.teacher)
+    CASCADE_ANSWERS.inc(tier=tier["tier"])
+    return result_data, timed_out, tier
+
+async def run_prediction(
+    image_data: bytes,
+    selected_models: List[str],
+    budget_ms: Optional[float],
+    started: float,
+    cache_key: str,
+    cascade: Optional[CascadePolicy] = None
+) -> dict:
+    """Upload + preprocess + inference for one image (the caller holds an executor slot)"""
+    # The upload runs in the background while we preprocess and infer;
+    # only image_url in the response depends on it
+    upload_task = upload_queue.submit(image_data, "inference_history")
+
+    # Preprocess (off the event loop), then hand each tensor to its model's
+    # batcher; models run concurrently and a slow one that misses its
+    # budget doesn't hold back the others
+    # Models not resident yet load meanwhile (once, however many requests wait on them)
+    # In cascade mode only the student is loaded up front (the teacher on escalation)
+    # Pinned until answered, so loads for other requests can't evict them in between
+    with model_registry.pinned(selected_models):
+        tensors, loaded = await asyncio.gather(
+            inference_executor.run_blocking(preprocess_image, image_data, selected_models),
+            ensure_models_loaded(selected_models if cascade is None else [cascade.student]),
+        )
+        tier = None
+        if cascade is not None:
+            result_data, timed_out, tier = await run_cascade(cascade, tensors, loaded, budget_ms, started)
+        else:
+            pending = {
+                model_name: infer(model_name, img_tensor)
+                for model_name, img_tensor in tensors.items()
+                if model_name in loaded
+            }
+            result_data, timed_out = await gather_with_budgets(
+                pending, model_budgets(selected_models, budget_ms, started)
+            )
+
+    # Give the upload a short grace period, then let it finish on its own
+    image_url = None
+    with span("upload_wait"):
+        done, _ = await asyncio.wait({upload_task}, timeout=UPLOAD_WAIT_MS / 1000)
+    if done:
+        image_url = upload_task.result()
+
+    # Only complete answers are worth replaying: every model that should have answered
+    # returned a top-k (failed inference yields [], unloadable models no entry at all)
+    expected = selected_models if cascade is None else [cascade.student] + ([cascade.teacher] if tier["escalated"] else [])
+    model_errors = {
+        model_name: "failed to load" if model_name not in result_data else "inference failed"
+        for model_name in expected
+        if model_name not in timed_out and not result_data.get(model_name)
+    }
+    if model_errors:
+        logger.warning("⚠️ No prediction from %s", ", ".join(model_errors), extra={**SAMPLED, "model_errors": model_errors})
+    complete = not timed_out and not model_errors
+    if complete and (image_url or not upload_queue.enabled):
+        prediction_cache.set(cache_key, {"result": result_data, "image_url": image_url, "cascade": tier})
+
+    return {
+        "result": result_data,
+        "cascade": tier,
+        "timed_out": timed_out,
+        "model_errors": model_errors,
+        "image_url": image_url,
+        # Still-running upload whose URL must be patched in later
+        "late_upload": None if done else upload_task,
+        "cache_key": cache_key if complete else None,
+    }
+
+def queue_full_error(e: InferenceQueueFull) -> HTTPException:
+    return HTTPException(
+        503,
+        "Inference queue is full, please retry shortly",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse holding an executor slot, released however the response ends
+    (the body generator never runs if the client disconnects before streaming starts)
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            inference_executor.release_slot()
 
 @app.post("/api/predict")
-async def predict(file: UploadFile = File(...), current_user: Optional[dict] = Depends(get_current_user)):
-    # 1. Read & Upload
+async def predict(
+    file: UploadFile = File(...),
+    models: Optional[str] = Form(None),
+    mode: Optional[str] = Form(None),
+    budget_ms: Optional[float] = Form(None),
+    current_user: Optional[dict] = Depends(get_current_user)
+):
+    started = time.perf_counter()
+    selected_models, cascade = parse_predict_mode(mode, models)
+
+    # 1. Read & check the cache
     try:
-        image_data = await file.read()
-        image_url = None
-        if CLOUDINARY_CLOUD_NAME:
-            try:
-                upload_result = cloudinary.uploader.upload(image_data, folder="inference_history")
-                image_url = upload_result.get("secure_url")
-            except Exception as e:
-                print(f"⚠️ Cloudinary upload failed: {e}")
+        with span("read"):
+            image_data = await file.read()
     except Exception as e:
         raise HTTPException(500, f"File processing error: {e}")
 
     # Fallback/Mock if no models loaded
-    if not models_dict: 
-        print("⚠️ No models loaded. Using Mock Data with FULL schema.")
+    if not model_registry.available_models(): 
+        image_url = await upload_queue.submit(image_data, "inference_history")
+        logger.warning("⚠️ No models loaded. Using Mock Data with FULL schema.", extra=SAMPLED)
         # We Mock ALL expected keys so the frontend doesn't break
         mock_result = {
             "baseline_b0_tiny": [{"class_name": "Goldfish (Mock)", "probability": 84.1}],
@@ -718,81 +1129,295 @@ async def predict(file: UploadFile = File(...), current_user: Optional[dict] = D
             "image_url": image_url
         }
         # Save mock history
-        if current_user:
-            entry = {
-                "id": str(uuid.uuid4()),
-                "user_id": current_user["id"],
-                "image_url": image_url,
-                "result": mock_result,
-                "timestamp": datetime.now() if db is not None else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            if db is not None: db.history.insert_one(entry)
-            else: MOCK_HISTORY.insert(0, entry)
+        await save_prediction_history(current_user, image_url, mock_result)
         return mock_result
 
+    cache_key = prediction_cache_key(image_data, selected_models, cascade)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        await save_prediction_history(current_user, cached["image_url"], cached["result"])
+        logger.debug("🔁 Served cached prediction", extra=SAMPLED)
+        return prediction_response(cached["result"], cached["image_url"], [], cached=True, cascade=cached.get("cascade"))
+
+    # Backpressure: refuse work instead of queueing without bound
     try:
-        # 2. Preprocess & Predict per Model
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
-        result_data = {}
-        
-        # Iterate over loaded models and apply their specific preprocessing
-        for model_name, model_instance in models_dict.items():
-            # Get the correct transform for this model
-            transform = MODEL_PREPROCESSING.get(model_name, TINY_IMAGENET_TRANSFORM)
-            
-            # Apply transform
-            img_tensor = transform(image).unsqueeze(0).to(device)
-            
-            # Run inference
-            result_data[model_name] = get_topk(model_instance, img_tensor)
+        inference_executor.acquire_slot()
+    except InferenceQueueFull as e:
+        raise queue_full_error(e)
+
+    try:
+        # 2. Upload, Preprocess & Predict per Model
+        outcome = await run_prediction(image_data, selected_models, budget_ms, started, cache_key, cascade)
         
         # 3. Save History
-        if current_user:
-            user_id_val = current_user["id"]
-            entry = {
-                "user_id": user_id_val,
-                "image_url": image_url,
-                "result": result_data, # Saves all keys automatically
-                "timestamp": datetime.utcnow()
-            }
-            if db is not None:
-                db.history.insert_one(entry)
-            else:
-                entry["id"] = str(uuid.uuid4())
-                entry["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                MOCK_HISTORY.insert(0, entry)
+        entry = await save_prediction_history(current_user, outcome["image_url"], outcome["result"])
+        if outcome["late_upload"] is not None:
+            attach_late_upload(outcome["late_upload"], entry, outcome["cache_key"], outcome["result"], outcome["cascade"])
 
-        return {**result_data, "image_url": image_url}
+        logger.debug(
+            "🔮 Predicted with %d models", len(outcome["result"]),
+            extra={**SAMPLED, "models": list(outcome["result"]), "timed_out": outcome["timed_out"], "cascade": outcome["cascade"]},
+        )
+        return prediction_response(
+            outcome["result"], outcome["image_url"], outcome["timed_out"], cached=False,
+            cascade=outcome["cascade"], model_errors=outcome["model_errors"]
+        )
 
     except Exception as e:
-        print(f"Prediction Error: {e}")
+        logger.exception("Prediction Error: %s", e)
         raise HTTPException(500, str(e))
+    finally:
+        inference_executor.release_slot()
+
+def extract_images(filename: str, data: bytes) -> List[tuple]:
+    """Expand a zip/tar upload into (name, bytes) image members; plain images pass through"""
+    buffer = io.BytesIO(data)
+    if zipfile.is_zipfile(buffer):
+        images, total = [], 0
+        with zipfile.ZipFile(buffer) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                total += info.file_size
+                if len(images) >= BATCH_MAX_IMAGES or total > BATCH_MAX_BYTES:
+                    raise ValueError(f"Archive exceeds {BATCH_MAX_IMAGES} images / {BATCH_MAX_BYTES // 2**20} MB")
+                images.append((info.filename, archive.read(info)))
+        return images
+
+    buffer.seek(0)
+    try:
+        archive = tarfile.open(fileobj=buffer, mode="r:*")
+    except tarfile.TarError:
+        return [(filename, data)]
+    images, total = [], 0
+    with archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            total += member.size
+            if len(images) >= BATCH_MAX_IMAGES or total > BATCH_MAX_BYTES:
+                raise ValueError(f"Archive exceeds {BATCH_MAX_IMAGES} images / {BATCH_MAX_BYTES // 2**20} MB")
+            images.append((member.name, archive.extractfile(member).read()))
+    return images
+
+@app.post("/api/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    models: Optional[str] = Form(None),
+    mode: Optional[str] = Form(None),
+    budget_ms: Optional[float] = Form(None),
+    current_user: Optional[dict] = Depends(get_current_user)
+):
+    """
+    Classify many images (multiple files and/or zip/tar archives) in one request.
+    Results stream back as NDJSON, one line per image in completion order.
+    """
+    selected_models, cascade = parse_predict_mode(mode, models)
+    if not model_registry.available_models():
+        raise HTTPException(503, "No models loaded")
+
+    # 1. Read & expand archives (off the event loop)
+    images = []
+    try:
+        for upload in files:
+            data = await upload.read()
+            images.extend(await inference_executor.run_blocking(extract_images, upload.filename or "upload", data))
+            if len(images) > BATCH_MAX_IMAGES:
+                raise ValueError(f"Batch exceeds {BATCH_MAX_IMAGES} images")
+    except ValueError as e:
+        raise HTTPException(413, str(e))
+    except Exception as e:
+        raise HTTPException(400, f"File processing error: {e}")
+    if not images:
+        raise HTTPException(400, "No images found in upload")
+
+    # The whole batch takes a single executor slot, freed when the response ends
+    try:
+        inference_executor.acquire_slot()
+    except InferenceQueueFull as e:
+        raise queue_full_error(e)
+
+    # Cap in-flight images so one batch fills the batchers without flooding them
+    in_flight = asyncio.Semaphore(INFERENCE_MAX_BATCH_SIZE)
+
+    async def classify(index: int, name: str, image_data: bytes) -> dict:
+        line = {"index": index, "filename": name}
+        cache_key = prediction_cache_key(image_data, selected_models, cascade)
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            line.update(prediction_response(cached["result"], cached["image_url"], [], cached=True, cascade=cached.get("cascade")))
+            return {"line": line, "result": cached["result"], "image_url": cached["image_url"]}
+        try:
+            async with in_flight:
+                # Budgets count from here: waiting behind earlier images in the batch is not inference time
+                started = time.perf_counter()
+                outcome = await run_prediction(image_data, selected_models, budget_ms, started, cache_key, cascade)
+        except Exception as e:
+            line["error"] = str(e)
+            return {"line": line}
+        line.update(prediction_response(
+            outcome["result"], outcome["image_url"], outcome["timed_out"], cached=False,
+            cascade=outcome["cascade"], model_errors=outcome["model_errors"]
+        ))
+        return {"line": line, **outcome}
+
+    async def ndjson_results():
+        finished = []
+        try:
+            # Decode/transform runs in parallel on the prep pool and the tensors
+            # meet in each model's batcher, so they share forward passes
+            tasks = [asyncio.ensure_future(classify(i, name, data)) for i, (name, data) in enumerate(images)]
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                finished.append(item)
+                yield json.dumps(item["line"], default=str) + "\n"
+        finally:
+            # 3. Save History: one insert_many for the whole batch
+            done = [item for item in finished if "result" in item]
+            if current_user and done:
+                entries = [{
+                    "user_id": current_user["id"],
+                    "image_url": item["image_url"],
+                    "result": item["result"],
+                    "timestamp": datetime.utcnow()
+                } for item in done]
+                await store.add_history_many(entries)
+                for item, entry in zip(done, entries):
+                    if item.get("late_upload") is not None:
+                        attach_late_upload(item["late_upload"], entry, item["cache_key"], item["result"], item["cascade"])
+
+    return SlotStreamingResponse(ndjson_results(), media_type="application/x-ndjson")
 
 @app.get("/api/history")
-async def get_history(current_user: dict = Depends(get_current_user)):
-    if db is not None:
-        cursor = db.history.find({"user_id": current_user["id"]}).sort("timestamp", -1).limit(20)
-        history = []
-        for doc in cursor:
-            doc["id"] = str(doc["_id"])
-            doc.pop("_id")
-            if "user_id" in doc: doc["user_id"] = str(doc["user_id"])
-            if isinstance(doc["timestamp"], datetime):
-                doc["timestamp"] = doc["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
-            history.append(doc)
-        return history
-    
-    user_history = [h for h in MOCK_HISTORY if h["user_id"] == current_user["id"]]
-    return user_history
+async def get_history(
+    response: Response,
+    summary: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    # summary=true keeps only each model's top prediction (projected in the DB)
+    options = {"top_k": 1, "result_keys": list(MODEL_CHECKPOINTS)} if summary else {}
+    if limit is None and cursor is None:
+        return await store.list_history(current_user["id"], **options)
+
+    # Keyset pagination: the body stays a plain list, the next page's cursor
+    # is returned in the X-Next-Cursor header (absent on the last page)
+    try:
+        page, next_cursor = await store.page_history(
+            current_user["id"], limit or HISTORY_DEFAULT_PAGE_SIZE, cursor=cursor, **options
+        )
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return page
+
+@app.get("/api/history/export")
+async def export_history(current_user: dict = Depends(get_current_user)):
+    """Stream the user's full history as NDJSON, one document per line"""
+    async def ndjson_lines():
+        async for doc in store.iter_history(current_user["id"]):
+            yield json.dumps(doc, default=str) + "\n"
+
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="deepdistill_history.ndjson"'}
+    )
 
 @app.get("/api/health")
 async def health():
     return {
         "status": "ok", 
-        "mode": "DB" if db is not None else "MOCK",
-        "loaded_models": list(models_dict.keys())
+        "mode": store.kind,
+        "loaded_models": list(models_dict.keys()),
+        "models": model_registry.status(),
+        "batching": {
+            name: {"batches": b.batches_run, "images": b.items_run, "queue_depth": b.queue_depth}
+            for name, b in model_batchers.items()
+        },
+        "executor": inference_executor.stats() if inference_executor is not None else None,
+        "prediction_cache": prediction_cache.stats(),
+        "auth_cache": {"claims": auth_claims_cache.stats(), "users": auth_user_cache.stats()},
+        "uploads": upload_queue.stats(),
+        "auth": {
+            "hasher": password_hasher.stats(),
+            "ip_limiter": auth_ip_limiter.stats(),
+            "email_limiter": auth_email_limiter.stats(),
+        },
+        "mail": {**mail_outbox.stats(), "outbox": await mail_outbox.backlog()},
+        "cascade": {"default_mode": PREDICT_DEFAULT_MODE, **cascade_policy.to_dict()},
     }
 
+def collect_serving_metrics():
+    """Scrape-time view of the batchers, executor, caches, uploads, mail outbox and registry"""
+    yield ("deepdistill_batch_queue_depth", "gauge", "Images waiting for a micro-batch",
+           [({"model": name}, b.queue_depth) for name, b in model_batchers.items()])
+    yield ("deepdistill_batches_total", "counter", "Micro-batches run",
+           [({"model": name}, b.batches_run) for name, b in model_batchers.items()])
+    yield ("deepdistill_batch_images_total", "counter", "Images run through micro-batches",
+           [({"model": name}, b.items_run) for name, b in model_batchers.items()])
+    if inference_executor is not None:
+        executor_stats = inference_executor.stats()
+        yield ("deepdistill_inference_in_flight", "gauge", "Predictions holding an executor slot",
+               [({"executor": executor_stats["kind"]}, executor_stats["in_flight"])])
+        yield ("deepdistill_inference_rejected_total", "counter", "Predictions refused with 503 (queue full)",
+               [({"executor": executor_stats["kind"]}, executor_stats["rejected"])])
+
+    for cache_name, cache in (
+        ("prediction_cache", prediction_cache),
+        ("auth_claims_cache", auth_claims_cache),
+        ("auth_user_cache", auth_user_cache),
+    ):
+        cache_stats = cache.stats()
+        label = cache_name.replace("_", " ")
+        for field in ("hits", "misses", "evictions"):
+            yield (f"deepdistill_{cache_name}_{field}_total", "counter", f"{label.capitalize()} {field}",
+                   [({}, cache_stats[field])])
+        yield (f"deepdistill_{cache_name}_hit_ratio", "gauge", f"{label.capitalize()} hits / lookups",
+               [({}, cache_stats["hit_rate"])])
+        yield (f"deepdistill_{cache_name}_entries", "gauge", f"Entries in the {label}",
+               [({}, cache_stats["entries"])])
+    yield ("deepdistill_prediction_cache_bytes", "gauge", "Approximate prediction cache size",
+           [({}, prediction_cache.stats()["bytes"])])
+
+    upload_stats = upload_queue.stats()
+    yield ("deepdistill_uploads_pending", "gauge", "Uploads queued or running", [({}, upload_stats["pending"])])
+    yield ("deepdistill_uploads_total", "counter", "Finished uploads",
+           [({"outcome": "ok"}, upload_stats["uploaded"]), ({"outcome": "failed"}, upload_stats["failed"])])
+    yield ("deepdistill_upload_retries_total", "counter", "Upload retries", [({}, upload_stats["retries"])])
+
+    hasher_stats = password_hasher.stats()
+    yield ("deepdistill_password_hash_pending", "gauge", "Password hashes queued or running",
+           [({}, hasher_stats["pending"])])
+    yield ("deepdistill_password_hash_total", "counter", "Finished password hashes/verifications",
+           [({"outcome": "ok"}, hasher_stats["completed"]), ({"outcome": "failed"}, hasher_stats["failed"])])
+    yield ("deepdistill_password_hash_rejected_total", "counter", "Auth requests refused with 503 (hasher backlog full)",
+           [({}, hasher_stats["rejected"])])
+    yield ("deepdistill_auth_rate_limited_total", "counter", "Auth requests refused with 429",
+           [({"scope": "ip"}, auth_ip_limiter.rejected), ({"scope": "email"}, auth_email_limiter.rejected)])
+
+    mail_stats = mail_outbox.stats()
+    yield ("deepdistill_mail_enqueued_total", "counter", "Emails queued for delivery", [({}, mail_stats["enqueued"])])
+    yield ("deepdistill_mail_total", "counter", "Finished email deliveries",
+           [({"outcome": "sent"}, mail_stats["sent"]), ({"outcome": "failed"}, mail_stats["failed"])])
+    yield ("deepdistill_mail_retries_total", "counter", "Email send retries scheduled", [({}, mail_stats["retries"])])
+
+    registry_stats = model_registry.status()
+    yield ("deepdistill_models_resident_mb", "gauge", "Size of the models held in memory",
+           [({}, registry_stats["resident_mb"])])
+    yield ("deepdistill_model_evictions_total", "counter", "Models evicted to stay within the memory budget",
+           [({}, registry_stats["evictions"])])
+    yield ("deepdistill_model_state", "gauge", "1 for each model's current registry state",
+           [({"model": key, "state": info["state"]}, 1) for key, info in registry_stats["models"].items()])
+
+METRICS_REGISTRY.add_collector(collect_serving_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(METRICS_REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
 # =============================================================================
 # 9. STATIC FILES & SPA SERVING
 # =============================================================================
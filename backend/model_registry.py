@@ -0,0 +1,612 @@
+"""
+Lazy, memory-bounded model registry for the DeepDistill API
+"""
+
+import asyncio
+import copy
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision import models as torchvision_models
+
+from inference import output_classes, build_label_table
+from logs import get_logger
+from metrics import histogram
+from onnx_backend import onnx_path, load_onnx_model
+
+logger = get_logger("models")
+
+try:
+    import safetensors.torch
+except ImportError:
+    safetensors = None
+
+try:
+    # We build the baseline checkpoints' architecture with timm (weights come from the checkpoint)
+    from models import get_efficientnet, get_model_size_mb
+except ImportError:
+    logger.warning("⚠️  Could not import models.py, using torchvision fallbacks.")
+
+    # Fallback if models.py is missing entirely
+    def get_efficientnet(model_name="efficientnet_b0", num_classes=200, pretrained=False):
+        logger.warning("⚠️ models.py missing, returning torchvision fallback with %d classes", num_classes)
+        model = torchvision_models.efficientnet_b0(weights=None)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+        return model
+
+    def get_model_size_mb(model: nn.Module) -> float:
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.nelement() * t.element_size() for t in tensors) / 1024 / 1024
+
+
+# Map friendly names to (path_suffix, architecture_type)
+MODEL_CHECKPOINTS = {
+    "baseline_b0_tiny": ("checkpoints/baseline_b0_tinyimagenet/best_model.pth", "efficientnet_b0"),
+    "distilled_b0": ("checkpoints/distilled_b0/best_model.pth", "efficientnet_b0"),
+    "b0_aktp_tiny": ("checkpoints_aktp/b0_aktp_tiny_best.pth", "efficientnet_b0"),
+    "teacher_b2_tiny": ("checkpoints_aktp/teacher_b2_tiny.pth", "efficientnet_b2"),
+    "teacher_r18_tiny": ("checkpoints_aktp/teacher_r18_tiny.pth", "resnet18"),
+    # INT8 students written by quantize.py (CPU only)
+    "distilled_b0_int8": ("checkpoints/distilled_b0/best_model_int8.pt", "torchscript"),
+    "b0_aktp_tiny_int8": ("checkpoints_aktp/b0_aktp_tiny_best_int8.pt", "torchscript"),
+}
+
+MODEL_LOAD_SECONDS = histogram(
+    "deepdistill_model_load_seconds", "Time to load, compile and warm up a model", ("model", "backend"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+# Directories checkpoint paths are resolved against (repo root, backend/, HF Space layout)
+CHECKPOINT_BASE_DIRS = [
+    os.getcwd(),
+    os.path.join(os.getcwd(), "deepdistill", "backend"),
+    os.path.join(os.getcwd(), "backend"),
+    os.path.join(os.getcwd(), "deepdistill")
+]
+
+
+def resolve_checkpoint(rel_path: str, base_dirs: Sequence[str] = CHECKPOINT_BASE_DIRS) -> Optional[str]:
+    """
+    Return the first existing location of ``rel_path`` under ``base_dirs``.
+
+    A ``.safetensors`` file next to a ``.pth`` checkpoint is preferred when present.
+    """
+    clean_rel_path = rel_path.replace("\\", os.sep).replace("/", os.sep)
+    for base in base_dirs:
+        full_path = os.path.join(base, clean_rel_path)
+        if os.path.exists(full_path):
+            stem, ext = os.path.splitext(full_path)
+            converted = stem + ".safetensors"
+            if ext == ".pth" and safetensors is not None and os.path.exists(converted):
+                return converted
+            return full_path
+    return None
+
+
+def read_state_dict(checkpoint_path: str) -> Dict[str, torch.Tensor]:
+    """
+    Read a checkpoint's state dict without copying tensor data up front.
+
+    Safetensors files and zip-format ``torch.save`` files are memory-mapped
+    and restricted to tensors (``weights_only``). Legacy or pickle-heavy
+    checkpoints fall back to a regular full-pickle load.
+    """
+    if checkpoint_path.endswith(".safetensors"):
+        return safetensors.torch.load_file(checkpoint_path, device="cpu")
+    try:
+        state = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, pickle.UnpicklingError) as e:
+        logger.warning(
+            "⚠️ %s can't be memory-mapped as weights only, using a full load (%s)",
+            os.path.basename(checkpoint_path), e.__class__.__name__,
+        )
+        state = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    if isinstance(state, dict) and 'model_state_dict' in state:
+        state = state['model_state_dict']
+    return state
+
+
+def build_architecture(model_key: str, arch_name: str, state_keys: Iterable[str], num_classes: int) -> Optional[nn.Module]:
+    """Instantiate the (untrained) architecture matching a checkpoint's keys."""
+    state_keys = list(state_keys)
+    # Determine Architecture Type
+    has_features = any(k.startswith('features.') for k in state_keys)
+    has_conv_stem = any(k.startswith('conv_stem') for k in state_keys)
+
+    model = None
+
+    if "efficientnet_b0" in arch_name:
+        if has_features:
+            logger.debug("[%s] Detected Torchvision format", model_key)
+            model = torchvision_models.efficientnet_b0(weights=None)
+            model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+        elif has_conv_stem:
+            logger.debug("[%s] Detected Custom/Timm format", model_key)
+            model = get_efficientnet("efficientnet_b0", num_classes=num_classes, pretrained=False)
+        else:
+            logger.warning("[%s] Unknown format, defaulting to Torchvision", model_key)
+            model = torchvision_models.efficientnet_b0(weights=None)
+            model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+
+    elif "efficientnet_b2" in arch_name:
+        model = torchvision_models.efficientnet_b2(weights=None)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+
+    elif "resnet18" in arch_name:
+        model = torchvision_models.resnet18(weights=None)
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+
+    else:
+        logger.warning("⚠️ Unknown architecture %s, skipping", arch_name)
+
+    return model
+
+
+def inspect_and_load_architecture(
+    model_key: str,
+    checkpoint_path: str,
+    arch_name: str,
+    num_classes: int,
+    device: Optional[torch.device] = None,
+    timings: Optional[Dict[str, float]] = None
+):
+    """
+    Intelligently loads model architecture based on the checkpoint file content.
+
+    The architecture is built on the meta device (no parameter allocation or
+    random init) and the memory-mapped checkpoint tensors are assigned to it
+    directly, so weights are never copied on CPU. ``arch_name="torchscript"``
+    loads a self-contained export (e.g. an INT8 student) instead.
+
+    Args:
+        model_key: Model name (for logging)
+        checkpoint_path: Resolved checkpoint file
+        arch_name: Architecture hint from MODEL_CHECKPOINTS
+        num_classes: Output classes to build the head with
+        device: Device to place the model on
+        timings: Filled with the ``read``/``build``/``assign`` durations in ms
+
+    Returns:
+        The model in eval mode, or None if it could not be loaded
+    """
+    device = device or torch.device("cpu")
+    timings = timings if timings is not None else {}
+    try:
+        started = time.perf_counter()
+        if arch_name == "torchscript":
+            # Self-contained exported graph (e.g. quantized INT8 students)
+            if device.type != "cpu":
+                logger.warning("⚠️ %s is a CPU-only TorchScript export, skipping on %s", model_key, device)
+                return None
+            model = torch.jit.load(checkpoint_path, map_location="cpu")
+            model.eval()
+            timings["read"] = (time.perf_counter() - started) * 1000
+            return model
+
+        state = read_state_dict(checkpoint_path)
+        timings["read"] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with torch.device("meta"):
+            model = build_architecture(model_key, arch_name, state.keys(), num_classes)
+        if model is None:
+            return None
+        timings["build"] = (time.perf_counter() - started) * 1000
+
+        # Load weights
+        started = time.perf_counter()
+        model.load_state_dict(state, strict=True, assign=True)
+        if any(t.is_meta for t in model.state_dict(keep_vars=True).values()):
+            # Non-persistent buffers aren't in the checkpoint; build them for real
+            model = build_architecture(model_key, arch_name, state.keys(), num_classes)
+            model.load_state_dict(state, strict=True)
+        model.to(device)
+        model.eval()
+        timings["assign"] = (time.perf_counter() - started) * 1000
+        return model
+
+    except Exception as e:
+        logger.error("❌ Failed to load %s from %s: %s", model_key, checkpoint_path, e)
+        return None
+
+
+# Optional graph optimization applied after a model is loaded (INFERENCE_COMPILE)
+COMPILE_MODES = ("off", "fuse", "trace", "compile")
+# Tracing/compilation state is process-global, so concurrent loads compile one at a time
+_COMPILE_LOCK = threading.Lock()
+
+
+class _ChannelsLast(nn.Module):
+    """Feeds the wrapped model channels_last inputs to match its weights."""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def compile_model(
+    model_key: str,
+    model: nn.Module,
+    mode: str,
+    example_shape: Tuple[int, ...],
+    device: Optional[torch.device] = None
+) -> Tuple[nn.Module, str]:
+    """
+    Optimize an eval-mode model for inference, falling back to eager on failure.
+
+    - ``fuse``: fold BatchNorm into the preceding conv (torch.fx) and switch
+      weights to channels_last, still running eagerly
+    - ``trace``: ``fuse`` + TorchScript trace, ``torch.jit.freeze`` (which
+      also folds conv-bn) and ``optimize_for_inference``
+    - ``compile``: ``fuse`` + ``torch.compile`` with dynamic batch sizes
+
+    The optimized model is run on two batch sizes and must match the eager
+    outputs, so compilation cost is paid here rather than on a request.
+
+    Args:
+        model_key: Model name (for logging)
+        model: Loaded model in eval mode
+        mode: One of ``COMPILE_MODES``
+        example_shape: Input shape [B, C, H, W] used to trace and verify
+        device: Device the model lives on
+
+    Returns:
+        (model to serve, mode actually applied - "eager" after a fallback)
+    """
+    if mode not in COMPILE_MODES:
+        logger.warning("⚠️ Unknown compile mode '%s', serving %s eagerly", mode, model_key)
+        return model, "eager"
+    if isinstance(model, torch.jit.ScriptModule):
+        return model, "torchscript"
+    if not isinstance(model, nn.Module):
+        return model, getattr(model, "backend", "external")
+    if mode == "off":
+        return model, "eager"
+    device = device or torch.device("cpu")
+    examples = [torch.randn((batch,) + tuple(example_shape[1:]), device=device) for batch in (1, 3)]
+    try:
+        with _COMPILE_LOCK, torch.no_grad():
+            try:
+                from torch.fx.experimental.optimization import fuse
+                optimized = fuse(model)
+            except Exception as e:
+                # Not symbolically traceable; trace/freeze still fold BN below
+                logger.info("⚠️ [%s] BatchNorm fusion skipped: %s", model_key, e.__class__.__name__)
+                optimized = copy.deepcopy(model)
+            optimized = _ChannelsLast(optimized.to(memory_format=torch.channels_last)).eval()
+
+            if mode == "trace":
+                optimized = torch.jit.trace(optimized, examples[0])
+                optimized = torch.jit.optimize_for_inference(torch.jit.freeze(optimized.eval()))
+            elif mode == "compile":
+                optimized = torch.compile(optimized, dynamic=True)
+
+        # Same grad mode as run_topk, so torch.compile guards match at serving time
+        with _COMPILE_LOCK, torch.inference_mode():
+            for x in examples:
+                # First calls also warm up TorchScript profiling / Inductor codegen
+                if not torch.allclose(optimized(x), model(x), rtol=1e-3, atol=1e-3):
+                    raise ValueError("outputs differ from eager")
+        return optimized, mode
+    except Exception as e:
+        logger.warning("⚠️ [%s] %s compilation failed, using eager: %s", model_key, mode, e)
+        return model, "eager"
+
+
+class ModelRegistry:
+    """
+    Loads checkpoints on first use and keeps them within a memory budget.
+
+    ``get(key)`` returns the resident model, loading it if needed; loads are
+    single-flight per key, so concurrent callers share one load. Once the
+    resident models exceed ``memory_budget_mb`` (measured with
+    ``get_model_size_mb``) the least recently used ones are evicted and will
+    be reloaded on their next use. Models ``pinned`` by requests with work
+    queued or running are never evicted; the budget may be exceeded until
+    they are released. ``models`` and ``label_tables`` are plain dicts of
+    what is currently resident.
+
+    Args:
+        checkpoints: Model name -> (checkpoint path, architecture name)
+        labels: Class names, checked against each model's output layer
+        num_classes: Output classes the architectures are built with
+        device: Device models are loaded onto
+        memory_budget_mb: Cap on resident model size (0 = unlimited)
+        loader: ``loader(key, path, arch, num_classes, device, timings=...)``
+            returning the model or ``None`` and filling per-phase timings
+        sizeof: Callable measuring a model's size in MB
+        warmup_shape: Input shape for one warm-up forward pass after each
+            load (``None`` skips it)
+        compile_mode: Optimization applied after loading (see
+            ``compile_model``; needs ``warmup_shape``)
+        onnx_models: Models served from their exported ``.onnx`` graph with
+            ONNX Runtime instead of PyTorch
+        onnx_threads: ONNX Runtime intra-op threads (0 = default)
+    """
+
+    def __init__(
+        self,
+        checkpoints: Dict[str, Tuple[str, str]],
+        labels: Sequence[str],
+        num_classes: int,
+        device: Optional[torch.device] = None,
+        memory_budget_mb: float = 0.0,
+        loader: Callable = inspect_and_load_architecture,
+        sizeof: Callable[[nn.Module], float] = get_model_size_mb,
+        warmup_shape: Optional[Tuple[int, ...]] = None,
+        compile_mode: str = "off",
+        onnx_models: Iterable[str] = (),
+        onnx_threads: int = 0
+    ):
+        self.checkpoints = dict(checkpoints)
+        self.labels = list(labels)
+        self.num_classes = num_classes
+        self.device = device or torch.device("cpu")
+        self.memory_budget_mb = float(memory_budget_mb)
+        self.loader = loader
+        self.sizeof = sizeof
+        self.warmup_shape = warmup_shape
+        self.compile_mode = compile_mode
+        # TorchScript exports (INT8 students) have no ONNX counterpart
+        self.onnx_models = {key for key in onnx_models if self.checkpoints.get(key, (None, "torchscript"))[1] != "torchscript"}
+        self.onnx_threads = onnx_threads
+
+        self.models: Dict[str, nn.Module] = {}
+        self.label_tables: Dict[str, np.ndarray] = {}
+        self.versions: Dict[str, str] = {}
+        self.paths: Dict[str, Optional[str]] = {}
+        self._info: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._pins: Dict[str, int] = {}
+        self._key_locks = {key: threading.Lock() for key in self.checkpoints}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.evictions = 0
+        self.discover()
+
+    def discover(self):
+        """Resolve checkpoint paths and fingerprints without loading anything."""
+        for key, (rel_path, _) in self.checkpoints.items():
+            started = time.perf_counter()
+            if key in self.onnx_models:
+                rel_path = onnx_path(rel_path)
+            path = resolve_checkpoint(rel_path)
+            self.paths[key] = path
+            self._info[key] = {
+                "state": "unloaded" if path else "missing",
+                "size_mb": None,
+                "loads": 0,
+                "load_ms": None,
+                "phases_ms": {"resolve": round((time.perf_counter() - started) * 1000, 2)},
+                "compiled": None,
+                "last_used": None,
+            }
+            if path:
+                stat = os.stat(path)
+                self.versions[key] = f"{stat.st_size}-{int(stat.st_mtime)}"
+
+    def available_models(self) -> List[str]:
+        """Models whose checkpoint exists and hasn't failed to load."""
+        return [key for key, info in self._info.items() if info["state"] not in ("missing", "failed")]
+
+    def state(self, key: str) -> Optional[str]:
+        info = self._info.get(key)
+        return info["state"] if info else None
+
+    # --- loading ---
+    def get(self, key: str) -> Optional[nn.Module]:
+        """Return the model for ``key``, loading it (blocking) if it isn't resident."""
+        model = self.models.get(key)
+        if model is None:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                return None
+            with lock:
+                model = self.models.get(key)
+                if model is None and self.state(key) not in ("missing", "failed"):
+                    model = self._load(key)
+        if model is not None:
+            self._info[key]["last_used"] = time.monotonic()
+        return model
+
+    def resident(self, key: str) -> Optional[nn.Module]:
+        """Return the model for ``key`` if it is resident, without ever loading it."""
+        model = self.models.get(key)
+        if model is not None:
+            self._info[key]["last_used"] = time.monotonic()
+        return model
+
+    async def load(self, key: str) -> Optional[nn.Module]:
+        """Async ``get``: the load runs in a worker thread, shared by concurrent awaiters."""
+        model = self.models.get(key)
+        if model is not None:
+            self._info[key]["last_used"] = time.monotonic()
+            return model
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self.get, key))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _, k=key: self._inflight.pop(k, None))
+        # Shielded so one cancelled caller doesn't abort the load for the others
+        return await asyncio.shield(future)
+
+    async def ensure_loaded(self, keys: Iterable[str]) -> List[str]:
+        """Load ``keys`` concurrently; returns the ones that are now resident."""
+        keys = list(keys)
+        loaded = await asyncio.gather(*(self.load(key) for key in keys))
+        return [key for key, model in zip(keys, loaded) if model is not None]
+
+    def _load(self, key: str) -> Optional[nn.Module]:
+        _, arch = self.checkpoints[key]
+        info = self._info[key]
+        info["state"] = "loading"
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        if key in self.onnx_models:
+            model = load_onnx_model(key, self.paths[key], intra_op_threads=self.onnx_threads)
+            timings["read"] = (time.perf_counter() - started) * 1000
+        else:
+            model = self.loader(key, self.paths[key], arch, self.num_classes, self.device, timings=timings)
+        if model is None:
+            info["state"] = "failed"
+            logger.warning("⚠️ Could not load %s (File not found or mismatch)", key)
+            return None
+
+        # Measured before compilation: frozen graphs hold weights as constants
+        size_mb = self.sizeof(model) if isinstance(model, nn.Module) else 0.0
+        size_mb = size_mb or os.path.getsize(self.paths[key]) / 1024 / 1024
+        compiled = "eager"
+        # Read off the layers before compilation hides them; the warm-up output overrides it
+        out_features = output_classes(model)
+        if self.warmup_shape is not None:
+            phase_started = time.perf_counter()
+            model, compiled = compile_model(key, model, self.compile_mode, self.warmup_shape, self.device)
+            if self.compile_mode != "off":
+                timings["compile"] = (time.perf_counter() - phase_started) * 1000
+            phase_started = time.perf_counter()
+            out_features = self._warm_up(key, model) or out_features
+            timings["warmup"] = (time.perf_counter() - phase_started) * 1000
+        # Bounds are settled here, once, so inference can index labels blindly
+        self.label_tables[key] = self._check_labels(key, out_features)
+        with self._lock:
+            self.models[key] = model
+            info.update(
+                state="loaded",
+                size_mb=round(size_mb, 2),
+                loads=info["loads"] + 1,
+                compiled=compiled,
+                load_ms=round((time.perf_counter() - started) * 1000, 1),
+                phases_ms={"resolve": info["phases_ms"]["resolve"], **{k: round(v, 2) for k, v in timings.items()}},
+                last_used=time.monotonic(),
+            )
+            self._evict(keep=key)
+        MODEL_LOAD_SECONDS.observe(info["load_ms"] / 1000, model=key, backend=compiled)
+        phases = ", ".join(f"{k} {v:.0f}" for k, v in info["phases_ms"].items())
+        logger.info(
+            "✅ Loaded %s (%.1f MB in %.0f ms; %s ms)", key, size_mb, info["load_ms"], phases,
+            extra={"model": key, "backend": compiled, "phases_ms": info["phases_ms"]},
+        )
+        return model
+
+    def _warm_up(self, key: str, model: nn.Module) -> Optional[int]:
+        """
+        One dummy forward pass, so lazy init and page faults don't hit the first request.
+
+        Returns the output width (classes), or None if the pass failed.
+        """
+        try:
+            if getattr(model, "numpy_io", False):
+                output = model(np.zeros(self.warmup_shape, dtype=np.float32))
+            else:
+                with torch.inference_mode():
+                    output = model(torch.zeros(self.warmup_shape, device=self.device))
+            return int(output.shape[1])
+        except Exception as e:
+            logger.warning("⚠️ Warm-up failed for %s: %s", key, e)
+            return None
+
+    def _check_labels(self, key: str, out_features: Optional[int]) -> np.ndarray:
+        num_labels_defined = len(self.labels)
+        if out_features is not None:
+            if out_features != num_labels_defined:
+                logger.warning(
+                    "⚠️  Label Mismatch for %s: %d output classes, %d labels; predictions >= %d will be reported as 'Unknown Class'",
+                    key, out_features, num_labels_defined, num_labels_defined,
+                    extra={"model": key, "output_classes": out_features, "labels": num_labels_defined},
+                )
+            else:
+                logger.debug("✅ %s verified: %d output classes match label list.", key, out_features)
+        else:
+            logger.warning("⚠️  Could not automatically verify output layer size for %s.", key)
+        return build_label_table(self.labels, out_features or num_labels_defined)
+
+    # --- memory budget ---
+    def resident_mb(self) -> float:
+        return sum(self._info[key]["size_mb"] or 0.0 for key in self.models)
+
+    @contextmanager
+    def pinned(self, keys: Iterable[str]):
+        """Keep ``keys`` from being evicted while the block runs (loaded or not)."""
+        keys = [key for key in keys if key in self._info]
+        with self._lock:
+            for key in keys:
+                self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._pins[key] -= 1
+                    if not self._pins[key]:
+                        del self._pins[key]
+                # Catch up on evictions the pins held back
+                self._evict(keep=None)
+
+    def _evict(self, keep: Optional[str]):
+        """Drop least recently used unpinned models until the budget holds (caller holds ``_lock``)."""
+        if self.memory_budget_mb <= 0:
+            return
+        while self.resident_mb() > self.memory_budget_mb:
+            candidates = [key for key in self.models if key != keep and key not in self._pins]
+            if not candidates:
+                if keep is not None and len(self.models) == 1:
+                    logger.warning("⚠️ %s alone exceeds the model memory budget (%.0f MB)", keep, self.memory_budget_mb)
+                else:
+                    logger.debug("Over the model memory budget until pinned models are released")
+                return
+            victim = min(candidates, key=lambda k: self._info[k]["last_used"] or 0.0)
+            # In-flight forward passes keep their own reference to the module
+            self.models.pop(victim)
+            self.label_tables.pop(victim, None)
+            self._info[victim]["state"] = "evicted"
+            self.evictions += 1
+            logger.info("♻️  Evicted %s to stay within %.0f MB", victim, self.memory_budget_mb)
+
+    # --- introspection ---
+    def worker_factory(self) -> Callable[[], "ModelRegistry"]:
+        """Picklable factory building an equivalent CPU registry (for process workers)."""
+        return partial(
+            ModelRegistry,
+            self.checkpoints,
+            self.labels,
+            self.num_classes,
+            device=torch.device("cpu"),
+            memory_budget_mb=self.memory_budget_mb,
+            loader=self.loader,
+            sizeof=self.sizeof,
+            warmup_shape=self.warmup_shape,
+            compile_mode=self.compile_mode,
+            onnx_models=self.onnx_models,
+            onnx_threads=self.onnx_threads,
+        )
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "memory_budget_mb": self.memory_budget_mb or None,
+            "resident_mb": round(self.resident_mb(), 2),
+            "evictions": self.evictions,
+            "models": {
+                key: {
+                    "state": info["state"],
+                    "size_mb": info["size_mb"],
+                    "loads": info["loads"],
+                    "load_ms": info["load_ms"],
+                    "phases_ms": info["phases_ms"],
+                    "compiled": info["compiled"],
+                    "idle_s": round(now - info["last_used"], 1) if info["last_used"] else None,
+                }
+                for key, info in self._info.items()
+            },
+        }
@@ -120,7 +120,8 @@ class DistillationLoss(nn.Module):
         
         Args:
             student_logits: Raw logits from student model
-            teacher_logits: Raw logits from teacher model
+            teacher_logits: Raw logits from teacher model (live, or read back from a
+                ``teacher_cache.TeacherLogitStore``)
             labels: Ground truth labels
         
         Returns:
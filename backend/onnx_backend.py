@@ -0,0 +1,90 @@
+"""
+ONNX Runtime serving backend (CPU execution provider, no torch in the forward path)
+"""
+
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from logs import get_logger
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = get_logger("onnx")
+
+
+def onnx_path(checkpoint_path: str) -> str:
+    """Where ``export_onnx.py`` writes the graph for a checkpoint."""
+    return os.path.splitext(checkpoint_path)[0] + ".onnx"
+
+
+class OnnxModel:
+    """
+    Callable wrapper around an ONNX Runtime ``InferenceSession``.
+
+    Takes a [B, C, H, W] float batch (numpy array or CPU tensor) and returns
+    [B, num_classes] logits as a numpy array, so it can stand in for a
+    ``torch.nn.Module`` in the registry and in ``run_topk``.
+
+    Args:
+        path: Exported ``.onnx`` file
+        intra_op_threads: Threads per operator (0 = onnxruntime default)
+    """
+
+    backend = "onnxruntime"
+    # run_topk hands numpy in and post-processes numpy out
+    numpy_io = True
+
+    def __init__(self, path: str, intra_op_threads: int = 0):
+        if ort is None:
+            raise ImportError("onnxruntime is not installed (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        classes = self.session.get_outputs()[0].shape[-1]
+        self.num_classes: Optional[int] = classes if isinstance(classes, int) else None
+
+    def __call__(self, batch) -> np.ndarray:
+        batch = np.ascontiguousarray(np.asarray(batch), dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def eval(self) -> "OnnxModel":
+        return self
+
+
+def load_onnx_model(model_key: str, checkpoint_path: str, intra_op_threads: int = 0) -> Optional[OnnxModel]:
+    """Open the ONNX graph exported for ``checkpoint_path``, or ``None`` if unavailable."""
+    try:
+        return OnnxModel(checkpoint_path, intra_op_threads=intra_op_threads)
+    except Exception as e:
+        logger.error("❌ Failed to load %s from %s: %s", model_key, checkpoint_path, e)
+        return None
+
+
+def postprocess_topk_numpy(logits: np.ndarray, label_table: np.ndarray, k: int = 5) -> List[List[dict]]:
+    """NumPy twin of ``inference.postprocess_topk`` with identical output."""
+    logits = logits.astype(np.float64)
+    k = min(k, logits.shape[1])
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    probs = exp / exp.sum(axis=1, keepdims=True)
+    # argpartition finds the k largest in O(C), then only those k are sorted
+    top_indices = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(probs, top_indices, axis=1), axis=1, kind="stable")
+    top_indices = np.take_along_axis(top_indices, order, axis=1)
+    top_probs = np.round(np.take_along_axis(probs, top_indices, axis=1) * 100, 2).tolist()
+    names = label_table[top_indices].tolist()
+    return [
+        [
+            {"class_id": idx, "class_name": name, "probability": prob}
+            for idx, name, prob in zip(row_ids, row_names, row_probs)
+        ]
+        for row_ids, row_names, row_probs in zip(top_indices.tolist(), names, top_probs)
+    ]
@@ -0,0 +1,109 @@
+"""
+Precompute teacher logits for distillation training (read by train_distillation.py)
+
+Runs the teacher(s) once per (training image, augmentation view) and writes
+the logits to a float16 memory-mapped TeacherLogitStore (all of them, or the
+top-k). Distillation then reads teacher outputs from disk instead of running
+a teacher forward pass at every student step of every epoch. Several teachers
+are averaged (logit ensemble). Interrupted runs resume where they stopped.
+
+Usage:
+    python precompute_teacher_logits.py --teachers teacher_b2_tiny --views 10 --top-k 0
+"""
+
+import argparse
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader, Subset
+
+import config
+from data import TinyImageNetTrain, AugmentedViews, TRAIN_TRANSFORM
+from logs import setup_logging
+from model_registry import MODEL_CHECKPOINTS, resolve_checkpoint, inspect_and_load_architecture
+from teacher_cache import TeacherLogitStore
+
+
+def load_teacher(model_key: str, device: torch.device):
+    if model_key not in MODEL_CHECKPOINTS:
+        print(f"⚠️ {model_key} is not in MODEL_CHECKPOINTS")
+        return None
+    rel_path, arch = MODEL_CHECKPOINTS[model_key]
+    checkpoint_path = resolve_checkpoint(rel_path)
+    if checkpoint_path is None:
+        print(f"⚠️ Could not find {model_key} checkpoint {rel_path}")
+        return None
+    model = inspect_and_load_architecture(model_key, checkpoint_path, arch, config.NUM_CLASSES, device)
+    if model is not None and device.type == "cuda":
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute teacher logits for distillation training")
+    parser.add_argument("--teachers", default="teacher_b2_tiny", help="Comma-separated MODEL_CHECKPOINTS keys (averaged)")
+    parser.add_argument("--views", type=int, default=10,
+                        help="Augmentation views per image; epoch e trains on view e %% views")
+    parser.add_argument("--top-k", type=int, default=0, help="Logits kept per image (0 = all classes)")
+    parser.add_argument("--data-dir", default=None, help="TinyImageNet root (default: DATA_DIR/tiny-imagenet-200)")
+    parser.add_argument("--output", default=None, help="Store directory (default: CHECKPOINT_DIR/teacher_logits/<teachers>)")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--num-workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--device", default=config.DEVICE)
+    args = parser.parse_args()
+    setup_logging(fmt="text")
+
+    device = torch.device(args.device)
+    teacher_keys = [m.strip() for m in args.teachers.split(",") if m.strip()]
+    teachers = [load_teacher(key, device) for key in teacher_keys]
+    if not teachers or any(t is None for t in teachers):
+        return
+
+    dataset = TinyImageNetTrain(args.data_dir, transform=None) if args.data_dir else TinyImageNetTrain(transform=None)
+    views = AugmentedViews(dataset, TRAIN_TRANSFORM, args.views)
+    output = args.output or os.path.join(config.CHECKPOINT_DIR, "teacher_logits", "+".join(teacher_keys))
+    store = TeacherLogitStore.create(
+        output,
+        num_images=len(dataset),
+        num_views=views.num_views,
+        num_classes=config.NUM_CLASSES,
+        top_k=args.top_k,
+        teachers=teacher_keys,
+        seed=views.seed,
+        image_size=config.IMAGE_SIZE,
+        augmentation=config.TRAIN_AUGMENTATION,
+        dataset_fingerprint=dataset.fingerprint(),
+    )
+    print(f"📦 {output}: {len(dataset)} images x {views.num_views} views, "
+          f"{'top-' + str(store.top_k) if store.top_k else 'full'} logits, {store.size_mb():.1f} MB")
+
+    started = time.perf_counter()
+    use_amp = device.type == "cuda"
+    for view in range(views.num_views):
+        missing = store.missing(view)
+        if len(missing) == 0:
+            continue
+        views.set_view(view)
+        loader = DataLoader(
+            Subset(views, missing.tolist()), batch_size=args.batch_size, shuffle=False,
+            num_workers=args.num_workers, pin_memory=use_amp,
+        )
+        view_started = time.perf_counter()
+        with torch.inference_mode(), torch.autocast(device.type, enabled=use_amp):
+            for step, (images, _, indices) in enumerate(loader):
+                images = images.to(device, non_blocking=True)
+                if use_amp:
+                    images = images.contiguous(memory_format=torch.channels_last)
+                logits = torch.stack([teacher(images).float() for teacher in teachers]).mean(dim=0)
+                store.write(view, indices, logits)
+                if (step + 1) % config.LOG_INTERVAL == 0:
+                    print(f"  view {view + 1}/{views.num_views}: {(step + 1) * args.batch_size}/{len(missing)} images")
+        store.flush()
+        print(f"✅ View {view + 1}/{views.num_views}: {len(missing)} images in {time.perf_counter() - view_started:.1f}s")
+
+    print(f"📝 Teacher logits complete in {time.perf_counter() - started:.1f}s -> {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Post-training INT8 quantization of the DeepDistill students
+
+Calibrates on a held-out TinyImageNet validation subset, exports each
+quantized student as a frozen TorchScript graph next to its FP32 checkpoint
+(the path its ``*_int8`` entry in MODEL_CHECKPOINTS points to), then
+evaluates FP32 and INT8 on the remaining images and writes both, plus the
+INT8 - FP32 deltas, in the results/*.json schema.
+
+Usage:
+    python quantize.py --models distilled_b0,b0_aktp_tiny --calibration-size 1000
+"""
+
+import argparse
+import copy
+import os
+from typing import Dict
+
+import torch
+import torch.nn as nn
+
+import config
+from data import TinyImageNetVal, calibration_split, make_loader
+from evaluation import evaluate_accuracy, measure_latency, results_entry, results_delta, save_results
+from logs import setup_logging
+from model_registry import MODEL_CHECKPOINTS, resolve_checkpoint, inspect_and_load_architecture, get_model_size_mb
+
+# Names used for these models in results/comparison_results_all.json
+RESULT_NAMES = {
+    "baseline_b0_tiny": "Baseline B0 TinyImageNet",
+    "distilled_b0": "Vanilla Distilled B0",
+    "b0_aktp_tiny": "AKTP Distilled B0",
+}
+
+
+def quantize_static(model: nn.Module, calibration_loader, backend: str = "x86") -> nn.Module:
+    """
+    FX graph mode static post-training quantization (INT8 weights and activations).
+
+    Args:
+        model: FP32 model in eval mode
+        calibration_loader: Batches used to observe activation ranges
+        backend: Quantized engine ("x86"/"fbgemm" on servers, "qnnpack" on ARM)
+
+    Returns:
+        Quantized model
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    example = next(iter(calibration_loader))[0][:1]
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (example,))
+    with torch.no_grad():
+        for images, _ in calibration_loader:
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def quantize_dynamic(model: nn.Module) -> nn.Module:
+    """Dynamic quantization (INT8 Linear weights only; no calibration needed)."""
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model: nn.Module, path: str, image_size: int) -> torch.jit.ScriptModule:
+    """Trace, freeze and save ``model``; returns the graph reloaded from disk (as it will be served)."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(1, 3, image_size, image_size))
+        frozen = torch.jit.freeze(traced.eval())
+    torch.jit.save(frozen, path)
+    return torch.jit.load(path, map_location="cpu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization of the student models")
+    parser.add_argument("--models", default="distilled_b0,b0_aktp_tiny", help="Comma-separated MODEL_CHECKPOINTS keys")
+    parser.add_argument("--mode", choices=("static", "dynamic"), default="static")
+    parser.add_argument("--backend", default="x86", help="Quantized engine for static quantization")
+    parser.add_argument("--data-dir", default=None, help="TinyImageNet root (default: DATA_DIR/tiny-imagenet-200)")
+    parser.add_argument("--calibration-size", type=int, default=1000, help="Held-out validation images used to calibrate")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--latency-runs", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads for the latency measurement (0 = default)")
+    parser.add_argument("--output", default=os.path.join(config.RESULTS_DIR, "quantization_results.json"))
+    args = parser.parse_args()
+    setup_logging(fmt="text")
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    dataset = TinyImageNetVal(args.data_dir) if args.data_dir else TinyImageNetVal()
+    calibration_set, eval_set = calibration_split(dataset, args.calibration_size)
+    calibration_loader = make_loader(calibration_set, args.batch_size)
+    eval_loader = make_loader(eval_set, args.batch_size)
+    print(f"📊 {len(calibration_set)} calibration / {len(eval_set)} evaluation images")
+
+    input_shape = (1, 3, config.IMAGE_SIZE, config.IMAGE_SIZE)
+    results: Dict[str, dict] = {}
+    for model_key in [m.strip() for m in args.models.split(",") if m.strip()]:
+        int8_key = f"{model_key}_int8"
+        if model_key not in MODEL_CHECKPOINTS or int8_key not in MODEL_CHECKPOINTS:
+            print(f"⚠️ {model_key} has no FP32/INT8 pair in MODEL_CHECKPOINTS, skipping")
+            continue
+        rel_path, arch = MODEL_CHECKPOINTS[model_key]
+        checkpoint_path = resolve_checkpoint(rel_path)
+        if checkpoint_path is None:
+            print(f"⚠️ Could not find {model_key} checkpoint {rel_path}, skipping")
+            continue
+        fp32 = inspect_and_load_architecture(model_key, checkpoint_path, arch, config.NUM_CLASSES)
+        if fp32 is None:
+            continue
+
+        print(f"🔧 Quantizing {model_key} ({args.mode})...")
+        quantized = quantize_static(fp32, calibration_loader, args.backend) if args.mode == "static" else quantize_dynamic(fp32)
+        int8_path = os.path.join(os.path.dirname(checkpoint_path), os.path.basename(MODEL_CHECKPOINTS[int8_key][0]))
+        int8 = export_torchscript(quantized, int8_path, config.IMAGE_SIZE)
+        print(f"💾 Saved {int8_key} to {int8_path}")
+
+        name = RESULT_NAMES.get(model_key, model_key)
+        num_parameters = sum(p.numel() for p in fp32.parameters())
+        fp32_entry = results_entry(
+            name,
+            evaluate_accuracy(fp32, eval_loader, config.NUM_CLASSES),
+            num_parameters,
+            get_model_size_mb(fp32),
+            measure_latency(fp32, input_shape, args.latency_runs),
+        )
+        # Packed INT8 weights aren't parameters, so the exported file size is reported
+        int8_entry = results_entry(
+            f"{name} INT8",
+            evaluate_accuracy(int8, eval_loader, config.NUM_CLASSES),
+            num_parameters,
+            os.path.getsize(int8_path) / 1024 / 1024,
+            measure_latency(int8, input_shape, args.latency_runs),
+        )
+        results[name] = fp32_entry
+        results[f"{name} INT8"] = int8_entry
+        results[f"{name} INT8 delta"] = results_delta(f"{name} INT8 delta", int8_entry, fp32_entry)
+        print(
+            f"✅ {int8_key}: top1 {int8_entry['top1_accuracy']:.2f}% ({int8_entry['top1_accuracy'] - fp32_entry['top1_accuracy']:+.2f}), "
+            f"{int8_entry['size_mb']:.1f} MB ({fp32_entry['size_mb']:.1f}), "
+            f"{int8_entry['inference_time_ms']:.2f} ms ({fp32_entry['inference_time_ms']:.2f})"
+        )
+
+    if results:
+        save_results(args.output, results)
+        print(f"📝 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
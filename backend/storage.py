@@ -0,0 +1,418 @@
+"""
+Async data-access layer for users and prediction history
+
+Two interchangeable backends expose the same coroutine interface:
+``MongoStore`` (pymongo calls offloaded to a thread pool sized to the
+connection pool) and ``MemoryStore`` (the indexed in-memory mock used when
+no MONGO_URI is configured).
+"""
+
+import asyncio
+import base64
+import json
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from logs import get_logger
+
+try:
+    import pymongo
+    from bson import ObjectId
+except ImportError:
+    pymongo = None
+    ObjectId = str
+
+logger = get_logger("storage")
+
+
+def _parse_created_at(value):
+    """Mock users may carry ISO strings instead of datetimes."""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return value
+
+
+def encode_cursor(data: dict) -> str:
+    """Opaque, URL-safe pagination cursor."""
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Inverse of ``encode_cursor``; raises ``ValueError`` on malformed input."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    return data
+
+
+def _slice_results(entry: dict, top_k: int, result_keys: Optional[List[str]]) -> dict:
+    return {**entry, "result": {
+        key: entry["result"][key][:top_k]
+        for key in result_keys or [] if isinstance(entry["result"].get(key), list)
+    }}
+
+
+class MongoStore:
+    """
+    MongoDB backend. Every pymongo call runs on a dedicated thread pool so
+    the event loop never blocks on a DB round-trip.
+
+    Args:
+        db: pymongo ``Database`` handle
+        max_workers: Threads for DB calls (match the client's ``maxPoolSize``)
+    """
+
+    kind = "DB"
+
+    def __init__(self, db, max_workers: int = 16):
+        self.db = db
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="mongo")
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+
+    @staticmethod
+    def _with_id(doc: Optional[dict]) -> Optional[dict]:
+        if doc is not None:
+            doc["id"] = str(doc["_id"])
+        return doc
+
+    @staticmethod
+    def _user_filter(user: dict) -> dict:
+        if "_id" in user:
+            return {"_id": user["_id"]}
+        return {"_id": ObjectId(user["id"])}
+
+    # --- indexes ---
+    async def ensure_indexes(self, unverified_ttl_s: Optional[int] = None) -> bool:
+        """
+        Create the indexes backing every query the API issues (idempotent).
+
+        Args:
+            unverified_ttl_s: If set, a partial TTL index on ``created_at`` lets
+                MongoDB itself expire unverified accounts after this many seconds
+
+        Returns:
+            Whether the TTL index is in place (the periodic cleanup can then be skipped)
+        """
+        has_string = lambda field: {field: {"$type": "string"}}
+        specs = [
+            (self.db.users, [("email", pymongo.ASCENDING)], {"name": "email_unique", "unique": True}),
+            # Tokens are None once used, so only index live ones
+            (self.db.users, [("verification_token", pymongo.ASCENDING)],
+             {"name": "verification_token", "partialFilterExpression": has_string("verification_token")}),
+            (self.db.users, [("reset_token", pymongo.ASCENDING)],
+             {"name": "reset_token", "partialFilterExpression": has_string("reset_token")}),
+            # Matches the (timestamp, _id) keyset used for pagination
+            (self.db.history, [("user_id", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+             {"name": "user_timeline"}),
+        ]
+        if unverified_ttl_s:
+            # Also serves the {is_verified: False, created_at: {$lt: ...}} cleanup query
+            specs.append((self.db.users, [("created_at", pymongo.ASCENDING)], {
+                "name": "unverified_ttl",
+                "expireAfterSeconds": int(unverified_ttl_s),
+                "partialFilterExpression": {"is_verified": False},
+            }))
+
+        ttl_ready = False
+        for collection, keys, options in specs:
+            try:
+                await self._run(collection.create_index, keys, **options)
+                if options["name"] == "unverified_ttl":
+                    ttl_ready = True
+            except Exception as e:
+                logger.warning("⚠️ Could not create index %s.%s: %s", collection.name, options["name"], e)
+        return ttl_ready
+
+    # --- users ---
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        return self._with_id(await self._run(self.db.users.find_one, {"email": email}))
+
+    async def get_user_by_verification_token(self, token: str) -> Optional[dict]:
+        return self._with_id(await self._run(self.db.users.find_one, {"verification_token": token}))
+
+    async def get_user_by_reset_token(self, token: str) -> Optional[dict]:
+        return self._with_id(await self._run(self.db.users.find_one, {"reset_token": token}))
+
+    async def create_user(self, user: dict) -> dict:
+        res = await self._run(self.db.users.insert_one, user)
+        user["id"] = str(res.inserted_id)
+        return user
+
+    async def update_user(self, user: dict, fields: dict):
+        await self._run(self.db.users.update_one, self._user_filter(user), {"$set": fields})
+
+    async def delete_user(self, user: dict):
+        await self._run(self.db.users.delete_one, self._user_filter(user))
+
+    async def delete_unverified_before(self, cutoff: datetime) -> int:
+        result = await self._run(self.db.users.delete_many, {
+            "is_verified": False,
+            "created_at": {"$lt": cutoff}
+        })
+        return result.deleted_count
+
+    # --- history ---
+    async def add_history(self, entry: dict) -> dict:
+        await self._run(self.db.history.insert_one, entry)
+        return entry
+
+    async def add_history_many(self, entries: List[dict]) -> List[dict]:
+        """Insert many entries in a single round-trip."""
+        if entries:
+            await self._run(self.db.history.insert_many, entries, ordered=False)
+        return entries
+
+    async def set_history_image(self, entry: dict, image_url: str):
+        await self._run(self.db.history.update_one, {"_id": entry["_id"]}, {"$set": {"image_url": image_url}})
+
+    async def page_history(
+        self,
+        user_id: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        top_k: Optional[int] = None,
+        result_keys: Optional[List[str]] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One newest-first page of a user's history plus the cursor of the next page.
+
+        Pages are keyset-paginated on (timestamp, _id), so every page is an
+        index range scan no matter how deep the client has paged. With
+        ``top_k`` the server only returns the first ``top_k`` predictions of
+        each model in ``result_keys``, so large ``result`` payloads never
+        leave MongoDB.
+        """
+        query = {"user_id": user_id}
+        if cursor:
+            position = decode_cursor(cursor)
+            try:
+                ts, oid = datetime.fromisoformat(position["t"]), ObjectId(position["id"])
+            except Exception as e:
+                raise ValueError("Invalid cursor") from e
+            query["$or"] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": oid}}]
+
+        projection = None
+        if top_k is not None:
+            projection = {"user_id": 1, "image_url": 1, "timestamp": 1}
+            for key in result_keys or []:
+                projection[f"result.{key}"] = {"$slice": top_k}
+
+        def _fetch():
+            docs = list(
+                self.db.history.find(query, projection)
+                .sort([("timestamp", -1), ("_id", -1)])
+                .limit(limit + 1)
+            )
+            next_cursor = None
+            if len(docs) > limit:
+                docs = docs[:limit]
+                last = docs[-1]
+                next_cursor = encode_cursor({"t": last["timestamp"].isoformat(), "id": str(last["_id"])})
+            return [self._serialize_history(doc) for doc in docs], next_cursor
+        return await self._run(_fetch)
+
+    async def list_history(self, user_id: str, limit: int = 20, **kwargs) -> List[dict]:
+        return (await self.page_history(user_id, limit, **kwargs))[0]
+
+    async def iter_history(self, user_id: str, batch_size: int = 500) -> AsyncIterator[dict]:
+        """Stream a user's whole history, holding at most one batch in memory."""
+        cursor = (
+            self.db.history.find({"user_id": user_id})
+            .sort([("timestamp", -1), ("_id", -1)])
+            .batch_size(batch_size)
+        )
+        try:
+            while True:
+                docs = await self._run(lambda: list(islice(cursor, batch_size)))
+                if not docs:
+                    break
+                for doc in docs:
+                    yield self._serialize_history(doc)
+        finally:
+            await self._run(cursor.close)
+
+    @staticmethod
+    def _serialize_history(doc: dict) -> dict:
+        doc["id"] = str(doc["_id"])
+        doc.pop("_id")
+        if "user_id" in doc: doc["user_id"] = str(doc["user_id"])
+        if isinstance(doc["timestamp"], datetime):
+            doc["timestamp"] = doc["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+        return doc
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+class MemoryStore:
+    """
+    In-memory mock backend, indexed so token lookups and history inserts
+    don't degrade as users and history accumulate.
+
+    Users live in the ``MOCK_USERS`` dict (keyed by email) with secondary
+    indexes on verification and reset tokens. History is kept per user in
+    newest-first deques capped at ``history_retention`` entries.
+
+    Args:
+        users: Users keyed by email
+        history: Per-user deques of ``(seq, entry)`` keyed by user id
+        history_retention: Maximum entries kept per user (oldest dropped first)
+    """
+
+    kind = "MOCK"
+    _TOKEN_FIELDS = ("verification_token", "reset_token")
+
+    def __init__(self, users: Dict[str, dict], history: Dict[str, Deque[Tuple[int, dict]]], history_retention: int = 500):
+        self.users = users
+        self.history = history
+        self.history_retention = max(1, int(history_retention))
+        self._by_token: Dict[str, Dict[str, str]] = {field: {} for field in self._TOKEN_FIELDS}
+        self._unverified = set()
+        self._seq = 0
+        for user in self.users.values():
+            self._index(user)
+
+    # --- index maintenance ---
+    def _index(self, user: dict):
+        for field, index in self._by_token.items():
+            if user.get(field):
+                index[user[field]] = user["email"]
+        if not user.get("is_verified", False):
+            self._unverified.add(user["email"])
+        else:
+            self._unverified.discard(user["email"])
+
+    def _unindex(self, user: dict):
+        for field, index in self._by_token.items():
+            if user.get(field):
+                index.pop(user[field], None)
+        self._unverified.discard(user["email"])
+
+    def _lookup_token(self, field: str, token: str) -> Optional[dict]:
+        email = self._by_token[field].get(token)
+        return self.users.get(email) if email else None
+
+    async def ensure_indexes(self, unverified_ttl_s: Optional[int] = None) -> bool:
+        # Indexes are maintained incrementally; there is no TTL support
+        return False
+
+    # --- users ---
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        return self.users.get(email)
+
+    async def get_user_by_verification_token(self, token: str) -> Optional[dict]:
+        return self._lookup_token("verification_token", token)
+
+    async def get_user_by_reset_token(self, token: str) -> Optional[dict]:
+        return self._lookup_token("reset_token", token)
+
+    async def create_user(self, user: dict) -> dict:
+        user["id"] = str(uuid.uuid4())
+        self.users[user["email"]] = user
+        self._index(user)
+        return user
+
+    async def update_user(self, user: dict, fields: dict):
+        stored = self.users.get(user["email"])
+        if stored is None:
+            return
+        self._unindex(stored)
+        stored.update(fields)
+        self._index(stored)
+
+    async def delete_user(self, user: dict):
+        stored = self.users.pop(user["email"], None)
+        if stored is not None:
+            self._unindex(stored)
+
+    async def delete_unverified_before(self, cutoff: datetime) -> int:
+        # Only unverified users are candidates, so verified accounts are never scanned
+        to_delete = []
+        for email in self._unverified:
+            created_at = _parse_created_at(self.users[email].get("created_at"))
+            if created_at and created_at < cutoff:
+                to_delete.append(email)
+        for email in to_delete:
+            await self.delete_user(self.users[email])
+        return len(to_delete)
+
+    # --- history ---
+    async def add_history(self, entry: dict) -> dict:
+        entry["id"] = str(uuid.uuid4())
+        entry["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        user_history = self.history.get(entry["user_id"])
+        if user_history is None:
+            user_history = self.history[entry["user_id"]] = deque(maxlen=self.history_retention)
+        # Sequence numbers give a stable keyset even when timestamps tie
+        self._seq += 1
+        user_history.appendleft((self._seq, entry))
+        return entry
+
+    async def add_history_many(self, entries: List[dict]) -> List[dict]:
+        for entry in entries:
+            await self.add_history(entry)
+        return entries
+
+    async def set_history_image(self, entry: dict, image_url: str):
+        entry["image_url"] = image_url
+
+    async def page_history(
+        self,
+        user_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        top_k: Optional[int] = None,
+        result_keys: Optional[List[str]] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        user_history = self.history.get(user_id, ())
+        start = 0
+        if cursor:
+            after = decode_cursor(cursor).get("seq")
+            if not isinstance(after, int):
+                raise ValueError("Invalid cursor")
+            # Sequence numbers decrease along the deque: binary search the first older entry
+            lo, hi = 0, len(user_history)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if user_history[mid][0] >= after:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = lo
+
+        stop = start + limit if limit else None
+        page = list(islice(user_history, start, stop))
+        next_cursor = None
+        if stop is not None and stop < len(user_history) and page:
+            next_cursor = encode_cursor({"seq": page[-1][0]})
+
+        entries = [entry for _, entry in page]
+        if top_k is not None:
+            entries = [_slice_results(entry, top_k, result_keys) for entry in entries]
+        return entries, next_cursor
+
+    async def list_history(self, user_id: str, limit: Optional[int] = None, **kwargs) -> List[dict]:
+        return (await self.page_history(user_id, limit, **kwargs))[0]
+
+    async def iter_history(self, user_id: str, batch_size: int = 500) -> AsyncIterator[dict]:
+        # Snapshot so concurrent inserts can't break iteration
+        for _, entry in list(self.history.get(user_id, ())):
+            yield entry
+
+    def close(self):
+        pass
@@ -0,0 +1,151 @@
+"""
+Memory-mapped float16 store of precomputed teacher logits for distillation training
+"""
+
+import json
+import os
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+IndexLike = Union[np.ndarray, torch.Tensor, Sequence[int]]
+
+
+class TeacherLogitStore:
+    """
+    Teacher logits per (augmentation view, image), float16 on disk and memory-mapped.
+
+    Files in ``root``:
+        meta.json     shapes, teachers and the dataset fingerprint
+        values.f16    [views, images, K]: full logits (K = classes) or the top-k
+        indices.i16   [views, images, k]: class ids of the top-k (top-k stores only)
+        lse.f32       [views, images]: logsumexp of the full logits (top-k stores only)
+        done.u8       [views, images]: rows written, so an interrupted precompute resumes
+
+    A top-k store is read back as full logits. The probability mass outside
+    the top-k is spread evenly over the other classes, which keeps the
+    teacher's softmax close to the original at any temperature.
+
+    Args:
+        root: Store directory (created by ``TeacherLogitStore.create``)
+        mode: "r" to read, "r+" to write
+    """
+
+    META = "meta.json"
+
+    def __init__(self, root: str, mode: str = "r"):
+        self.root = root
+        with open(os.path.join(root, self.META)) as f:
+            self.meta = json.load(f)
+        self.num_views = self.meta["num_views"]
+        self.num_images = self.meta["num_images"]
+        self.num_classes = self.meta["num_classes"]
+        self.top_k = self.meta["top_k"]
+        width = self.top_k or self.num_classes
+
+        shape = (self.num_views, self.num_images)
+        self.values = np.memmap(os.path.join(root, "values.f16"), np.float16, mode, shape=shape + (width,))
+        self.done = np.memmap(os.path.join(root, "done.u8"), np.uint8, mode, shape=shape)
+        self.indices = self.lse = None
+        if self.top_k:
+            self.indices = np.memmap(os.path.join(root, "indices.i16"), np.int16, mode, shape=shape + (self.top_k,))
+            self.lse = np.memmap(os.path.join(root, "lse.f32"), np.float32, mode, shape=shape)
+
+    @classmethod
+    def create(
+        cls,
+        root: str,
+        num_images: int,
+        num_views: int,
+        num_classes: int,
+        top_k: int = 0,
+        **meta
+    ) -> "TeacherLogitStore":
+        """
+        Create an empty store, or reopen an existing one with the same shape (to resume).
+
+        Args:
+            root: Store directory
+            num_images: Images in the dataset
+            num_views: Augmentation views per image
+            num_classes: Teacher output size
+            top_k: Logits kept per row (0 = all)
+            **meta: Extra fields for meta.json (teachers, seed, dataset fingerprint, ...)
+
+        Returns:
+            The store, opened for writing
+        """
+        top_k = 0 if not top_k or top_k >= num_classes else int(top_k)
+        settings = {"num_images": num_images, "num_views": num_views, "num_classes": num_classes, "top_k": top_k}
+        meta_path = os.path.join(root, cls.META)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+            mismatched = {k: (existing.get(k), v) for k, v in {**settings, **meta}.items() if existing.get(k) != v}
+            if mismatched:
+                raise ValueError(f"{root} holds a different store (existing, requested): {mismatched}")
+            return cls(root, "r+")
+
+        os.makedirs(root, exist_ok=True)
+        shape = (num_views, num_images)
+        np.memmap(os.path.join(root, "values.f16"), np.float16, "w+", shape=shape + (top_k or num_classes,)).flush()
+        np.memmap(os.path.join(root, "done.u8"), np.uint8, "w+", shape=shape).flush()
+        if top_k:
+            np.memmap(os.path.join(root, "indices.i16"), np.int16, "w+", shape=shape + (top_k,)).flush()
+            np.memmap(os.path.join(root, "lse.f32"), np.float32, "w+", shape=shape).flush()
+        with open(meta_path, "w") as f:
+            json.dump({**settings, **meta}, f, indent=2)
+        return cls(root, "r+")
+
+    def missing(self, view: int) -> np.ndarray:
+        """Image indices of ``view`` not written yet."""
+        return np.flatnonzero(self.done[view] == 0)
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.done.all())
+
+    def write(self, view: int, indices: IndexLike, logits: torch.Tensor):
+        """Store teacher ``logits`` [B, C] for images ``indices`` of ``view``."""
+        rows = np.asarray(indices, dtype=np.int64)
+        logits = logits.detach().float()
+        if self.top_k:
+            top_values, top_indices = logits.topk(self.top_k, dim=1)
+            self.values[view, rows] = top_values.cpu().numpy().astype(np.float16)
+            self.indices[view, rows] = top_indices.cpu().numpy().astype(np.int16)
+            self.lse[view, rows] = torch.logsumexp(logits, dim=1).cpu().numpy()
+        else:
+            self.values[view, rows] = logits.cpu().numpy().astype(np.float16)
+        self.done[view, rows] = 1
+
+    def read(self, view: int, indices: IndexLike) -> torch.Tensor:
+        """Teacher logits [B, C] (float32) for images ``indices`` of ``view``."""
+        rows = np.asarray(indices, dtype=np.int64)
+        values = torch.from_numpy(self.values[view, rows].astype(np.float32))
+        if not self.top_k:
+            return values
+        lse = torch.from_numpy(self.lse[view, rows].astype(np.float32))
+        kept_mass = torch.exp(values - lse[:, None]).sum(dim=1)
+        rest = (1 - kept_mass).clamp_min(1e-8) / (self.num_classes - self.top_k)
+        logits = (lse + torch.log(rest))[:, None].repeat(1, self.num_classes)
+        logits.scatter_(1, torch.from_numpy(self.indices[view, rows].astype(np.int64)), values)
+        return logits
+
+    def flush(self):
+        for array in (self.values, self.done, self.indices, self.lse):
+            if array is not None:
+                array.flush()
+
+    def size_mb(self) -> float:
+        arrays = (self.values, self.done, self.indices, self.lse)
+        return sum(a.nbytes for a in arrays if a is not None) / 1024 / 1024
+
+    def check(self, num_images: int, fingerprint: Optional[str] = None):
+        """Raise ``ValueError`` unless the store covers this dataset and every row is written."""
+        if num_images != self.num_images:
+            raise ValueError(f"Store has {self.num_images} images, dataset has {num_images}")
+        if fingerprint is not None and self.meta.get("dataset_fingerprint") not in (None, fingerprint):
+            raise ValueError("Store was built from a different training set (fingerprint mismatch)")
+        if not self.complete:
+            raise ValueError(f"Store is incomplete ({int(self.done.sum())}/{self.done.size} rows); rerun the precompute")
@@ -0,0 +1,188 @@
+"""
+Knowledge distillation of the student from precomputed teacher logits
+
+Teacher outputs come from a TeacherLogitStore written by
+precompute_teacher_logits.py. No teacher is loaded or run here, so a step
+costs one student forward/backward and the teacher takes no VRAM. Epoch ``e``
+trains on augmentation view ``e % views``, i.e. on exactly the images the
+stored logits were computed for.
+
+Usage:
+    python train_distillation.py --teacher-cache checkpoints/teacher_logits/teacher_b2_tiny
+"""
+
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+import config
+from data import TinyImageNetTrain, TinyImageNetVal, AugmentedViews, TRAIN_TRANSFORM, make_loader
+from logs import setup_logging
+from models import DistillationLoss, get_efficientnet, count_parameters
+from teacher_cache import TeacherLogitStore
+
+
+def build_scheduler(optimizer: torch.optim.Optimizer, epochs: int):
+    if config.LR_SCHEDULER == "step":
+        return torch.optim.lr_scheduler.StepLR(optimizer, config.LR_STEP_SIZE, config.LR_GAMMA)
+    if config.LR_SCHEDULER == "plateau":
+        return torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="max", factor=config.LR_GAMMA)
+    return torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+
+def train_epoch(
+    student: nn.Module,
+    loader: DataLoader,
+    store: TeacherLogitStore,
+    view: int,
+    criterion: DistillationLoss,
+    optimizer: torch.optim.Optimizer,
+    scaler: torch.amp.GradScaler,
+    device: torch.device
+) -> dict:
+    """
+    One epoch over augmentation ``view``, with teacher logits read from ``store``.
+
+    Returns:
+        Mean total/soft/hard loss and top-1 accuracy (percent)
+    """
+    student.train()
+    totals = {"loss": 0.0, "soft_loss": 0.0, "hard_loss": 0.0}
+    correct, seen = 0, 0
+    for step, (images, labels, indices) in enumerate(loader):
+        images = images.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+        teacher_logits = store.read(view, indices).to(device, non_blocking=True)
+
+        with torch.autocast(device.type, enabled=scaler.is_enabled()):
+            student_logits = student(images)
+        loss, soft_loss, hard_loss = criterion(student_logits.float(), teacher_logits, labels)
+
+        optimizer.zero_grad(set_to_none=True)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+
+        batch = labels.shape[0]
+        totals["loss"] += loss.item() * batch
+        totals["soft_loss"] += soft_loss.item() * batch
+        totals["hard_loss"] += hard_loss.item() * batch
+        correct += (student_logits.argmax(dim=1) == labels).sum().item()
+        seen += batch
+        if (step + 1) % config.LOG_INTERVAL == 0:
+            print(f"  step {step + 1}/{len(loader)}: loss {totals['loss'] / seen:.4f}, acc@1 {100.0 * correct / seen:.2f}%")
+    return {**{k: v / max(seen, 1) for k, v in totals.items()}, "acc": 100.0 * correct / max(seen, 1)}
+
+
+def validate(student: nn.Module, loader: DataLoader, device: torch.device) -> dict:
+    student.eval()
+    ce_loss = nn.CrossEntropyLoss(reduction="sum")
+    loss, correct, seen = 0.0, 0, 0
+    with torch.inference_mode():
+        for images, labels in loader:
+            images, labels = images.to(device), labels.to(device)
+            logits = student(images)
+            loss += ce_loss(logits, labels).item()
+            correct += (logits.argmax(dim=1) == labels).sum().item()
+            seen += labels.shape[0]
+    return {"loss": loss / max(seen, 1), "acc": 100.0 * correct / max(seen, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the student from precomputed teacher logits")
+    parser.add_argument("--teacher-cache", required=True, help="Store written by precompute_teacher_logits.py")
+    parser.add_argument("--data-dir", default=None, help="TinyImageNet root (default: DATA_DIR/tiny-imagenet-200)")
+    parser.add_argument("--epochs", type=int, default=config.NUM_EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=config.BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--from-scratch", action="store_true", help="Don't start from ImageNet weights")
+    parser.add_argument("--output-dir", default=os.path.join(config.CHECKPOINT_DIR, "distilled_b0"))
+    parser.add_argument("--history", default=os.path.join(config.RESULTS_DIR, "distillation_history.json"))
+    parser.add_argument("--device", default=config.DEVICE)
+    args = parser.parse_args()
+    setup_logging(fmt="text")
+
+    device = torch.device(args.device)
+    torch.manual_seed(config.SEED)
+
+    store = TeacherLogitStore(args.teacher_cache)
+    root_kwargs = {"root": args.data_dir} if args.data_dir else {}
+    train_set = TinyImageNetTrain(transform=None, **root_kwargs)
+    store.check(len(train_set), train_set.fingerprint())
+    views = AugmentedViews(train_set, TRAIN_TRANSFORM, store.num_views, seed=store.meta.get("seed", config.SEED))
+    val_loader = make_loader(TinyImageNetVal(**root_kwargs), args.batch_size, args.num_workers)
+    print(f"📦 Teacher logits: {store.meta.get('teachers')} ({store.num_views} views, "
+          f"{'top-' + str(store.top_k) if store.top_k else 'full'}, {store.size_mb():.1f} MB)")
+
+    student = get_efficientnet(
+        config.STUDENT_MODEL, config.NUM_CLASSES, pretrained=config.USE_PRETRAINED_STUDENT and not args.from_scratch
+    ).to(device)
+    print(f"Student parameters: {count_parameters(student):,} (trainable)")
+    criterion = DistillationLoss(config.TEMPERATURE, config.ALPHA)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=config.LEARNING_RATE, weight_decay=config.WEIGHT_DECAY)
+    scheduler = build_scheduler(optimizer, args.epochs)
+    scaler = torch.amp.GradScaler(device.type, enabled=device.type == "cuda")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    history = {k: [] for k in ("train_loss", "train_acc", "val_loss", "val_acc", "soft_loss", "hard_loss", "learning_rate")}
+    best_acc, stale_epochs = 0.0, 0
+    started = time.perf_counter()
+    for epoch in range(args.epochs):
+        view = epoch % store.num_views
+        views.set_view(view)
+        loader = DataLoader(
+            views, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+            pin_memory=device.type == "cuda", drop_last=True,
+        )
+        epoch_started = time.perf_counter()
+        train = train_epoch(student, loader, store, view, criterion, optimizer, scaler, device)
+        val = validate(student, val_loader, device)
+        learning_rate = optimizer.param_groups[0]["lr"]
+        if isinstance(scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
+            scheduler.step(val["acc"])
+        else:
+            scheduler.step()
+
+        for key, value in (
+            ("train_loss", train["loss"]), ("train_acc", train["acc"]), ("val_loss", val["loss"]),
+            ("val_acc", val["acc"]), ("soft_loss", train["soft_loss"]), ("hard_loss", train["hard_loss"]),
+            ("learning_rate", learning_rate),
+        ):
+            history[key].append(value)
+        print(
+            f"Epoch {epoch + 1}/{args.epochs} (view {view}, {time.perf_counter() - epoch_started:.1f}s): "
+            f"train loss {train['loss']:.4f}, acc {train['acc']:.2f}% | val loss {val['loss']:.4f}, acc {val['acc']:.2f}%"
+        )
+
+        checkpoint = {
+            "epoch": epoch + 1,
+            "model_state_dict": student.state_dict(),
+            "optimizer_state_dict": optimizer.state_dict(),
+            "val_acc": val["acc"],
+        }
+        torch.save(checkpoint, os.path.join(args.output_dir, "latest_model.pth"))
+        if val["acc"] > best_acc:
+            best_acc, stale_epochs = val["acc"], 0
+            torch.save(checkpoint, os.path.join(args.output_dir, "best_model.pth"))
+            print(f"  New best validation accuracy: {best_acc:.2f}%")
+        else:
+            stale_epochs += 1
+            if stale_epochs >= config.EARLY_STOPPING_PATIENCE:
+                print(f"Early stopping triggered at epoch {epoch + 1}")
+                break
+
+    print(f"Training completed in {(time.perf_counter() - started) / 60:.2f} minutes")
+    print(f"Best validation accuracy: {best_acc:.2f}%")
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=2)
+    print(f"Training history saved to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
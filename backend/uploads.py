@@ -0,0 +1,142 @@
+"""
+Image upload backends and a bounded, retrying upload queue
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+
+from logs import get_logger
+from metrics import histogram
+
+try:
+    import cloudinary.uploader
+except ImportError:
+    cloudinary = None
+
+logger = get_logger("uploads")
+
+UPLOAD_SECONDS = histogram(
+    "deepdistill_upload_seconds", "Upload attempt duration, including the wait for a slot", ("backend", "outcome")
+)
+
+
+class CloudinaryUploader:
+    """Uploads to Cloudinary (blocking; meant to run in a worker thread)."""
+
+    name = "cloudinary"
+
+    def upload(self, data: bytes, folder: str) -> Optional[str]:
+        result = cloudinary.uploader.upload(data, folder=folder)
+        return result.get("secure_url")
+
+
+class LocalUploader:
+    """
+    Local stand-in for Cloudinary, for offline development and benchmarks.
+
+    Files are written content-addressed under ``root_dir/<folder>/`` and the
+    returned URL is ``base_url/<folder>/<sha256>``. ``latency_ms`` adds an
+    artificial delay to mimic the network round-trip of a real upload.
+
+    Args:
+        root_dir: Directory the files are written to
+        base_url: URL prefix the directory is served under
+        latency_ms: Simulated upload latency in milliseconds
+    """
+
+    name = "local"
+
+    def __init__(self, root_dir: str, base_url: str = "/uploads", latency_ms: float = 0.0):
+        self.root_dir = root_dir
+        self.base_url = base_url.rstrip("/")
+        self.latency_ms = latency_ms
+
+    def upload(self, data: bytes, folder: str) -> Optional[str]:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+        name = hashlib.sha256(data).hexdigest()
+        target_dir = os.path.join(self.root_dir, folder)
+        os.makedirs(target_dir, exist_ok=True)
+        path = os.path.join(target_dir, name)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(data)
+        return f"{self.base_url}/{folder}/{name}"
+
+
+class UploadQueue:
+    """
+    Runs uploads in the background with bounded concurrency and retries.
+
+    ``submit`` returns immediately with an ``asyncio.Task`` resolving to the
+    uploaded URL, or ``None`` once every attempt has failed, so callers can
+    overlap uploads with other work and decide how long to wait for them.
+
+    Args:
+        uploader: Backend with a blocking ``upload(data, folder)`` method
+            (``None`` disables uploads; every task then resolves to ``None``)
+        max_concurrency: Maximum number of uploads in flight
+        max_retries: Attempts after the first failure
+        backoff_s: Initial retry delay, doubled after each failure
+    """
+
+    def __init__(self, uploader=None, max_concurrency: int = 4, max_retries: int = 2, backoff_s: float = 0.5):
+        self.uploader = uploader
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_s = backoff_s
+        self._semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+        self._tasks = set()
+
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.uploader is not None
+
+    def submit(self, data: bytes, folder: str) -> asyncio.Task:
+        task = asyncio.create_task(self._upload(data, folder))
+        # Keep a reference so fire-and-forget uploads aren't garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _upload(self, data: bytes, folder: str) -> Optional[str]:
+        if self.uploader is None:
+            return None
+        delay = self.backoff_s
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    url = await asyncio.to_thread(self.uploader.upload, data, folder)
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, backend=self.uploader.name, outcome="ok")
+                self.uploaded += 1
+                return url
+            except Exception as e:
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, backend=self.uploader.name, outcome="error")
+                if attempt == self.max_retries:
+                    logger.warning("⚠️ %s upload failed after %d attempts: %s", self.uploader.name, attempt + 1, e)
+                    self.failed += 1
+                    return None
+                self.retries += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.uploader.name if self.uploader is not None else None,
+            "pending": len(self._tasks),
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait for in-flight uploads (used on shutdown)."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)